@@ -1,12 +1,9 @@
 import streamlit as st
-from PyPDF2 import PdfReader
-import os, re, io
-import tempfile
+import os
+import asyncio
 from dotenv import load_dotenv
-from pdf2image import convert_from_path
-import fitz
 from collections import OrderedDict
-from my_rag import RAG
+from my_rag import RAG, DEFAULT_COLLECTION
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,9 +16,21 @@ chunk_overlap = 25 # default
 top_k = 3 # number of chunks found in semantic search
 DBPATH = 'data/db_file.db'
 model = 'all-MiniLM-L6-v2'
+reranker_model = None # e.g. 'cross-encoder/ms-marco-MiniLM-L-6-v2' to rerank 20 candidates down to top_k
+ALL_COLLECTIONS = 'All collections' # selector entry searching every collection
 
-# instantiate RAG class
-st_rag = RAG(db_path = DBPATH, llm_api_key=OPENAI_API_KEY, embedding_model=model, chunk_size = chunk_size, overlap=chunk_overlap, top_k = top_k)
+# instantiate RAG class once per process; the instance is thread-safe and shared by
+# every session and rerun, so the model, index and connections are loaded only once
+@st.cache_resource
+def get_rag():
+    rag = RAG(db_path = DBPATH, llm_api_key=OPENAI_API_KEY, embedding_model=model, chunk_size = chunk_size, overlap=chunk_overlap, top_k = top_k, persist_cache=True, pdf_dir=pdf_storage_dir, reranker_model=reranker_model)
+    # The page renders right away while the embedding model loads in the background
+    rag.warm_up()
+    return rag
+
+# Must be the first Streamlit command; loading the RAG on a cache miss shows a spinner
+st.set_page_config(page_title="Chat with Docs", layout="wide")
+st_rag = get_rag()
 
 
 # Get the image of the source page
@@ -29,16 +38,8 @@ def get_page_image(pdf_filename, page_number):
     pdf_path = os.path.join(pdf_storage_dir, pdf_filename)
     
     try:
-        pdf = fitz.open(pdf_path)
-        page = pdf.load_page(page_number)
-
-        # Convert the page to an image
-        page_image = page.get_pixmap()
-
-        # Get image data in PNG format and write to BytesIO
-        image_bytes = io.BytesIO(page_image.tobytes("png"))
-        
-        return image_bytes
+        # Rendered pages are cached, and usually pre-rendered while the answer streams
+        return st_rag.get_page_image(pdf_path, page_number)
     except Exception as e:
         st.error(f"Error loading page image: {e}")
         return None
@@ -47,12 +48,33 @@ def get_page_image(pdf_filename, page_number):
 # Clear the conversation, removing the history
 def clear_conversation():
     st.session_state['conversation_history'] = []
+    st.session_state['conversation'] = st_rag.new_conversation()
     st.session_state['new_query'] = ''
     st.rerun()
 
+# Sidebar panel of the pipeline metrics
+def show_metrics():
+    """
+    Shows the latency of every pipeline stage and the throughput counters.
+    """
+    snapshot = st_rag.metrics.snapshot()
+    if not snapshot['stages']:
+        st.caption("No requests measured yet.")
+        return
+    st.dataframe([{'stage': stage, 'calls': values['count'], 'p50 ms': round(values['p50_ms'], 1),
+                   'p95 ms': round(values['p95_ms'], 1), 'max ms': round(values['max_ms'], 1)}
+                  for stage, values in snapshot['stages'].items()], hide_index=True)
+    counters = snapshot['counters']
+    rates = ' · '.join(f"{rate.replace('_per_s', '')}/s {value:.0f}" for rate, value in snapshot['rates'].items())
+    st.caption(f"{rates} · cache hits {counters.get('cache_hits', 0)}/{counters.get('cache_hits', 0) + counters.get('cache_misses', 0)}"
+               f" · LLM tokens {counters.get('llm_prompt_tokens', 0)} in, {counters.get('llm_completion_tokens', 0)} out")
+
+# Refresh the panel on its own every few seconds where Streamlit supports fragments
+if hasattr(st, 'fragment'):
+    show_metrics = st.fragment(run_every=5)(show_metrics)
+
 # Main UI function
 def run_UI():
-    st.set_page_config(page_title="Chat with Docs", layout="wide")
     st.header("Chat with Docs: Interact with Your Documents")
     st.write("This app will allow you to interact with the documents in the database. If you have not already done so, please add documents using the sidebar panel.")
 
@@ -62,6 +84,16 @@ def run_UI():
     # 'query', 'rag_response', 'llm_response', 'source_pages'   
     if 'conversation_history' not in st.session_state:
         st.session_state['conversation_history'] = []
+    # Recent turns and a rolling summary of older ones, used for the prompts
+    if 'conversation' not in st.session_state:
+        st.session_state['conversation'] = st_rag.new_conversation()
+
+    # Collection the questions are answered from, at the top of the sidebar
+    with st.sidebar:
+        st.subheader("Collection")
+        collections = [collection['collection'] for collection in st_rag.list_collections()]
+        collection = st.selectbox("Search in", [ALL_COLLECTIONS] + collections, key='collection')
+        search_filters = {'collection': collection} if collection != ALL_COLLECTIONS else None
 
 
     # Clear conversation button
@@ -77,10 +109,17 @@ def run_UI():
             st.text_area(f"RAG Response {i+1}", value=convo['rag_response'], height=250, disabled=True)
         with col2:
             st.text_area(f"LLM Response {i+1}", value=convo['llm_response'], height=250, disabled=True)
+        if convo.get('timings'):
+            st.caption(' | '.join(f"{stage[:-3]} {ms:.0f} ms" for stage, ms in convo['timings'].items()))
         
         # Show source page buttons
         for j, (pdf_filename, page_number) in enumerate(convo['source_pages']):
-            if st.button(f"Show source for Q{i+1} - File {pdf_filename} - Page {page_number + 1}", key=f'source_button_{i}_{j}'):
+            thumb_col, button_col = st.columns([1, 8])
+            try:
+                thumb_col.image(st_rag.renderer.thumbnail(os.path.join(pdf_storage_dir, pdf_filename), page_number))
+            except Exception:
+                pass
+            if button_col.button(f"Show source for Q{i+1} - File {pdf_filename} - Page {page_number + 1}", key=f'source_button_{i}_{j}'):
                 image_bytes = get_page_image(pdf_filename, page_number)
                 st.image(image_bytes, caption=f"Source: {pdf_filename} (Page {page_number + 1})")
 
@@ -92,26 +131,36 @@ def run_UI():
 
     # On submitting a new query
     if st.button("Submit") and new_query:
-        # Concatenate previous conversation with new query
-        full_conversation = '\n'.join([item['query'] + '\n' + item['rag_response'] for item in st.session_state['conversation_history']])
-        full_conversation += '\nQ: ' + new_query
+        conversation = st.session_state['conversation']
 
-        # Generate responses
-        rag_response = 'A: ' + st_rag.generate_response(full_conversation)
-        llm_response = 'A: ' + st_rag.integrate_llm(full_conversation)
-        #print(full_conversation)
+        # Generate both responses concurrently, streaming tokens as they arrive; the plain
+        # answer starts while the RAG answer retrieves, and the source pages use the same retrieval
+        col1, col2 = st.columns(2)
+        rag_placeholder = col1.empty()
+        llm_placeholder = col2.empty()
+        retrieval = {}
+        rag_text, llm_text = asyncio.run(st_rag.answer_concurrently(
+            new_query,
+            on_rag_token=lambda text: rag_placeholder.markdown('A: ' + text),
+            on_llm_token=lambda text: llm_placeholder.markdown('A: ' + text),
+            timeout=120,
+            conversation=conversation,
+            filters=search_filters,
+            on_retrieval=retrieval.update))
+        rag_response = 'A: ' + (rag_text or '')
+        llm_response = 'A: ' + (llm_text or '')
+        st_rag.record_turn(conversation, new_query, rag_text)
 
         # Get info for the source page display
-        chunk_ids = st_rag.semantic_search(new_query)
-        best_chunks_and_references = st_rag.get_chunks_by_ids(chunk_ids)
-        current_source_pages = [(ref[0], ref[1]) for _, ref in best_chunks_and_references]
+        current_source_pages = list(OrderedDict.fromkeys(page for chunk in retrieval['chunks'] for page in chunk['pages']))
 
         #Update conversation history
         st.session_state['conversation_history'].append({
         'query': 'Q: ' + new_query,
         'rag_response': rag_response,
         'llm_response': llm_response,
-        'source_pages': current_source_pages
+        'source_pages': current_source_pages,
+        'timings': retrieval['timings']
     })
 
         # Clear the input field and rerun
@@ -142,11 +191,22 @@ def run_UI():
 
         # Document uploader
         pdf_files = st.file_uploader("Upload documents", type="pdf", key="upload", accept_multiple_files=True)
+        upload_collection = st.text_input("Into collection",
+                                          value=collection if collection != ALL_COLLECTIONS else DEFAULT_COLLECTION)
 
         # Process the document after the user clicks the button
         if st.button("Process Files"):
             with st.spinner("Processing"):
-                text_chunks = st_rag.extract_and_store_text(pdf_files)
+                progress_bar = st.progress(0.0, text="Starting")
+
+                # Report progress per file and per page
+                def show_progress(filename, file_index, n_files, page_number, n_pages):
+                    done = (file_index + (page_number + 1) / n_pages) / n_files
+                    progress_bar.progress(done, text=f"File {file_index + 1}/{n_files}: {filename} - page {page_number + 1}/{n_pages}")
+
+                n_chunks = st_rag.extract_and_store_text(pdf_files, progress_callback=show_progress,
+                                                         collection=upload_collection.strip() or DEFAULT_COLLECTION)
+                progress_bar.progress(1.0, text=f"Stored {n_chunks} new chunks")
               
                 for pdf_file in pdf_files:
                     # Define the path to save the PDF
@@ -157,6 +217,25 @@ def run_UI():
                         f.write(pdf_file.getbuffer())
 
                     st.write(f"Saved {pdf_file.name} to {pdf_storage_dir}")
+
+    with st.sidebar:
+        st.subheader("Documents")
+
+        documents = st_rag.list_documents(collection if collection != ALL_COLLECTIONS else None)
+        if documents:
+            labels = {(document['pdf_filename'], document['collection']):
+                      f"{document['pdf_filename']} [{document['collection']}] ({document['n_pages'] or '?'} pages, "
+                      f"{document['n_chunks'] or '?'} chunks)" for document in documents}
+            selected = st.selectbox("Stored documents", list(labels), format_func=labels.get)
+            if st.button("Delete Document"):
+                n_chunks = st_rag.delete_document(*selected)
+                st.write(f"Deleted {selected[0]} from {selected[1]} and its {n_chunks} chunks.")
+        else:
+            st.caption("No documents stored yet.")
+
+    with st.sidebar:
+        with st.expander("Performance"):
+            show_metrics()
  
             
 
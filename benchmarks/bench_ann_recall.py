@@ -0,0 +1,102 @@
+"""
+Benchmark of the approximate IVF index against exact brute-force search.
+
+Reports recall@k (fraction of the exact top-k found by the approximate index) and
+mean query latency for several nprobe settings. Vectors are synthetic clustered
+embeddings by default, or the stored embeddings of an existing database.
+
+Usage:
+    python benchmarks/bench_ann_recall.py --size 100000 --k 10
+    python benchmarks/bench_ann_recall.py --db data/db_file.db
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from vector_index import FlatIndex, IVFFlatIndex
+
+
+def synthetic_embeddings(size, dim, n_clusters=256, seed=0):
+    """
+    Generates unit-length vectors scattered around random cluster centres,
+    which resembles the structure of real sentence embeddings better than pure noise.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, size)
+    vectors = centres[labels] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def database_embeddings(db_path):
+    """
+    Loads the normalized embeddings stored in a RAG database.
+    """
+    db = sqlite3.connect(db_path)
+    rows = db.execute("SELECT embedding FROM embeddings").fetchall()
+    db.close()
+    vectors = np.frombuffer(b''.join(row[0] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def run_queries(index, queries, k, **search_args):
+    """
+    Runs all queries and returns the result ids and mean latency in milliseconds.
+    """
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        ids, _ = index.search(query, k, **search_args)
+        results.append(ids)
+    elapsed = time.perf_counter() - start
+    return results, 1000 * elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='Use the embeddings stored in this database instead of synthetic vectors')
+    parser.add_argument('--size', type=int, default=100000, help='Number of synthetic vectors')
+    parser.add_argument('--dim', type=int, default=384, help='Dimension of synthetic vectors')
+    parser.add_argument('--queries', type=int, default=200, help='Number of queries')
+    parser.add_argument('--k', type=int, default=10, help='Number of results per query')
+    parser.add_argument('--n-lists', type=int, default=None, help='Number of IVF lists')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32], help='nprobe values to test')
+    args = parser.parse_args()
+
+    if args.db:
+        vectors = database_embeddings(args.db)
+    else:
+        vectors = synthetic_embeddings(args.size, args.dim)
+    ids = np.arange(len(vectors))
+
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    flat = FlatIndex(vectors.shape[1])
+    flat.add(ids, vectors)
+    exact, flat_ms = run_queries(flat, queries, args.k)
+
+    start = time.perf_counter()
+    ivf = IVFFlatIndex(vectors.shape[1], n_lists=args.n_lists, min_train_size=0)
+    ivf.add(ids, vectors)
+    build_s = time.perf_counter() - start
+
+    print(f"vectors={len(vectors)} dim={vectors.shape[1]} k={args.k} queries={args.queries}")
+    print(f"IVF lists={len(ivf.centroids)} build={build_s:.2f}s")
+    print(f"{'index':<12}{'nprobe':>8}{'recall@k':>10}{'ms/query':>10}")
+    print(f"{'flat':<12}{'-':>8}{1.0:>10.3f}{flat_ms:>10.3f}")
+    for nprobe in args.nprobe:
+        approx, ivf_ms = run_queries(ivf, queries, args.k, nprobe=nprobe)
+        recall = np.mean([len(np.intersect1d(a, e)) / len(e) for a, e in zip(approx, exact)])
+        print(f"{'ivf':<12}{nprobe:>8}{recall:>10.3f}{ivf_ms:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
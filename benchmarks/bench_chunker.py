@@ -0,0 +1,105 @@
+"""
+Micro-benchmark of the chunker on the bundled PDFs.
+
+Page text is extracted once, then each chunker configuration is timed over it and
+its throughput reported in MB/s of page text. The previous quadratic implementation
+is included for comparison.
+
+Usage:
+    python benchmarks/bench_chunker.py --chunk-size 500 --overlap 25
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from chunker import TokenCounter, iter_chunks
+from pdf_extract import iter_pdf_pages
+
+
+def legacy_chunk_text(text_dict, chunk_size, overlap):
+    """
+    The chunker used before the linear-time rewrite, kept as a baseline.
+    """
+    chunks = []
+    current_chunk = ""
+    current_references = []
+
+    for (file_name, page_number), (text) in text_dict.items():
+        sentences = re.split(r'(?<=[.!?]) +', text)
+        for sentence in sentences:
+            if len(current_chunk) + len(sentence) > chunk_size and current_chunk:
+                chunks.append((current_chunk, current_references.copy()))
+                current_chunk = current_chunk[-overlap:]
+                current_references = list(set(current_references + [(file_name, page_number)]))
+            current_chunk += sentence + ' '
+            current_references.append((file_name, page_number))
+            current_references = sorted(set(current_references), key=current_references.index)
+
+        if current_chunk:
+            chunks.append((current_chunk, current_references))
+            current_chunk = ""
+            current_references = []
+
+    return chunks
+
+
+def load_pages(pdf_dir):
+    """
+    Extracts the text of every page of every PDF in a directory.
+    """
+    text_dict = {}
+    for path in sorted(glob.glob(os.path.join(pdf_dir, '*.pdf'))):
+        for page_num, text in iter_pdf_pages(path):
+            text_dict[(os.path.basename(path), page_num)] = text
+    return text_dict
+
+
+def best_time(function, repeats):
+    """
+    Returns the result and the fastest wall time of several runs.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf-dir', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'pdfs'))
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--overlap', type=int, default=25)
+    parser.add_argument('--token-chunk-size', type=int, default=128)
+    parser.add_argument('--token-overlap', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    text_dict = load_pages(args.pdf_dir)
+    megabytes = sum(len(text.encode('utf-8')) for text in text_dict.values()) / 1e6
+    print(f"pages={len(text_dict)} text={megabytes:.2f} MB")
+
+    runs = [
+        ('legacy chars', lambda: legacy_chunk_text(text_dict, args.chunk_size, args.overlap)),
+        ('linear chars', lambda: list(iter_chunks(text_dict.items(), args.chunk_size, args.overlap))),
+    ]
+    try:
+        TokenCounter()
+        runs.append(('linear tokens', lambda: list(iter_chunks(text_dict.items(), args.token_chunk_size,
+                                                               args.token_overlap, unit='tokens'))))
+    except Exception as e:
+        print(f"tiktoken encoding unavailable ({type(e).__name__}), skipping token-based chunking")
+
+    print(f"{'chunker':<16}{'chunks':>8}{'seconds':>10}{'MB/s':>10}")
+    for name, function in runs:
+        chunks, seconds = best_time(function, args.repeats)
+        print(f"{name:<16}{len(chunks):>8}{seconds:>10.3f}{megabytes / seconds:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Latency and quality benchmark of cross-encoder reranking on a question set.
+
+Every question of the Q:/A: file is retrieved against an existing database with:
+    top-<k>                the first-stage ranking cut at top_k, as without a reranker
+    top-<wide>             a wider first-stage cut, the usual way to compensate for it
+    rerank-<n>             n first-stage candidates reranked by the cross-encoder down to top_k
+
+Reports retrieval p50/p95 latency with an empty score cache and again with the
+scores cached, the retrieval hit rate (the chunks contain most content words of
+the reference answer) and the mean number of prompt tokens, which drives the cost
+and latency of the language model. With --llm-base-url the answers are also
+requested and their end-to-end latency reported.
+
+Usage:
+    python benchmarks/bench_rerank.py --db data/db_file.db --questions assets/question_doc.txt
+    python benchmarks/bench_rerank.py --candidates 10 20 50 --wide-top-k 10 --retrieval-mode hybrid
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from rag_eval import answer_overlap, percentile, read_question_answer_pairs
+
+
+def run_config(rag, qa_pairs, hit_threshold, answer=False):
+    """
+    Retrieves every question twice, first with empty caches and then with the
+    reranker scores cached, and optionally answers it.
+
+    Returns:
+        dict: Latency percentiles in milliseconds, hit rate, mean answer overlap and mean prompt tokens.
+    """
+    rag.cache.clear('search')
+    rag.cache.clear('rerank')
+    latencies, overlaps, prompt_tokens, retrievals = [], [], [], []
+    for question, reference in qa_pairs:
+        start = time.perf_counter()
+        retrieval = rag.retrieve(question)
+        latencies.append(1000 * (time.perf_counter() - start))
+        texts = [chunk['text'] for chunk in retrieval['chunks']]
+        overlaps.append(answer_overlap(reference, texts))
+        prompt_tokens.append(rag.build_prompt(question, chunks=texts)[1] if texts else 0)
+        retrievals.append(retrieval)
+
+    # Search results are cached too, so only the reranker scores are reused
+    rag.cache.clear('search')
+    cached_latencies = []
+    for question, _ in qa_pairs:
+        start = time.perf_counter()
+        rag.retrieve(question)
+        cached_latencies.append(1000 * (time.perf_counter() - start))
+
+    result = {
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'cached_p50_ms': percentile(cached_latencies, 50),
+        'hit_rate': float(np.mean([overlap >= hit_threshold for overlap in overlaps])),
+        'mean_overlap': float(np.mean(overlaps)),
+        'prompt_tokens': float(np.mean(prompt_tokens)),
+    }
+    if answer:
+        rag.cache.clear('completion')
+        answer_latencies = []
+        # The uncached retrieval latency plus the language model request made with its chunks
+        for (question, _), retrieval, latency in zip(qa_pairs, retrievals, latencies):
+            rag.generate_response(question, retrieval=retrieval)
+            answer_latencies.append(latency + retrieval['timings'].get('llm_ms', 0.0))
+        result['answer_p50_ms'] = percentile(answer_latencies, 50)
+        result['answer_p95_ms'] = percentile(answer_latencies, 95)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='data/db_file.db', help='Path to the SQLite database')
+    parser.add_argument('--questions', default='assets/question_doc.txt', help='Question file with Q:/A: pairs')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence transformer embedding model')
+    parser.add_argument('--reranker', default='cross-encoder/ms-marco-MiniLM-L-6-v2', help='Cross-encoder model')
+    parser.add_argument('--top-k', type=int, default=3, help='Number of chunks given to the language model')
+    parser.add_argument('--wide-top-k', type=int, default=8, help='Wider first-stage cut compared against reranking')
+    parser.add_argument('--candidates', type=int, nargs='+', default=[20, 50], help='First-stage candidates reranked')
+    parser.add_argument('--retrieval-mode', default='vector', choices=('vector', 'bm25', 'hybrid'))
+    parser.add_argument('--hit-threshold', type=float, default=0.5, help='Answer overlap counted as a hit')
+    parser.add_argument('--llm-base-url', help='OpenAI compatible API to measure answer latency with, '
+                                               'e.g. the stub server of stub_llm_server.py')
+    args = parser.parse_args()
+
+    from my_rag import RAG
+
+    rag = RAG(db_path=args.db, llm_api_key=os.getenv("OPENAI_API_KEY", 'stub'), embedding_model=args.model,
+              top_k=args.top_k, retrieval_mode=args.retrieval_mode, reranker_model=args.reranker,
+              llm_base_url=args.llm_base_url, collect_metrics=False)
+    reranker = rag.reranker
+    qa_pairs = read_question_answer_pairs(args.questions)
+
+    # Load both models so that no configuration is charged for it
+    rag.encode_query(qa_pairs[0][0])
+    reranker.score(qa_pairs[0][0], ['warm up'])
+    if args.llm_base_url:
+        rag.integrate_llm('Warm up')
+
+    configs = [(f'top-{args.top_k}', args.top_k, None), (f'top-{args.wide_top_k}', args.wide_top_k, None)]
+    configs += [(f'rerank-{n}', args.top_k, n) for n in args.candidates]
+
+    print(f"{len(qa_pairs)} questions, {args.retrieval_mode} retrieval, reranker {args.reranker}")
+    header = f"{'config':>10} {'p50 ms':>9} {'p95 ms':>9} {'cached':>9} {'hit rate':>9} {'overlap':>8} {'tokens':>7}"
+    print(header + (f" {'answer p50':>11} {'answer p95':>11}" if args.llm_base_url else ''))
+    for name, top_k, candidates in configs:
+        rag.top_k = top_k
+        rag.reranker = reranker if candidates else None
+        rag.rerank_candidates = candidates or 0
+        result = run_config(rag, qa_pairs, args.hit_threshold, answer=bool(args.llm_base_url))
+        line = (f"{name:>10} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['cached_p50_ms']:9.2f} "
+                f"{result['hit_rate']:9.2f} {result['mean_overlap']:8.2f} {result['prompt_tokens']:7.0f}")
+        if args.llm_base_url:
+            line += f" {result['answer_p50_ms']:11.1f} {result['answer_p95_ms']:11.1f}"
+        print(line)
+    rag.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark of vector-only, BM25-only and hybrid retrieval on a question set.
+
+Every question of the Q:/A: file is searched against an existing database in each
+retrieval mode. Reports p50/p95 query latency and the retrieval hit rate, where a
+hit means the retrieved chunks contain most content words of the reference answer.
+
+Usage:
+    python benchmarks/bench_retrieval.py --db data/db_file.db --questions assets/question_doc.txt
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from rag_eval import answer_overlap, percentile, read_question_answer_pairs
+
+MODES = ('vector', 'bm25', 'hybrid')
+
+
+def run_mode(rag, qa_pairs, mode, hit_threshold):
+    """
+    Searches every question in one retrieval mode.
+
+    Returns:
+        dict: Latency percentiles in milliseconds, hit rate and mean answer overlap.
+    """
+    rag.retrieval_mode = mode
+    rag.cache.clear('search')
+    latencies, overlaps = [], []
+    for question, answer in qa_pairs:
+        start = time.perf_counter()
+        retrieval = rag.retrieve(question)
+        latencies.append(1000 * (time.perf_counter() - start))
+        overlaps.append(answer_overlap(answer, [chunk['text'] for chunk in retrieval['chunks']]))
+    return {
+        'latency_p50_ms': percentile(latencies, 50),
+        'latency_p95_ms': percentile(latencies, 95),
+        'hit_rate': float(np.mean([overlap >= hit_threshold for overlap in overlaps])),
+        'mean_overlap': float(np.mean(overlaps)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='data/db_file.db', help='Path to the SQLite database')
+    parser.add_argument('--questions', default='assets/question_doc.txt', help='Question file with Q:/A: pairs')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence transformer embedding model')
+    parser.add_argument('--top-k', type=int, default=3, help='Number of chunks retrieved per question')
+    parser.add_argument('--hit-threshold', type=float, default=0.5, help='Answer overlap counted as a hit')
+    parser.add_argument('--prefilter', action='store_true', help='Only score BM25 candidates with vectors in hybrid mode')
+    args = parser.parse_args()
+
+    from my_rag import RAG
+
+    rag = RAG(db_path=args.db, llm_api_key=None, embedding_model=args.model, top_k=args.top_k,
+              lexical_prefilter=args.prefilter)
+    if not rag.fts_enabled:
+        sys.exit("This SQLite build has no FTS5 support")
+    qa_pairs = read_question_answer_pairs(args.questions)
+
+    # Warm up the model so the first mode is not charged for loading it
+    rag.encode_query(qa_pairs[0][0])
+
+    print(f"{len(qa_pairs)} questions, top_k={args.top_k}")
+    print(f"{'mode':>8} {'p50 ms':>9} {'p95 ms':>9} {'hit rate':>9} {'overlap':>8}")
+    for mode in MODES:
+        result = run_mode(rag, qa_pairs, mode, args.hit_threshold)
+        print(f"{mode:>8} {result['latency_p50_ms']:9.2f} {result['latency_p95_ms']:9.2f} "
+              f"{result['hit_rate']:9.2f} {result['mean_overlap']:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Cold start benchmark of the RAG pipeline.
+
+Every run starts a fresh interpreter and measures the time to import my_rag, to
+create a RAG instance, to the first retrieval (which loads the embedding model)
+and to the first answer, generated by the local stub LLM server so no network
+is involved. Also lists which heavy modules the import pulled in. Runs are
+repeated and the medians reported, per embedding backend.
+
+Usage:
+    python benchmarks/bench_startup.py --db data/db_file.db --backends torch torch-int8 onnx-int8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__))
+from stub_llm_server import start_stub_server
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY_MODULES = ('torch', 'sentence_transformers', 'transformers', 'openai', 'fitz', 'streamlit', 'PyPDF2', 'pdf2image')
+
+# Runs in the fresh interpreter; prints the measurements as JSON
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import my_rag
+imported = time.perf_counter()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+rag = my_rag.RAG(db_path={db!r}, llm_api_key='stub', embedding_model={model!r}, embedding_backend={backend!r},
+                 llm_base_url={base_url!r})
+created = time.perf_counter()
+retrieval = rag.retrieve({question!r})
+retrieved = time.perf_counter()
+rag.generate_response({question!r}, retrieval=retrieval)
+answered = time.perf_counter()
+print(json.dumps({{'import_s': imported - start, 'init_s': created - imported, 'first_retrieval_s': retrieved - created,
+                  'first_answer_s': answered - start, 'heavy_modules_after_import': heavy}}))
+'''
+
+
+def run_once(db, model, backend, base_url, question):
+    code = CHILD.format(heavy=HEAVY_MODULES, db=db, model=model, backend=backend, base_url=base_url, question=question)
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'child failed')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='data/db_file.db', help='Path to the SQLite database')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence transformer embedding model')
+    parser.add_argument('--backends', nargs='+', default=['torch'], help='Embedding backends to compare')
+    parser.add_argument('--runs', type=int, default=3, help='Fresh interpreters per backend')
+    parser.add_argument('--question', default='What are the MR safety zones?', help='Question of the first answer')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server()
+    db = os.path.abspath(args.db)
+    print(f"{'backend':>11} {'import s':>9} {'init s':>8} {'1st retr s':>11} {'1st answer s':>13}  heavy modules after import")
+    for backend in args.backends:
+        try:
+            runs = [run_once(db, args.model, backend, base_url, args.question) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{backend:>11} failed: {e}")
+            continue
+        median = {key: float(np.median([run[key] for run in runs]))
+                  for key in ('import_s', 'init_s', 'first_retrieval_s', 'first_answer_s')}
+        print(f"{backend:>11} {median['import_s']:9.2f} {median['init_s']:8.2f} {median['first_retrieval_s']:11.2f} "
+              f"{median['first_answer_s']:13.2f}  {', '.join(runs[-1]['heavy_modules_after_import']) or '-'}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Load test of one shared RAG instance under 1 to 64 concurrent clients.
+
+Each client thread sends retrieval requests built from the questions of a Q:/A:
+file, made unique so every request encodes a new query instead of hitting the
+cache. Requests go straight to the RAG instance (in-process) or through the
+local HTTP endpoint of rag_service.py. Reports throughput, p50/p95 latency and
+the mean number of queries the micro-batching encoder coalesced per model call.
+
+Usage:
+    python benchmarks/load_test.py --db data/db_file.db --mode inprocess
+    python benchmarks/load_test.py --db data/db_file.db --mode http --requests 20
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from rag_eval import percentile, read_question_answer_pairs
+from rag_service import RAGClient, start_service
+
+CONCURRENCY = (1, 2, 4, 8, 16, 32, 64)
+
+
+def run_level(retrieve, questions, n_clients, n_requests, tag):
+    """
+    Runs `n_clients` threads each sending `n_requests` retrievals.
+
+    Returns:
+        tuple: (requests per second, latencies in milliseconds, number of errors)
+    """
+    latencies = [[] for _ in range(n_clients)]
+    errors = [0] * n_clients
+    barrier = threading.Barrier(n_clients + 1)
+
+    def client(c):
+        barrier.wait()
+        for i in range(n_requests):
+            question = questions[(c * n_requests + i) % len(questions)]
+            start = time.perf_counter()
+            try:
+                retrieve(f"{question} [{tag}-{c}-{i}]")
+            except Exception:
+                errors[c] += 1
+                continue
+            latencies[c].append(1000 * (time.perf_counter() - start))
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(n_clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    all_latencies = [latency for client_latencies in latencies for latency in client_latencies]
+    return len(all_latencies) / elapsed, all_latencies, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='data/db_file.db', help='Path to the SQLite database')
+    parser.add_argument('--questions', default='assets/question_doc.txt', help='Question file with Q:/A: pairs')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence transformer embedding model')
+    parser.add_argument('--mode', default='inprocess', choices=('inprocess', 'http'), help='How clients reach the RAG')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per client')
+    parser.add_argument('--batch-wait-ms', type=float, default=0, help='Time the encoder waits for more queries')
+    parser.add_argument('--max-clients', type=int, default=64, help='Highest concurrency level')
+    args = parser.parse_args()
+
+    from my_rag import RAG
+
+    rag = RAG(db_path=args.db, llm_api_key=None, embedding_model=args.model,
+              read_connections=min(args.max_clients, 16), query_batch_wait_ms=args.batch_wait_ms)
+    questions = [question for question, _ in read_question_answer_pairs(args.questions)]
+
+    server = None
+    if args.mode == 'http':
+        server, base_url = start_service(rag)
+        retrieve = RAGClient(base_url).retrieve
+    else:
+        retrieve = rag.retrieve
+
+    # Warm up the model and the connections
+    run_level(retrieve, questions, 2, 5, 'warmup')
+
+    print(f"{len(rag.index)} chunks, mode={args.mode}, {args.requests} requests per client")
+    print(f"{'clients':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'batch':>7} {'errors':>7}")
+    for n_clients in CONCURRENCY:
+        if n_clients > args.max_clients:
+            break
+        batches, items = rag.query_encoder.batches, rag.query_encoder.items
+        throughput, latencies, errors = run_level(retrieve, questions, n_clients, args.requests, n_clients)
+        batches, items = rag.query_encoder.batches - batches, rag.query_encoder.items - items
+        print(f"{n_clients:>7} {throughput:9.1f} {percentile(latencies, 50):9.2f} {percentile(latencies, 95):9.2f} "
+              f"{items / max(batches, 1):7.1f} {errors:>7}")
+
+    if server is not None:
+        server.shutdown()
+    rag.close()
+
+
+if __name__ == '__main__':
+    main()
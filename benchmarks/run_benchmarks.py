@@ -0,0 +1,298 @@
+"""
+Reproducible benchmark suite of the RAG pipeline, runnable offline.
+
+Every stage is measured on the bundled data so that runs on different commits
+can be compared:
+    ingest    get_text pages/s and chunk_text chunks/s on the PDFs in data/pdfs,
+              create_embeddings chunks/s on the resulting chunks
+    quality   retrieval hit rate and answer overlap on assets/question_doc.txt,
+              with the query latency of the same runs, so a speedup cannot hide
+              a drop in accuracy
+    search    semantic_search p50/p99 latency over synthetic corpora of 10k, 100k
+              and 1M vectors
+    answer    end-to-end answer latency, retrieval included, against the local
+              stub LLM server
+
+The corpus is built in a temporary database, synthetic vectors use a fixed seed
+and the embedding model is loaded from the local cache only (pass --online to
+allow downloading it). Results are written as JSON; with --baseline they are
+compared against an earlier results file and the exit status is 1 if any metric
+regressed by more than the tolerance.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --output new.json --baseline results.json
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 --repeats 1
+"""
+import argparse
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from rag_eval import answer_overlap, percentile, read_question_answer_pairs
+from stub_llm_server import start_stub_server
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def synthetic_index(index, size, seed=0, n_clusters=256, block_size=100000):
+    """
+    Fills an empty index with clustered unit-length vectors, generated block by
+    block so that the 1M vector corpus fits in memory.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, index.dim)).astype(np.float32)
+    vectors = np.empty((size, index.dim), dtype=np.float32)
+    for start in range(0, size, block_size):
+        end = min(start + block_size, size)
+        block = centres[rng.integers(0, n_clusters, end - start)]
+        block += 0.6 * rng.standard_normal(block.shape, dtype=np.float32)
+        vectors[start:end] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    index.add(np.arange(1, size + 1), vectors)
+    return index
+
+
+def best_time(function, repeats):
+    """
+    Calls a function `repeats` times and returns (last result, fastest time in seconds).
+    """
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def uploads(pdf_paths):
+    """
+    Opens PDFs as in-memory files with a name, like the files uploaded to the app.
+    """
+    files = []
+    for path in pdf_paths:
+        with open(path, 'rb') as file:
+            upload = io.BytesIO(file.read())
+        upload.name = os.path.basename(path)
+        files.append(upload)
+    return files
+
+
+def bench_ingest(rag, pdf_paths, repeats):
+    """
+    Measures text extraction, chunking and embedding, and stores the corpus in the RAG database.
+    """
+    def extract():
+        files = uploads(pdf_paths)
+        return rag.get_text(files)
+
+    text_dict, extract_s = best_time(extract, repeats)
+    chunks, chunk_s = best_time(lambda: rag.chunk_text(text_dict), repeats)
+
+    rag.store_chunks(chunks)
+    start = time.perf_counter()
+    rag.create_embeddings()
+    embed_s = time.perf_counter() - start
+    return {
+        'ingest.pages': len(text_dict),
+        'ingest.chunks': len(chunks),
+        'ingest.get_text_pages_per_s': len(text_dict) / extract_s,
+        'ingest.chunk_text_chunks_per_s': len(chunks) / chunk_s,
+        'ingest.create_embeddings_chunks_per_s': len(chunks) / embed_s,
+    }
+
+
+def bench_quality(rag, qa_pairs, hit_threshold):
+    """
+    Retrieves every question once, recording latency and whether the chunks contain the answer.
+    """
+    rag.cache.clear('search')
+    latencies, overlaps = [], []
+    for question, answer in qa_pairs:
+        start = time.perf_counter()
+        retrieval = rag.retrieve(question)
+        latencies.append(1000 * (time.perf_counter() - start))
+        overlaps.append(answer_overlap(answer, [chunk['text'] for chunk in retrieval['chunks']]))
+    return {
+        'quality.hit_rate': float(np.mean([overlap >= hit_threshold for overlap in overlaps])),
+        'quality.mean_overlap': float(np.mean(overlaps)),
+        'quality.retrieve_p50_ms': percentile(latencies, 50),
+        'quality.retrieve_p99_ms': percentile(latencies, 99),
+    }
+
+
+def bench_search(rag, sizes, questions, n_queries):
+    """
+    Measures semantic_search over synthetic corpora. Every query is made unique so that
+    it is encoded and scored instead of answered from the cache.
+    """
+    from vector_index import CollectionIndex, FlatIndex, DEFAULT_COLLECTION
+
+    real_index = rag.index
+    results = {}
+    try:
+        for size in sizes:
+            rag.index = CollectionIndex(real_index.dim, lambda collection: FlatIndex(real_index.dim))
+            synthetic_index(rag.index.collection(DEFAULT_COLLECTION), size)
+            rag.semantic_search(f"{questions[0]} [warmup {size}]")
+            latencies = []
+            for i in range(n_queries):
+                query = f"{questions[i % len(questions)]} [{size}-{i}]"
+                start = time.perf_counter()
+                rag.semantic_search(query)
+                latencies.append(1000 * (time.perf_counter() - start))
+            label = f'{size // 1000}k' if size < 1000000 else f'{size // 1000000}M'
+            results[f'search.{label}.p50_ms'] = percentile(latencies, 50)
+            results[f'search.{label}.p99_ms'] = percentile(latencies, 99)
+    finally:
+        rag.index = real_index
+        rag.cache.clear('search')
+    return results
+
+
+def bench_answer(rag, qa_pairs):
+    """
+    Answers every question, retrieval included, with the language model stubbed.
+    """
+    # The first request pays for importing openai and connecting
+    rag.integrate_llm('Warm up')
+    rag.cache.clear('search')
+    rag.cache.clear('completion')
+    latencies = []
+    for question, _ in qa_pairs:
+        start = time.perf_counter()
+        rag.generate_response(question)
+        latencies.append(1000 * (time.perf_counter() - start))
+    return {'answer.p50_ms': percentile(latencies, 50), 'answer.p99_ms': percentile(latencies, 99)}
+
+
+def lower_is_better(metric):
+    return metric.endswith('_ms')
+
+
+def compare(results, baseline, tolerance, quality_tolerance):
+    """
+    Compares results against a baseline.
+
+    Latencies may grow and throughputs shrink by `tolerance` (relative), quality
+    metrics may drop by `quality_tolerance` (absolute) before counting as a regression.
+
+    Returns:
+        tuple: (rows of (metric, baseline, current, relative change, regressed), any regression)
+    """
+    rows = []
+    for metric, current in results.items():
+        previous = baseline.get(metric)
+        if previous is None or current is None or metric in ('ingest.pages', 'ingest.chunks'):
+            continue
+        change = (current - previous) / previous if previous else 0.0
+        if metric.startswith('quality.') and not lower_is_better(metric):
+            regressed = previous - current > quality_tolerance
+        elif lower_is_better(metric):
+            regressed = change > tolerance
+        else:
+            regressed = -change > tolerance
+        rows.append((metric, previous, current, change, regressed))
+    return rows, any(row[-1] for row in rows)
+
+
+def environment():
+    """
+    Describes the machine and code the results were measured on.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf-dir', default=os.path.join(ROOT, 'data', 'pdfs'), help='Directory of the PDFs to ingest')
+    parser.add_argument('--questions', default=os.path.join(ROOT, 'assets', 'question_doc.txt'),
+                        help='Question file with Q:/A: pairs')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence transformer embedding model')
+    parser.add_argument('--chunk-size', type=int, default=250)
+    parser.add_argument('--overlap', type=int, default=25)
+    parser.add_argument('--top-k', type=int, default=3, help='Number of chunks retrieved per question')
+    parser.add_argument('--retrieval-mode', default='vector', choices=('vector', 'bm25', 'hybrid'))
+    parser.add_argument('--hit-threshold', type=float, default=0.5, help='Answer overlap counted as a hit')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Synthetic corpus sizes of the search benchmark')
+    parser.add_argument('--search-queries', type=int, default=200, help='Queries per synthetic corpus size')
+    parser.add_argument('--repeats', type=int, default=3, help='Repeats of the extraction and chunking timings')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative slowdown')
+    parser.add_argument('--quality-tolerance', type=float, default=0.02, help='Allowed absolute quality drop')
+    parser.add_argument('--online', action='store_true', help='Allow downloading the embedding model')
+    args = parser.parse_args()
+
+    if not args.online:
+        os.environ.setdefault('HF_HUB_OFFLINE', '1')
+        os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+    from my_rag import RAG
+
+    pdf_paths = sorted(glob.glob(os.path.join(args.pdf_dir, '*.pdf')))
+    qa_pairs = read_question_answer_pairs(args.questions)
+    server, base_url = start_stub_server()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rag = RAG(db_path=os.path.join(tmp_dir, 'bench.db'), llm_api_key='stub', embedding_model=args.model,
+                  chunk_size=args.chunk_size, overlap=args.overlap, top_k=args.top_k,
+                  retrieval_mode=args.retrieval_mode, llm_base_url=base_url, collect_metrics=False)
+        # Loading the model is measured by bench_startup.py, not here
+        rag.encode_query(qa_pairs[0][0])
+
+        stages = [
+            ('ingest', lambda: bench_ingest(rag, pdf_paths, args.repeats)),
+            ('quality', lambda: bench_quality(rag, qa_pairs, args.hit_threshold)),
+            ('answer', lambda: bench_answer(rag, qa_pairs)),
+            ('search', lambda: bench_search(rag, args.sizes, [q for q, _ in qa_pairs], args.search_queries)),
+        ]
+        for name, stage in stages:
+            start = time.perf_counter()
+            stage_results = stage()
+            results.update(stage_results)
+            print(f"{name:>8} done in {time.perf_counter() - start:.1f} s")
+        rag.close()
+    server.shutdown()
+
+    print()
+    for metric, value in results.items():
+        print(f"{metric:<42} {value:12.3f}")
+
+    report = {'environment': environment(), 'settings': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        rows, regressed = compare(results, baseline['results'], args.tolerance, args.quality_tolerance)
+        print(f"\nCompared with {args.baseline} (commit {baseline['environment'].get('commit')})")
+        print(f"{'metric':<42} {'baseline':>12} {'current':>12} {'change':>8}")
+        for metric, previous, current, change, is_regression in rows:
+            print(f"{metric:<42} {previous:12.3f} {current:12.3f} {100 * change:7.1f}%{'  REGRESSION' if is_regression else ''}")
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Answers POST /v1/chat/completions, streaming (server-sent events) or not, with a
+short deterministic answer emitted word by word. Delays, dropped connections
+and failures can be injected to exercise timeouts, retries and concurrency without network access.
+Point RAG at it with llm_base_url='http://127.0.0.1:<port>/v1'.
+
+Usage:
+    python benchmarks/stub_llm_server.py --port 8765 --first-token-delay 0.3 --token-delay 0.02
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubSettings:
+    """
+    Behaviour of the stub server, shared by all request handlers.
+    """
+
+    def __init__(self, first_token_delay=0.0, token_delay=0.0, fail_first=0, answer_words=20, drop_first=0):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.fail_first = fail_first
+        self.answer_words = answer_words
+        self.drop_first = drop_first
+        self.requests = 0
+        self.cancelled = 0
+        self.lock = threading.Lock()
+
+
+def stub_answer(messages, n_words):
+    """
+    Builds a deterministic answer from the last words of the user prompt.
+    """
+    prompt = messages[-1]['content'] if messages else ''
+    words = prompt.split()[-n_words:]
+    return ['Stub'] + ['answer:'] + words
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    settings = StubSettings()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        settings = self.settings
+        with settings.lock:
+            settings.requests += 1
+            request_number = settings.requests
+        if request_number <= settings.drop_first:
+            # Close the connection without a response, as a crashed upstream would
+            self.close_connection = True
+            return
+        if request_number <= settings.drop_first + settings.fail_first:
+            self._send_json(503, {'error': {'message': 'stub overloaded', 'type': 'server_error'}})
+            return
+
+        words = stub_answer(request.get('messages', []), settings.answer_words)
+        prompt_tokens = sum(len(m.get('content', '').split()) for m in request.get('messages', []))
+        model = request.get('model', 'stub')
+        created = int(time.time())
+        time.sleep(settings.first_token_delay)
+
+        if not request.get('stream'):
+            time.sleep(settings.token_delay * len(words))
+            self._send_json(200, {
+                'id': f'chatcmpl-stub-{request_number}', 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': ' '.join(words)}}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(words),
+                          'total_tokens': prompt_tokens + len(words)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(settings.token_delay)
+                event = {'id': f'chatcmpl-stub-{request_number}', 'object': 'chat.completion.chunk',
+                         'created': created, 'model': model,
+                         'choices': [{'index': 0, 'finish_reason': None,
+                                      'delta': {'content': (' ' if i else '') + word}}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream
+            with settings.lock:
+                settings.cancelled += 1
+
+
+def start_stub_server(port=0, **settings):
+    """
+    Starts the stub server in a background thread.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free port.
+        **settings: StubSettings arguments.
+
+    Returns:
+        tuple: (server, base_url). Call server.shutdown() to stop it.
+    """
+    handler = type('StubHandler', (StubHandler,), {'settings': StubSettings(**settings)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--first-token-delay', type=float, default=0.0, help='Seconds before the first token')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='Seconds between tokens')
+    parser.add_argument('--fail-first', type=int, default=0, help='Number of initial requests answered with HTTP 503')
+    parser.add_argument('--drop-first', type=int, default=0,
+                        help='Number of initial requests whose connection is closed without a response, '
+                             'before the failed ones')
+    args = parser.parse_args()
+
+    handler = type('StubHandler', (StubHandler,), {'settings': StubSettings(
+        args.first_token_delay, args.token_delay, args.fail_first, drop_first=args.drop_first)})
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+    print(f"Stub OpenAI API listening on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
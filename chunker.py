@@ -0,0 +1,92 @@
+import re
+from collections import OrderedDict
+
+SENTENCE_END = re.compile(r'(?<=[.!?]) +')
+
+
+class TokenCounter:
+    """
+    Measures text in tiktoken tokens, for chunk sizes expressed in tokens.
+    """
+
+    def __init__(self, encoding_name='cl100k_base'):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def __call__(self, text):
+        return len(self.encoding.encode_ordinary(text))
+
+    def tail(self, text, n_tokens):
+        """
+        Returns the text of the last `n_tokens` tokens.
+        """
+        if n_tokens <= 0:
+            return ''
+        return self.encoding.decode(self.encoding.encode_ordinary(text)[-n_tokens:])
+
+
+def _char_tail(text, n_chars):
+    return text[-n_chars:] if n_chars > 0 else ''
+
+
+def iter_chunks(pages, chunk_size, overlap, unit='chars'):
+    """
+    Splits a stream of pages into chunks of at most `chunk_size` characters or tokens,
+    splitting at sentence endings and repeating the last `overlap` characters or tokens
+    of a chunk at the start of the next one.
+
+    Chunks may span consecutive pages of the same file and record every page they
+    contain. Work and memory are linear in the size of the text: sentences are
+    collected in a list and joined once per chunk, and the pages of the current
+    chunk are tracked in an ordered dict.
+
+    Args:
+        pages (iterable): ((filename, page_number), text) pairs in document order.
+        chunk_size (int): Maximum size of a chunk.
+        overlap (int): Size of the overlap between consecutive chunks.
+        unit (str): 'chars' to measure in characters, 'tokens' to measure in tiktoken tokens.
+
+    Yields:
+        tuple: (chunk, references) where references lists every (filename, page_number)
+            the chunk was taken from, in page order.
+    """
+    if unit == 'tokens':
+        measure = TokenCounter()
+        tail = measure.tail
+    elif unit == 'chars':
+        measure = len
+        tail = _char_tail
+    else:
+        raise ValueError(f"Unknown chunk unit '{unit}', expected 'chars' or 'tokens'")
+
+    sentences = []           # Sentences of the current chunk, each followed by a space when joined
+    size = 0                 # Size of the current chunk in the chosen unit
+    references = OrderedDict()  # (filename, page_number) keys of the current chunk
+    current_file = None
+
+    for (file_name, page_number), text in pages:
+        # Chunks never span two files
+        if file_name != current_file and sentences:
+            yield ''.join(sentences), list(references)
+            sentences, size, references = [], 0, OrderedDict()
+        current_file = file_name
+
+        for sentence in SENTENCE_END.split(text):
+            if not sentence:
+                continue
+            sentence = sentence + ' '
+            sentence_size = measure(sentence)
+            if size + sentence_size > chunk_size and sentences:
+                chunk = ''.join(sentences)
+                yield chunk, list(references)
+                overlap_text = tail(chunk, overlap)
+                sentences = [overlap_text] if overlap_text else []
+                size = measure(overlap_text) if overlap_text else 0
+                # The overlap comes from the page of the last sentence
+                references = OrderedDict([(next(reversed(references)), None)])
+            sentences.append(sentence)
+            size += sentence_size
+            references[(file_name, page_number)] = None
+
+    if sentences:
+        yield ''.join(sentences), list(references)
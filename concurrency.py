@@ -0,0 +1,200 @@
+"""
+Building blocks that let one RAG instance serve many threads at once: a SQLite
+connection pool, a readers-writer lock and a micro-batching request queue.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """
+    One writable SQLite connection plus a bounded pool of read-only connections.
+
+    The database is switched to write-ahead logging, so readers never block the
+    writer and see the last committed state while a write transaction is open.
+    """
+
+    def __init__(self, db_path, size=8, timeout=30.0):
+        """
+        Args:
+            db_path (str): Path to the SQLite database file.
+            size (int): Maximum number of read-only connections.
+            timeout (float): Seconds a connection waits for a lock held by another connection.
+        """
+        self.db_path = db_path
+        self.timeout = timeout
+        self.writer = self.connect()
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        # Commits only wait for the log write, not for a sync; still safe against corruption in WAL mode
+        self.writer.execute("PRAGMA synchronous=NORMAL")
+        # Bulk ingestion touches many index pages; keep them and temporary sort data in memory
+        self.writer.execute("PRAGMA cache_size=-65536")
+        self.writer.execute("PRAGMA temp_store=MEMORY")
+        self.size = size
+        self.created = 0
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+
+    def connect(self, read_only=False):
+        """
+        Opens a new connection that may be used from any thread (one thread at a time).
+        """
+        if read_only:
+            uri = f'file:{urllib.parse.quote(os.path.abspath(self.db_path))}?mode=ro'
+            return sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False)
+        return sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+
+    @contextmanager
+    def reader(self):
+        """
+        Lends a read-only connection, opening one if fewer than `size` exist and
+        otherwise waiting for one to be returned.
+        """
+        try:
+            db = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+            db = self.connect(read_only=True) if create else self.idle.get()
+        try:
+            yield db
+        finally:
+            # End the implicit read transaction so the next reader sees new commits
+            db.rollback()
+            self.idle.put(db)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self.writer.close()
+
+
+class ReadWriteLock:
+    """
+    Lock allowing many concurrent readers or one writer; waiting writers block new readers.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writer = None
+        self.writer_depth = 0
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            # The writing thread may read; other threads wait for writers to finish
+            if self.writer != threading.get_ident():
+                while self.writer is not None or self.waiting_writers:
+                    self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer != me:
+                self.waiting_writers += 1
+                while self.writer is not None or self.readers:
+                    self.condition.wait()
+                self.waiting_writers -= 1
+                self.writer = me
+            self.writer_depth += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer_depth -= 1
+                if not self.writer_depth:
+                    self.writer = None
+                self.condition.notify_all()
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests into batched calls of a function.
+
+    Requests are queued and handled by one worker thread. The worker takes every
+    request that is waiting, up to `max_batch_size`, optionally lingering
+    `max_wait` seconds for more, and answers them all with one call. With no
+    linger a lone request is handled immediately, while requests that arrive
+    during a call are batched into the next one.
+    """
+
+    def __init__(self, fn, max_batch_size=64, max_wait=0.0, name='micro-batcher'):
+        """
+        Args:
+            fn (callable): Function mapping a list of items to a sequence of results.
+            max_batch_size (int): Maximum number of items per call.
+            max_wait (float): Seconds to wait for more items after the first one arrives.
+            name (str): Name of the worker thread.
+        """
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self.worker.start()
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def submit(self, item):
+        """
+        Queues an item.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the result for the item.
+        """
+        future = Future()
+        self.requests.put((item, future))
+        return future
+
+    def __call__(self, item):
+        """
+        Handles one item, blocking until its batch is done.
+        """
+        return self.submit(item).result()
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while len(batch) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                pass
+
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
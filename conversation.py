@@ -0,0 +1,93 @@
+import re
+
+from chunker import TokenCounter
+
+# Context windows in tokens of the chat models, matched by longest name prefix
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-3.5-turbo-instruct': 4096,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+FIRST_SENTENCE = re.compile(r'^(.+?[.!?])(?:\s|$)', re.S)
+
+
+def context_window(model):
+    """
+    Returns the context window of a chat model in tokens, a conservative default if unknown.
+    """
+    matches = [name for name in MODEL_CONTEXT_WINDOWS if model.startswith(name)]
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_WINDOW
+
+
+def approximate_tokens(text):
+    """
+    Estimates the token count of English text at four characters per token.
+    """
+    return (len(text) + 3) // 4
+
+
+def token_counter():
+    """
+    Returns a function counting tiktoken tokens, or an estimate when tiktoken or its
+    encoding files are unavailable.
+    """
+    try:
+        return TokenCounter()
+    except Exception:
+        return approximate_tokens
+
+
+def fit_tokens(text, max_tokens, count_tokens, keep='head'):
+    """
+    Shortens text at word boundaries until it fits a token budget.
+
+    Args:
+        text (str): The text to shorten.
+        max_tokens (int): The token budget.
+        count_tokens (callable): Function returning the token count of a text.
+        keep (str): 'head' keeps the beginning of the text, 'tail' its end.
+
+    Returns:
+        str: The text, shortened if needed ('' if nothing fits).
+    """
+    n_tokens = count_tokens(text)
+    if n_tokens <= max_tokens:
+        return text
+    words = text.split()
+    n_words = int(len(words) * max_tokens / n_tokens)
+    while n_words > 0:
+        fitted = ' '.join(words[:n_words] if keep == 'head' else words[-n_words:])
+        if count_tokens(fitted) <= max_tokens:
+            return fitted
+        n_words -= max(1, n_words // 10)
+    return ''
+
+
+def first_sentence(text):
+    """
+    Returns the first sentence of a text, or the whole text if it has no sentence end.
+    """
+    text = ' '.join(text.split())
+    match = FIRST_SENTENCE.match(text)
+    return match.group(1) if match else text
+
+
+class Conversation:
+    """
+    Chat history kept for prompts: the most recent turns verbatim and a rolling
+    summary of the older ones, so its size stays bounded in long sessions.
+    Turns are added and compacted with `RAG.record_turn`.
+    """
+
+    def __init__(self):
+        self.turns = []          # Recent (question, answer) pairs, oldest first
+        self.summary = ''        # Summary of the turns no longer kept verbatim
+        self.n_summarized = 0    # Number of turns folded into the summary
+
+    def __len__(self):
+        return self.n_summarized + len(self.turns)
@@ -0,0 +1,334 @@
+"""
+Low-overhead instrumentation of the RAG pipeline.
+
+Metrics records per-stage latency histograms and event counters (pages,
+chunks, embeddings, scanned index rows, LLM tokens, ...). Disabled metrics hand
+out one shared no-op timer, so the instrumented code pays a method call and
+nothing else. Histograms are exported in the Prometheus text format, to a file
+for the node exporter's textfile collector or over HTTP by rag_service.py.
+
+SamplingProfiler is an opt-in statistical profiler: while a profiled block
+runs, a background thread samples the stack of the thread running it every few
+milliseconds and counts the samples per stack, in the collapsed format read by
+flamegraph.pl and speedscope.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Throughputs reported by `snapshot`: counter divided by the total time of a stage
+RATES = {
+    'pages_per_s': ('pages', 'extract'),
+    'chunks_per_s': ('chunks', 'store'),
+    'embeddings_per_s': ('embeddings', 'embed'),
+}
+
+_NULL_CONTEXT = nullcontext()
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+class Histogram:
+    """
+    Cumulative bucket counts of one stage, plus a window of recent observations
+    for the percentiles of the live view.
+    """
+
+    def __init__(self, buckets, window):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+
+class _Timer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Thread-safe registry of stage latency histograms and counters.
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS, window=512, profiler=None):
+        """
+        Args:
+            enabled (bool): Record anything at all; disabled metrics cost a method call per event.
+            buckets (tuple): Upper bounds of the latency histogram buckets, in seconds.
+            window (int): Number of recent observations per stage kept for percentiles.
+            profiler (SamplingProfiler): Optional profiler run by `profile`.
+        """
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.window = window
+        self.profiler = profiler
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = Counter()
+        self.gauges = {}
+        self.exporter = None
+
+    def time(self, stage):
+        """
+        Returns a context manager recording the duration of the block under `stage`.
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        """
+        Records one duration of a stage.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self.buckets, self.window)
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        """
+        Adds `n` to a counter.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += n
+
+    def gauge(self, name, read):
+        """
+        Registers a value read at export time, e.g. the size of the index.
+
+        Args:
+            name (str): Name of the gauge.
+            read (callable): Function returning the current value.
+        """
+        self.gauges[name] = read
+
+    def profile(self, name):
+        """
+        Returns a context manager sampling the current thread's stack under `name`
+        when a profiler is attached, and a no-op otherwise.
+        """
+        if self.profiler is None or not self.enabled:
+            return _NULL_CONTEXT
+        return self.profiler.profile(name)
+
+    def reset(self):
+        """
+        Forgets all recorded histograms and counters.
+        """
+        with self.lock:
+            self.histograms = {}
+            self.counters = Counter()
+
+    def snapshot(self):
+        """
+        Returns the current metrics for display.
+
+        Returns:
+            dict: 'stages' maps each stage to its 'count', 'total_s', 'mean_ms', and the
+                'p50_ms', 'p95_ms' and 'max_ms' of its recent observations; 'counters'
+                holds the counters and gauges; 'rates' the throughputs listed in RATES.
+        """
+        with self.lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                recent = sorted(histogram.recent)
+                stages[stage] = {
+                    'count': histogram.count,
+                    'total_s': histogram.sum,
+                    'mean_ms': 1000 * histogram.sum / histogram.count,
+                    'p50_ms': 1000 * _percentile(recent, 50),
+                    'p95_ms': 1000 * _percentile(recent, 95),
+                    'max_ms': 1000 * histogram.max,
+                }
+            counters = dict(self.counters)
+        counters.update((name, read()) for name, read in self.gauges.items())
+        rates = {rate: counters[counter] / stages[stage]['total_s'] for rate, (counter, stage) in RATES.items()
+                 if counter in counters and stage in stages and stages[stage]['total_s'] > 0}
+        return {'stages': stages, 'counters': counters, 'rates': rates}
+
+    def to_prometheus(self, prefix='rag'):
+        """
+        Formats the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: One `<prefix>_stage_seconds` histogram labelled by stage, one
+                `<prefix>_<name>_total` counter per counter and one gauge per gauge.
+        """
+        lines = [f'# HELP {prefix}_stage_seconds Latency of the RAG pipeline stages.',
+                 f'# TYPE {prefix}_stage_seconds histogram']
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            counters = sorted(self.counters.items())
+        for name, value in counters:
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        for name, read in sorted(self.gauges.items()):
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            lines.append(f'{prefix}_{name} {read()}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='rag'):
+        """
+        Writes the Prometheus text format to a file, replacing it atomically so a
+        scraper never reads a partial file.
+        """
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
+    def start_exporter(self, path, interval=15.0, prefix='rag'):
+        """
+        Rewrites the Prometheus text file every `interval` seconds in a daemon thread.
+
+        Returns:
+            threading.Event: Set it to stop the exporter.
+        """
+        stop = threading.Event()
+
+        def export():
+            while not stop.wait(interval):
+                self.write_prometheus(path, prefix)
+
+        self.exporter = threading.Thread(target=export, name='metrics-exporter', daemon=True)
+        self.exporter.start()
+        return stop
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of the threads running profiled blocks.
+
+    One sampler thread runs while any profiled block is active and reads the
+    stacks of the registered threads with sys._current_frames(), so the
+    profiled code itself is not slowed down by tracing.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        """
+        Args:
+            interval (float): Time between samples, in seconds.
+            max_depth (int): Innermost frames kept per stack.
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.active = {}          # thread id -> list of names of the profiled blocks it is in
+        self.stacks = Counter()   # collapsed stack -> number of samples
+        self.sampler = None
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Samples the current thread's stack while the block runs, under `name`.
+        """
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.active.setdefault(thread_id, []).append(name)
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+                self.sampler.start()
+        try:
+            yield self
+        finally:
+            with self.lock:
+                names = self.active[thread_id]
+                names.pop()
+                if not names:
+                    del self.active[thread_id]
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    self.sampler = None
+                    return
+                active = {thread_id: names[0] for thread_id, names in self.active.items()}
+            frames = sys._current_frames()
+            for thread_id, name in active.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stack.append(name)
+                with self.lock:
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """
+        Returns the samples in the collapsed stack format, one 'frame;frame;... count' line per stack.
+        """
+        with self.lock:
+            return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+    def write(self, path):
+        """
+        Writes the collapsed stacks to a file, e.g. for flamegraph.pl or speedscope.
+        """
+        with open(path, 'w') as file:
+            file.write(self.collapsed())
+
+    def top(self, n=20):
+        """
+        Returns the functions most often on top of the sampled stacks.
+
+        Returns:
+            list: (function, share of the samples) pairs, most frequent first.
+        """
+        with self.lock:
+            leaves = Counter()
+            for stack, count in self.stacks.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(function, count / total) for function, count in leaves.most_common(n)]
+
+    def clear(self):
+        with self.lock:
+            self.stacks = Counter()
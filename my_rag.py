@@ -1,19 +1,50 @@
-import streamlit as st
-from PyPDF2 import PdfReader
 import os, re, io
-import tempfile
+import hashlib
+import time
+import threading
+import weakref
+import asyncio
+import random
 #import nougat
-from pdf2image import convert_from_path
-import fitz
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import sqlite3
-import openai
+from collections import Counter
+# sentence_transformers (torch), openai and fitz are imported when first used, so importing
+# this module and creating a RAG instance stay fast
+from pdf_extract import iter_pdf_pages, count_pages
+from chunker import iter_chunks
+from vector_index import create_index, collection_path, top_k_rows, CollectionIndex, MmapFlatIndex, DEFAULT_COLLECTION
+from rag_cache import RAGCache, cache_key, normalize_query
+from page_render import PageRenderer
+from concurrency import ConnectionPool, MicroBatcher, ReadWriteLock
+from conversation import Conversation, context_window, first_sentence, fit_tokens, token_counter
+from metrics import Metrics, SamplingProfiler
+from ocr import PageOCR, OCR_RETRYABLE
+from reranker import Reranker
 #from haystack.nodes import PreProcessor, PDFToTextConverter
 
+# Tokens of the chat message framing and system message, reserved in the prompt budget
+MESSAGE_OVERHEAD_TOKENS = 32
+# Maximum length of a rewritten search query
+REWRITE_TOKENS = 64
+
+# Embedding dimensions of common models, so the index can be created before the model is loaded
+KNOWN_EMBEDDING_DIMENSIONS = {
+    'all-MiniLM-L6-v2': 384,
+    'all-MiniLM-L12-v2': 384,
+    'multi-qa-MiniLM-L6-cos-v1': 384,
+    'paraphrase-MiniLM-L6-v2': 384,
+    'all-mpnet-base-v2': 768,
+}
+EMBEDDING_BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+# Metadata a search can be restricted to, see RAG.retrieve
+SEARCH_FILTERS = ('collection', 'pdf_filename', 'pages')
+# Quantized ONNX export published with the sentence-transformers models (AVX2 CPUs)
+ONNX_INT8_FILE = 'onnx/model_quint8_avx2.onnx'
+
 class RAG:
      
-    def __init__(self, db_path, llm_api_key, embedding_model='all-MiniLM-L6-v2', llm_engine = 'gpt-3.5-turbo', chunk_size=250, overlap=25, top_k = 3, search_threshold=0.8, max_token_length=512, cache_size=1000, verbose=False):
+    def __init__(self, db_path, llm_api_key, embedding_model='all-MiniLM-L6-v2', llm_engine = 'gpt-3.5-turbo', chunk_size=250, overlap=25, chunk_unit='chars', top_k = 3, search_threshold=0.3, max_token_length=512, cache_size=1000, persist_cache=False, index_type='flat', nprobe=8, n_lists=None, embedding_storage='sqlite', vector_dtype='float16', rescore_oversample=4, retrieval_mode='vector', rrf_k=60, lexical_candidates=100, lexical_prefilter=False, embed_batch_size=64, encode_processes=0, ingest_batch_size=256, ingest_workers=0, llm_base_url=None, llm_timeout=60, llm_retries=3, pdf_dir=None, page_cache_dir=None, render_dpi=110, page_cache_memory_mb=64, page_cache_disk_mb=512, context_window=None, history_turns=2, summary_tokens=200, llm_summaries=False, query_rewrite=False, read_connections=8, query_batch_size=64, query_batch_wait_ms=0, embedding_backend='torch', collect_metrics=True, profile=False, metrics_path=None, ocr_engine='tesseract', ocr_languages='eng', ocr_dpi=300, ocr_min_chars=32, ocr_workers=2, ocr_timeout=60, reranker_model=None, rerank_candidates=20, rerank_batch_size=32, verbose=False):
         """
         Initializes the RAG instance with database connection and configurations.
 
@@ -21,30 +52,237 @@ class RAG:
             db_path (str): Path to the SQLite database file.
             llm_api_key (str): API key for OpenAI's language model.
             embedding_model (str): Name of the sentence transformer model for embeddings.
-            chunk_size (int): Maximum length of each chunk in characters.
-            overlap (int): Number of characters to overlap between chunks.
+            chunk_size (int): Maximum length of each chunk in characters (or tokens, see chunk_unit).
+            overlap (int): Number of characters (or tokens) to overlap between chunks.
+            chunk_unit (str): Unit of chunk_size and overlap, 'chars' or 'tokens' (tiktoken tokens).
             top_k (int): Number of top results to retrieve in semantic search.
-            search_threshold (float): Threshold for similarity in semantic search.
+            search_threshold (float): Minimum cosine similarity for a chunk to be returned
+                by semantic search (None disables the filter). In hybrid retrieval it applies to
+                the vector candidates before fusion; keyword matches have no similarity and are kept.
             max_token_length (int): Maximum token length for language model responses.
             cache_size (int): Size of the cache for storing recent queries and responses.
+            persist_cache (bool): Store the cache in the database so it survives restarts.
+            index_type (str): Vector index used by semantic search, 'flat' (exact) or 'ivf' (approximate).
+            nprobe (int): Number of IVF lists scanned per query; higher is slower but more accurate.
+            n_lists (int): Number of IVF lists, defaults to about 4 * sqrt(number of chunks).
+            embedding_storage (str): 'sqlite' keeps the search vectors in memory; 'mmap' scans a
+                memory-mapped vector file next to the database (flat index only).
+            vector_dtype (str): Storage type of the memory-mapped vectors, 'float32', 'float16' or 'int8'.
+            rescore_oversample (int): Candidates per result rescored with exact float32 embeddings
+                when the memory-mapped vectors are quantized.
+            retrieval_mode (str): 'vector' (cosine similarity), 'bm25' (SQLite FTS5 keyword search)
+                or 'hybrid' (both, fused with reciprocal rank fusion).
+            rrf_k (int): Rank offset of reciprocal rank fusion; larger values flatten the rank weights.
+            lexical_candidates (int): Number of candidates taken from each ranking before fusion.
+            lexical_prefilter (bool): In hybrid mode, only score the BM25 candidates with vectors
+                instead of scanning the whole vector index.
+            embed_batch_size (int): Number of chunks encoded per batch when creating embeddings.
+            encode_processes (int): Number of CPU worker processes used to encode chunks (0 encodes in-process).
+            ingest_batch_size (int): Number of chunks stored and embedded together while ingesting PDFs.
+            ingest_workers (int): Number of worker processes extracting PDF pages (0 extracts in-process).
+            llm_base_url (str): Alternative base URL of an OpenAI compatible API, e.g. a local stub server.
+            llm_timeout (float): Timeout in seconds for a language model request.
+            llm_retries (int): Number of retries, with exponential backoff, of a failed language model request.
+            pdf_dir (str): Directory of the stored PDFs; when given, the source pages of every
+                semantic search are rendered in the background so they display instantly.
+            page_cache_dir (str): Directory of the rendered page image cache, defaults to
+                '<database name>_pages' next to the database.
+            render_dpi (int): Resolution of rendered page images.
+            page_cache_memory_mb (float): Memory budget of the page image cache.
+            page_cache_disk_mb (float): Disk budget of the page image cache.
+            context_window (int): Context window of the language model in tokens, looked up from
+                llm_engine if omitted; the prompt budget is this minus max_token_length.
+            history_turns (int): Number of recent conversation turns kept verbatim in prompts.
+            summary_tokens (int): Maximum length of the rolling summary of older turns.
+            llm_summaries (bool): Summarize older turns with the language model instead of
+                keeping the first sentence of each answer.
+            query_rewrite (bool): Search with a short standalone rewrite of follow-up questions,
+                made by the language model, instead of the question as asked.
+            read_connections (int): Maximum number of read-only database connections used by
+                concurrent searches.
+            query_batch_size (int): Maximum number of concurrent query encodes coalesced into
+                one model call.
+            query_batch_wait_ms (float): Time to wait for more concurrent queries before encoding;
+                0 only batches queries that arrive while the model is busy.
+            embedding_backend (str): CPU inference backend of the embedding model: 'torch',
+                'torch-int8' (dynamically quantized linear layers), 'onnx' or 'onnx-int8'
+                (ONNX Runtime, requires sentence-transformers>=3.2 and optimum[onnxruntime]).
+                Quantized backends are faster but their embeddings differ slightly, so
+                stored embeddings should be created with the same backend.
+            collect_metrics (bool): Record per-stage latencies and counters in `metrics`.
+            profile (bool): Run a sampling profiler during ingestion and queries, see `metrics.profiler`.
+            metrics_path (str): Prometheus text file the metrics are written to every 15 seconds.
+            ocr_engine (str): OCR engine for scanned pages without a text layer, 'tesseract',
+                or None to keep such pages empty. See ocr.py.
+            ocr_languages (str): Tesseract language codes, e.g. 'eng+deu'.
+            ocr_dpi (int): Resolution scanned pages are rasterized at for OCR.
+            ocr_min_chars (int): Pages with images and fewer extracted characters are OCRed.
+            ocr_workers (int): Number of OCR processes.
+            ocr_timeout (float): Seconds allowed per page before OCR gives up on it.
+            reranker_model (str): Cross-encoder that reranks the first-stage candidates, e.g.
+                'cross-encoder/ms-marco-MiniLM-L-6-v2', or None to return the first-stage ranking.
+                See reranker.py.
+            rerank_candidates (int): Number of first-stage candidates reranked to pick the `top_k` chunks.
+            rerank_batch_size (int): Number of query and chunk pairs scored per cross-encoder call.
             verbose (bool): Flag to enable verbose logging for debugging.
         """
        
+        # The instance may be shared by many threads: writes go through one connection
+        # under write_lock, searches use pooled read-only connections
         self.db_path = db_path
-        self.db = sqlite3.connect(db_path)
+        self.metrics = Metrics(enabled=collect_metrics, profiler=SamplingProfiler() if profile else None)
+        self.pool = ConnectionPool(db_path, size=read_connections)
+        self.db = self.pool.writer
+        self.write_lock = threading.RLock()
+        self.index_lock = ReadWriteLock()
         self.llm_api_key = llm_api_key
         self.embedding_model = embedding_model
         self.chunk_size = chunk_size
         self.overlap = overlap
+        self.chunk_unit = chunk_unit
         self.top_k = top_k
         self.search_threshold = search_threshold
+        self.retrieval_mode = retrieval_mode
+        self.rrf_k = rrf_k
+        self.lexical_candidates = lexical_candidates
+        self.lexical_prefilter = lexical_prefilter
         self.max_token_length = max_token_length
+        self.context_window = context_window
+        self.history_turns = history_turns
+        self.summary_tokens = summary_tokens
+        self.llm_summaries = llm_summaries
+        self.query_rewrite = query_rewrite
+        self._token_counter = None
         self.cache_size = cache_size
+        self.embed_batch_size = embed_batch_size
+        self.encode_processes = encode_processes
+        self.ingest_batch_size = ingest_batch_size
+        self.ingest_workers = ingest_workers
+        self.embedding_errors = []
         self.text_dict = {}
         self.verbose = verbose
-        self.model = SentenceTransformer(embedding_model)
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{embedding_backend}', expected one of {EMBEDDING_BACKENDS}")
+        self.embedding_backend = embedding_backend
+        # Cache keys of embeddings and search results depend on the model and its backend
+        self.embedding_key = embedding_model if embedding_backend == 'torch' else f'{embedding_model}#{embedding_backend}'
+        # The model is loaded on the first encode
+        self._model = None
+        self._model_lock = threading.Lock()
         self.llm_engine = llm_engine
+        self.llm_base_url = llm_base_url
+        self.llm_timeout = llm_timeout
+        self.llm_retries = llm_retries
+        self._llm_client = None
+        # One asynchronous client per event loop, as its connections are bound to the loop they were opened on
+        self._async_llm_clients = weakref.WeakKeyDictionary()
+        self._async_llm_clients_lock = threading.Lock()
+        self.pdf_dir = pdf_dir
+        self.renderer = PageRenderer(cache_dir=page_cache_dir or os.path.splitext(db_path)[0] + '_pages', dpi=render_dpi,
+                                     max_memory_mb=page_cache_memory_mb, max_disk_mb=page_cache_disk_mb, verbose=verbose)
         self.initialize_database()
+        # OCR output is cached in the database through a connection of its own
+        self.ocr = PageOCR(db=self.pool.connect(), engine=ocr_engine, languages=ocr_languages, dpi=ocr_dpi,
+                           min_chars=ocr_min_chars, workers=ocr_workers, timeout=ocr_timeout,
+                           verbose=verbose) if ocr_engine else None
+        self.cache = RAGCache(cache_size, db=self.pool.connect() if persist_cache else None)
+        self.reranker = Reranker(reranker_model, cache=self.cache, batch_size=rerank_batch_size,
+                                 verbose=verbose) if reranker_model else None
+        self.rerank_candidates = rerank_candidates
+        # Concurrent query encodes share one model call
+        self.query_encoder = MicroBatcher(self._encode_query_batch, max_batch_size=query_batch_size,
+                                          max_wait=query_batch_wait_ms / 1000, name='query-encoder')
+
+        # One vector index per collection over the pre-normalized embeddings, persisted next to the database
+        dim = self._embedding_dimension()
+        base_path = os.path.splitext(db_path)[0]
+        if embedding_storage == 'mmap':
+            if index_type != 'flat':
+                raise ValueError("embedding_storage='mmap' is only supported with index_type='flat'")
+            factory = lambda collection: MmapFlatIndex(dim, collection_path(base_path, collection), dtype=vector_dtype,
+                                                       rescore=self._fetch_embeddings, oversample=rescore_oversample)
+        elif embedding_storage == 'sqlite':
+            index_params = {'nprobe': nprobe, 'n_lists': n_lists} if index_type != 'flat' else {}
+            factory = lambda collection: create_index(index_type, dim, **index_params)
+        else:
+            raise ValueError(f"Unknown embedding storage '{embedding_storage}', expected 'sqlite' or 'mmap'")
+        self.index = CollectionIndex(dim, factory)
+        self.index_path = base_path + f'.{index_type}.npz'
+        self.load_index()
+
+        self.metrics.gauge('indexed_chunks', lambda: len(self.index))
+        self.metrics.gauge('cache_hits', lambda: self.cache.hits)
+        self.metrics.gauge('cache_misses', lambda: self.cache.misses)
+        self.metrics.gauge('query_encode_batch_size', lambda: self.query_encoder.mean_batch_size)
+        if metrics_path is not None:
+            self.metrics.start_exporter(metrics_path)
+
+    @property
+    def model(self):
+        """
+        The sentence transformer model, loaded on first use.
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    model = self._load_model()
+                    # The index is sized before the model loads when the dimension is known up front
+                    index = getattr(self, 'index', None)
+                    if index is not None and model.get_sentence_embedding_dimension() != index.dim:
+                        raise ValueError(f"{self.embedding_model} produces {model.get_sentence_embedding_dimension()}-"
+                                         f"dimensional embeddings, the index holds {index.dim}-dimensional ones")
+                    self._model = model
+                    self.metrics.observe('model_load', time.perf_counter() - start)
+                    if self.verbose:
+                        print(f"Debug: loaded {self.embedding_key} in {time.perf_counter() - start:.1f} s")
+        return self._model
+
+    def warm_up(self):
+        """
+        Loads the embedding model, and the reranker if any, in a background thread, so that
+        an application can start immediately and still have them ready for its first question.
+
+        Returns:
+            threading.Thread: The loading thread.
+        """
+        def load():
+            self.model
+            if self.reranker is not None:
+                self.reranker.model
+
+        thread = threading.Thread(target=load, name='model-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    def _load_model(self):
+        """
+        Loads the embedding model with the configured inference backend.
+        """
+        from sentence_transformers import SentenceTransformer
+
+        if self.embedding_backend == 'onnx':
+            return SentenceTransformer(self.embedding_model, backend='onnx')
+        if self.embedding_backend == 'onnx-int8':
+            return SentenceTransformer(self.embedding_model, backend='onnx', model_kwargs={'file_name': ONNX_INT8_FILE})
+        if self.embedding_backend == 'torch-int8':
+            import torch
+            model = SentenceTransformer(self.embedding_model, device='cpu')
+            return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return SentenceTransformer(self.embedding_model)
+
+    def _embedding_dimension(self):
+        """
+        Returns the embedding dimension, taken from the stored embeddings or the known
+        models when possible so that the model does not have to be loaded.
+        """
+        if self._model is None:
+            row = self.db.execute("SELECT embedding FROM embeddings LIMIT 1").fetchone()
+            if row is not None:
+                return len(row[0]) // np.dtype(np.float32).itemsize
+            if self.embedding_model in KNOWN_EMBEDDING_DIMENSIONS:
+                return KNOWN_EMBEDDING_DIMENSIONS[self.embedding_model]
+        return self.model.get_sentence_embedding_dimension()
 
     def initialize_database(self):
         """
@@ -52,94 +290,658 @@ class RAG:
         """
         cursor = self.db.cursor()
 
-        # Create the text_chunks table
+        # Create the text_chunks table; AUTOINCREMENT keeps IDs of deleted chunks from being reused
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS text_chunks (
-            id INTEGER PRIMARY KEY,
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
             chunk TEXT NOT NULL,
             pdf_filename TEXT NOT NULL,
             page_number INTEGER NOT NULL
         )
     ''')
 
-        # Create the embeddings table
+        # Create the embeddings table, one embedding per chunk
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS embeddings (
-                chunk_id INTEGER NOT NULL,
+                chunk_id INTEGER PRIMARY KEY,
                 embedding BLOB NOT NULL,
                 FOREIGN KEY (chunk_id) REFERENCES text_chunks (id)
             )
         ''')
 
+        # Create the documents table, one row per ingested PDF content
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                pdf_filename TEXT NOT NULL,
+                file_hash TEXT NOT NULL,
+                file_size INTEGER,
+                n_pages INTEGER,
+                n_chunks INTEGER,
+                ingested_at REAL,
+                collection TEXT NOT NULL DEFAULT '{DEFAULT_COLLECTION}'
+            )
+        ''')
+        # Metadata columns, added to databases created before they existed
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(documents)")]
+        for column in ('file_size', 'n_pages', 'n_chunks'):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE documents ADD COLUMN {column} INTEGER")
+        if 'ingested_at' not in columns:
+            cursor.execute("ALTER TABLE documents ADD COLUMN ingested_at REAL")
+        if 'collection' not in columns:
+            cursor.execute(f"ALTER TABLE documents ADD COLUMN collection TEXT NOT NULL DEFAULT '{DEFAULT_COLLECTION}'")
+
+        # Create the chunk_pages table, every page a chunk was taken from
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_pages (
+                chunk_id INTEGER NOT NULL,
+                pdf_filename TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                FOREIGN KEY (chunk_id) REFERENCES text_chunks (id)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_pages_chunk_id ON chunk_pages (chunk_id)")
+
+        # Create the document_pages table, how and how fast every page of a document was extracted
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_pages (
+                file_hash TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                method TEXT NOT NULL,
+                extract_ms REAL NOT NULL,
+                n_chars INTEGER NOT NULL,
+                PRIMARY KEY (file_hash, page_number)
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO chunk_pages (chunk_id, pdf_filename, page_number)
+            SELECT id, pdf_filename, page_number FROM text_chunks
+            WHERE id NOT IN (SELECT chunk_id FROM chunk_pages)
+        ''')
+
+        # Content hashes on chunks, added to databases created before they existed
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(text_chunks)")]
+        if 'chunk_hash' not in columns:
+            cursor.execute("ALTER TABLE text_chunks ADD COLUMN chunk_hash TEXT")
+        if 'file_hash' not in columns:
+            cursor.execute("ALTER TABLE text_chunks ADD COLUMN file_hash TEXT")
+        # Chunks of databases created before collections belong to the default collection
+        if 'collection' not in columns:
+            cursor.execute(f"ALTER TABLE text_chunks ADD COLUMN collection TEXT NOT NULL DEFAULT '{DEFAULT_COLLECTION}'")
+        self._migrate_chunk_ids(cursor)
+
+        cursor.execute("SELECT id, chunk FROM text_chunks WHERE chunk_hash IS NULL")
+        cursor.executemany("UPDATE text_chunks SET chunk_hash = ? WHERE id = ?",
+                           [(self._content_hash(chunk), chunk_id) for chunk_id, chunk in cursor.fetchall()])
+
+        # Older versions re-embedded every chunk on each upload; keep one embedding per chunk
+        # and enforce it in tables created before chunk_id became the primary key
+        if not any(row[1] == 'chunk_id' and row[5] for row in cursor.execute("PRAGMA table_info(embeddings)")):
+            cursor.execute("DELETE FROM embeddings WHERE rowid NOT IN (SELECT MIN(rowid) FROM embeddings GROUP BY chunk_id)")
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_embeddings_chunk_id ON embeddings (chunk_id)")
+
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_text_chunks_chunk_hash ON text_chunks (chunk_hash)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_text_chunks_pdf_filename ON text_chunks (pdf_filename)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_pages_pdf_filename ON chunk_pages (pdf_filename, page_number)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_file_hash ON documents (file_hash)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_pdf_filename ON documents (pdf_filename)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_text_chunks_collection ON text_chunks (collection)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_collection ON documents (collection, pdf_filename)")
+
+        # Create the BM25 keyword index over the chunk text, built from existing chunks the first time
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'text_chunks_fts'")
+        fts_exists = cursor.fetchone() is not None
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS text_chunks_fts
+                USING fts5(chunk, content='text_chunks', content_rowid='id')
+            ''')
+            if not fts_exists:
+                cursor.execute("INSERT INTO text_chunks_fts (text_chunks_fts) VALUES ('rebuild')")
+            self.fts_enabled = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5
+            self.fts_enabled = False
+
         self.db.commit()
+
+    @staticmethod
+    def _migrate_chunk_ids(cursor):
+        """
+        Rebuilds a text_chunks table created before it used AUTOINCREMENT, keeping every
+        chunk ID. Without it the IDs of the newest deleted chunks were handed out again,
+        so stale index entries and cached search results could point at other chunks.
+        """
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'text_chunks'")
+        if 'AUTOINCREMENT' in cursor.fetchone()[0].upper():
+            return
+        cursor.execute(f'''
+            CREATE TABLE text_chunks_autoincrement (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chunk TEXT NOT NULL,
+                pdf_filename TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                chunk_hash TEXT,
+                file_hash TEXT,
+                collection TEXT NOT NULL DEFAULT '{DEFAULT_COLLECTION}'
+            )
+        ''')
+        # Same IDs, so rowids of the keyword index and the vector index stay valid
+        cursor.execute('''
+            INSERT INTO text_chunks_autoincrement (id, chunk, pdf_filename, page_number, chunk_hash, file_hash, collection)
+            SELECT id, chunk, pdf_filename, page_number, chunk_hash, file_hash, collection FROM text_chunks
+        ''')
+        cursor.execute("DROP TABLE text_chunks")
+        cursor.execute("ALTER TABLE text_chunks_autoincrement RENAME TO text_chunks")
+
+    @staticmethod
+    def _content_hash(content):
+        """
+        Returns the SHA-256 hex digest of a chunk's text or a file's bytes.
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return hashlib.sha256(content).hexdigest()
     
 
     def clear_database(self):
         """
-        Clears all data from the text_chunks and embeddings tables in the database.
+        Clears all data from the text_chunks, chunk_pages, embeddings and documents tables in the database.
+        """
+        with self.write_lock:
+            cursor = self.db.cursor()
+            cursor.execute("DELETE FROM text_chunks")
+            cursor.execute("DELETE FROM chunk_pages")
+            if self.fts_enabled:
+                cursor.execute("INSERT INTO text_chunks_fts (text_chunks_fts) VALUES ('delete-all')")
+            cursor.execute("DELETE FROM embeddings")
+            cursor.execute("DELETE FROM documents")
+            cursor.execute("DELETE FROM document_pages")
+            self.db.commit()
+            with self.index_lock.write():
+                self.index.reset()
+            self.index.save(self.index_path)
+            self.cache.clear('search')
+
+    def _delete_chunks(self, chunk_ids):
         """
+        Removes chunks from the vector index and from every table, without committing.
+        The vector index goes first, so searches never return IDs whose rows are gone.
+        Callers finish with `_commit_deletions`.
+        """
+        if not chunk_ids:
+            return
+        with self.index_lock.write():
+            self.index.remove(chunk_ids)
         cursor = self.db.cursor()
-        cursor.execute("DELETE FROM text_chunks")
-        cursor.execute("DELETE FROM embeddings")
+        params = [(chunk_id,) for chunk_id in chunk_ids]
+        if self.fts_enabled:
+            # The keyword index holds no text of its own and needs the old text to delete a row
+            for start in range(0, len(chunk_ids), 500):
+                window = chunk_ids[start:start + 500]
+                cursor.execute(f'''
+                    INSERT INTO text_chunks_fts (text_chunks_fts, rowid, chunk)
+                    SELECT 'delete', id, chunk FROM text_chunks WHERE id IN ({','.join('?' * len(window))})
+                ''', window)
+        cursor.executemany("DELETE FROM embeddings WHERE chunk_id = ?", params)
+        cursor.executemany("DELETE FROM chunk_pages WHERE chunk_id = ?", params)
+        cursor.executemany("DELETE FROM text_chunks WHERE id = ?", params)
+
+    def _commit_deletions(self):
+        """
+        Commits the open write transaction and saves the vector index, then drops the cached
+        search results. The persistent cache writes through its own connection, so clearing
+        it before the commit would wait for the writer's lock.
+        """
         self.db.commit()
+        self.index.save(self.index_path)
+        self.cache.clear('search')
 
-    def extract_and_store_text(self, pdf_files):
+    def _delete_document_rows(self, document_ids):
         """
-        Extracts text from PDF files, chunks it, and stores it in the database.
-        
+        Removes rows of the documents table, and the page log of files no other row refers to,
+        without committing.
+        """
+        if not document_ids:
+            return
+        cursor = self.db.cursor()
+        placeholders = ','.join('?' * len(document_ids))
+        cursor.execute(f"SELECT DISTINCT file_hash FROM documents WHERE id IN ({placeholders})", document_ids)
+        file_hashes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f"DELETE FROM documents WHERE id IN ({placeholders})", document_ids)
+        # The same file may also be stored in another collection
+        cursor.executemany("DELETE FROM document_pages WHERE file_hash = ? "
+                           "AND NOT EXISTS (SELECT 1 FROM documents WHERE documents.file_hash = document_pages.file_hash)",
+                           [(file_hash,) for file_hash in file_hashes])
+
+    def delete_document(self, pdf_filename, collection=None):
+        """
+        Removes one document: its chunks, their pages, embeddings and keyword and vector
+        index entries, and its row in the documents table.
+
         Args:
-            pdf_files: List of PDF files to process.
+            pdf_filename (str): Name of the PDF, as stored with its chunks.
+            collection (str): Collection to remove the document from, or None to remove it from every collection.
+
+        Returns:
+            int: Number of chunks removed.
         """
+        with self.write_lock:
+            cursor = self.db.cursor()
+            scope, params = ("", (pdf_filename,))
+            if collection is not None:
+                scope, params = "AND collection = ?", (pdf_filename, collection)
+            try:
+                cursor.execute(f"SELECT id FROM text_chunks WHERE pdf_filename = ? {scope}", params)
+                chunk_ids = [row[0] for row in cursor.fetchall()]
+                self._delete_chunks(chunk_ids)
+                cursor.execute(f"SELECT id FROM documents WHERE pdf_filename = ? {scope}", params)
+                self._delete_document_rows([row[0] for row in cursor.fetchall()])
+            except BaseException:
+                self.db.rollback()
+                raise
+            self._commit_deletions()
+            if self.verbose:
+                print(f"Debug: deleted {pdf_filename} with {len(chunk_ids)} chunks")
+            return len(chunk_ids)
 
-        # Extract text from PDF files
-        text_dict = self.get_text(pdf_files)
+    def delete_collection(self, collection):
+        """
+        Removes every document of a collection.
+
+        Args:
+            collection (str): Name of the collection.
+
+        Returns:
+            int: Number of chunks removed.
+        """
+        with self.write_lock:
+            cursor = self.db.cursor()
+            try:
+                cursor.execute("SELECT id FROM text_chunks WHERE collection = ?", (collection,))
+                chunk_ids = [row[0] for row in cursor.fetchall()]
+                self._delete_chunks(chunk_ids)
+                cursor.execute("SELECT id FROM documents WHERE collection = ?", (collection,))
+                self._delete_document_rows([row[0] for row in cursor.fetchall()])
+            except BaseException:
+                self.db.rollback()
+                raise
+            self._commit_deletions()
+            if self.verbose:
+                print(f"Debug: deleted collection '{collection}' with {len(chunk_ids)} chunks")
+            return len(chunk_ids)
 
-        # Chunk the extracted text
-        chunks = self.chunk_text(text_dict)
-        #chunks = self.haystack_text_chunker(text_dict)
+    def replace_document(self, pdf_file, progress_callback=None, collection=DEFAULT_COLLECTION):
+        """
+        Replaces the stored version of a document with a new one of the same name in a collection.
 
-        # Store the chunks in the database
-        self.store_chunks(chunks)
+        The new version is ingested before the old one is removed, so searches always
+        find one of them, and its unchanged chunks reuse the embeddings of the old
+        version. Nothing happens if the content did not change, or if the new version is
+        skipped as a copy of another document in the collection.
 
-        # Create embeddings
-        self.create_embeddings()
+        Args:
+            pdf_file: The new PDF file; its name identifies the document.
+            progress_callback (callable): See `extract_and_store_text`.
+            collection (str): Name of the collection holding the document.
 
-        return chunks
+        Returns:
+            int: Number of new chunks stored.
+        """
+        with self.write_lock:
+            file_hash = self._content_hash(pdf_file.read())
+            pdf_file.seek(0)
+            cursor = self.db.cursor()
+            cursor.execute("SELECT id, file_hash FROM documents WHERE pdf_filename = ? AND collection = ?",
+                           (pdf_file.name, collection))
+            old_documents = cursor.fetchall()
+            if any(old_hash == file_hash for _, old_hash in old_documents):
+                # Unchanged; only ingested again to retry pages whose OCR timed out or was unavailable
+                return self.extract_and_store_text([pdf_file], progress_callback, collection)
+            cursor.execute("SELECT id FROM text_chunks WHERE pdf_filename = ? AND collection = ?", (pdf_file.name, collection))
+            old_chunk_ids = [row[0] for row in cursor.fetchall()]
+
+            n_chunks = self.extract_and_store_text([pdf_file], progress_callback, collection)
+            cursor.execute("SELECT 1 FROM documents WHERE pdf_filename = ? AND file_hash = ? AND collection = ?",
+                           (pdf_file.name, file_hash, collection))
+            if cursor.fetchone() is None:
+                # Skipped as a copy of another document in the collection; the old version stays
+                if self.verbose:
+                    print(f"Debug: kept the stored version of {pdf_file.name}, the new one was not ingested")
+                return n_chunks
 
-    def get_text(self, pdf_files):
+            try:
+                self._delete_chunks(old_chunk_ids)
+                self._delete_document_rows([document_id for document_id, _ in old_documents])
+            except BaseException:
+                self.db.rollback()
+                raise
+            self._commit_deletions()
+            return n_chunks
+
+    def list_documents(self, collection=None):
         """
-        Function to extract the text from one or more PDF file
+        Returns the ingested documents with their metadata.
 
         Args:
-            pdf_files (files): The PDF files to extract the text from
+            collection (str): Only list the documents of this collection; None lists all.
 
         Returns:
-            text_dict (dict): The text extracted for each page number 
-                with references to the source pdf and page
+            list of dict: 'pdf_filename', 'file_hash', 'file_size' (bytes), 'n_pages', 'n_chunks',
+                'ingested_at' (Unix time) and 'collection' of each document, by filename. Metadata
+                of documents ingested by older versions is None.
+        """
+        scope, params = ("WHERE collection = ?", (collection,)) if collection is not None else ("", ())
+        with self.pool.reader() as db:
+            rows = db.execute(f'''
+                SELECT pdf_filename, file_hash, file_size, n_pages, n_chunks, ingested_at, collection
+                FROM documents {scope} ORDER BY pdf_filename, collection
+            ''', params).fetchall()
+        keys = ('pdf_filename', 'file_hash', 'file_size', 'n_pages', 'n_chunks', 'ingested_at', 'collection')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def list_collections(self):
+        """
+        Returns the collections holding documents.
+
+        Returns:
+            list of dict: 'collection', 'n_documents' and 'n_chunks' of each collection, by name.
+        """
+        with self.pool.reader() as db:
+            rows = db.execute('''
+                SELECT d.collection, COUNT(*), (SELECT COUNT(*) FROM text_chunks t WHERE t.collection = d.collection)
+                FROM documents d GROUP BY d.collection ORDER BY d.collection
+            ''').fetchall()
+        return [{'collection': collection, 'n_documents': n_documents, 'n_chunks': n_chunks}
+                for collection, n_documents, n_chunks in rows]
+
+    @staticmethod
+    def _normalize(embeddings):
+        """
+        L2-normalizes a vector or the rows of a matrix so that dot products are cosine similarities.
+
+        Args:
+            embeddings (np.ndarray): A 1-D vector or 2-D matrix of embeddings.
+
+        Returns:
+            np.ndarray: float32 array of the same shape with unit-length rows.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    def load_index(self):
         """
+        Loads the vector index of every collection, either from its persisted file or by
+        rebuilding it from the embeddings stored in the database. Rebuilding is also the
+        migration path of existing databases to the memory-mapped vector file.
+        """
+        with self.write_lock, self.index_lock.write():
+            cursor = self.db.cursor()
+            cursor.execute('''
+                SELECT t.collection, COUNT(*) FROM embeddings e JOIN text_chunks t ON t.id = e.chunk_id
+                GROUP BY t.collection
+            ''')
+            counts = dict(cursor.fetchall())
+
+            for collection, count in counts.items():
+                index = self.index.collection(collection)
+                path = collection_path(self.index_path, collection)
+                # A persisted index is only trusted if it matches the database
+                if index.load(path) and len(index) == count:
+                    if self.verbose:
+                        print("Debug: loaded vector index from", path)
+                    continue
+
+                index.reset()
+                cursor.execute('''
+                    SELECT e.chunk_id, e.embedding FROM embeddings e JOIN text_chunks t ON t.id = e.chunk_id
+                    WHERE t.collection = ?
+                ''', (collection,))
+                while True:
+                    rows = cursor.fetchmany(10000)
+                    if not rows:
+                        break
+                    chunk_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+                    matrix = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+                    index.add(chunk_ids, self._normalize(matrix))
+                index.save(path)
+
+                if self.verbose:
+                    print(f"Debug: built vector index of collection '{collection}' with", len(index), "vectors")
+
+    def _fetch_embeddings(self, chunk_ids):
+        """
+        Reads the exact float32 embeddings of some chunks, used to rescore quantized search candidates.
+
+        Args:
+            chunk_ids (list of int): The chunk IDs.
+
+        Returns:
+            np.ndarray: Normalized embeddings in the order of `chunk_ids`.
+        """
+        placeholders = ','.join('?' * len(chunk_ids))
+        with self.pool.reader() as db:
+            blobs = dict(db.execute(f"SELECT chunk_id, embedding FROM embeddings WHERE chunk_id IN ({placeholders})",
+                                    chunk_ids).fetchall())
+        matrix = np.frombuffer(b''.join(blobs[chunk_id] for chunk_id in chunk_ids), dtype=np.float32)
+        return self._normalize(matrix.reshape(len(chunk_ids), -1))
+
+    def extract_and_store_text(self, pdf_files, progress_callback=None, collection=DEFAULT_COLLECTION):
+        """
+        Extracts text from PDF files, chunks it, and stores it in the database.
+
+        Pages are extracted, chunked, stored and embedded as a stream: every
+        `ingest_batch_size` chunks are written and embedded before more pages are read,
+        so memory use stays flat and the first chunks become searchable early. If
+        ingestion fails, the chunks it already stored are removed before the error is
+        raised, so a retry starts clean.
         
-        text_dict = {}
-        for pdf_file in pdf_files:
-            pdf = fitz.open(stream=pdf_file.read(), filetype="pdf")
+        Files whose content has already been ingested into the collection are skipped,
+        so uploading an identical PDF again does no extraction or embedding work. The
+        exception are documents with pages whose OCR timed out or was unavailable:
+        while OCR is available they are ingested again, which retries just those pages
+        (the others come from the OCR cache), and replace their stored version.
+
+        Args:
+            pdf_files: List of PDF files to process.
+            progress_callback (callable): Optional function called after every page as
+                progress_callback(filename, file_index, n_files, page_number, n_pages).
+            collection (str): Name of the collection the documents are added to; searches
+                can be restricted to collections, see `retrieve`.
+
+        Returns:
+            int: Number of new chunks stored.
+        """
+        with self.write_lock, self.metrics.profile('ingest'), self.metrics.time('ingest'):
+            # Skip files whose content hash is already in the collection, unless their OCR is incomplete
+            cursor = self.db.cursor()
+            new_files, file_hashes, file_sizes = [], {}, {}
+            stale_documents = []
+            for pdf_file in pdf_files:
+                content = pdf_file.read()
+                file_hash = self._content_hash(content)
+                pdf_file.seek(0)
+                cursor.execute("SELECT id FROM documents WHERE file_hash = ? AND collection = ?", (file_hash, collection))
+                document_ids = [row[0] for row in cursor.fetchall()]
+                if file_hash in file_hashes.values() or (document_ids and not self._ocr_incomplete(file_hash)):
+                    if self.verbose:
+                        print("Debug: skipping already ingested file", pdf_file.name)
+                    continue
+                if document_ids and self.verbose:
+                    print("Debug: ingesting again to retry failed OCR pages of", pdf_file.name)
+                stale_documents += document_ids
+                new_files.append(pdf_file)
+                file_hashes[pdf_file.name] = file_hash
+                file_sizes[pdf_file.name] = len(content)
+
+            if not new_files:
+                return 0
+
+            # Extract, chunk, store and embed the new files batch by batch
+            page_counts, chunk_counts = Counter(), Counter()
+
+            def counted(pages):
+                for (filename, page_number), text in pages:
+                    page_counts[filename] += 1
+                    yield (filename, page_number), text
+
+            page_log = []
+            pages = counted(self.iter_pages(new_files, progress_callback, page_log))
+            # Chunks stored from here on have larger IDs than every existing one
+            last_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM text_chunks").fetchone()[0]
+            n_chunks = 0
+            batch = []
+            # One encoding pool for every batch of the call, as starting one costs seconds
+            pool = self._start_encode_pool()
+            try:
+                for chunk in self.iter_chunks(pages):
+                    batch.append(chunk)
+                    chunk_counts[chunk[1][0][0]] += 1
+                    if len(batch) >= self.ingest_batch_size:
+                        n_chunks += self._store_and_embed(batch, file_hashes, collection, pool)
+                        batch = []
+                n_chunks += self._store_and_embed(batch, file_hashes, collection, pool)
+            except BaseException:
+                # Batches are committed as they go; without a documents row they would be
+                # orphans, and a retry of the same files would store them a second time
+                self.db.rollback()
+                try:
+                    self._delete_ingested_chunks(file_hashes.values(), collection, last_id)
+                except Exception as e:
+                    # The original error is the one to raise
+                    self.db.rollback()
+                    print(f"Error in removing the chunks of a failed ingestion: {e}")
+                raise
+            finally:
+                if pool is not None:
+                    self.model.stop_multi_process_pool(pool)
+
+            now = time.time()
+            cursor.executemany("INSERT INTO documents (pdf_filename, file_hash, file_size, n_pages, n_chunks, ingested_at, "
+                               "collection) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               [(filename, file_hash, file_sizes[filename], page_counts[filename], chunk_counts[filename], now,
+                                 collection) for filename, file_hash in file_hashes.items()])
+            cursor.executemany("INSERT OR REPLACE INTO document_pages (file_hash, page_number, method, extract_ms, n_chars) "
+                               "VALUES (?, ?, ?, ?, ?)",
+                               [(file_hashes[filename], page_number, method, 1000 * seconds, n_chars)
+                                for filename, page_number, method, seconds, n_chars in page_log])
+            if stale_documents:
+                # The versions ingested with failed OCR pages
+                placeholders = ','.join('?' * len(stale_documents))
+                cursor.execute(f"""
+                    SELECT t.id FROM text_chunks t JOIN documents d ON d.file_hash = t.file_hash AND d.collection = t.collection
+                    WHERE d.id IN ({placeholders}) AND t.id <= ?
+                """, stale_documents + [last_id])
+                self._delete_chunks([row[0] for row in cursor.fetchall()])
+                self._delete_document_rows(stale_documents)
+                self._commit_deletions()
+            else:
+                self.db.commit()
+                self.index.save(self.index_path)
+
+            return n_chunks
+
+    def _store_and_embed(self, chunks, file_hashes, collection=DEFAULT_COLLECTION, pool=None):
+        """
+        Stores a batch of chunks in a collection and embeds them, making them searchable.
+        Only the new chunks are embedded, so each batch costs the same however many came before.
+
+        Returns:
+            int: Number of chunks in the batch.
+        """
+        if not chunks:
+            return 0
+        chunk_ids = self.store_chunks(chunks, file_hashes, collection)
+        self.create_embeddings(save_index=False, chunk_ids=chunk_ids, pool=pool)
+        return len(chunks)
+
+    def _ocr_incomplete(self, file_hash):
+        """
+        Tells whether a stored file has pages whose OCR timed out or was unavailable,
+        and OCR is available now to retry them.
+        """
+        if self.ocr is None or not self.ocr.available:
+            return False
+        placeholders = ','.join('?' * len(OCR_RETRYABLE))
+        row = self.db.execute(f"SELECT 1 FROM document_pages WHERE file_hash = ? AND method IN ({placeholders}) LIMIT 1",
+                              (file_hash,) + OCR_RETRYABLE).fetchone()
+        return row is not None
+
+    def _delete_ingested_chunks(self, file_hashes, collection, last_id):
+        """
+        Removes the chunks an interrupted ingestion stored, those of its files with IDs
+        above `last_id`, so that ingesting them again starts clean.
+        """
+        cursor = self.db.cursor()
+        chunk_ids = []
+        for file_hash in file_hashes:
+            cursor.execute("SELECT id FROM text_chunks WHERE file_hash = ? AND collection = ? AND id > ?",
+                           (file_hash, collection, last_id))
+            chunk_ids += [row[0] for row in cursor.fetchall()]
+        self._delete_chunks(chunk_ids)
+        self._commit_deletions()
+        if self.verbose:
+            print(f"Debug: ingestion failed, removed its {len(chunk_ids)} stored chunks")
+
+    def iter_pages(self, pdf_files, progress_callback=None, page_log=None):
+        """
+        Extracts the text of one or more PDF files page by page. Scanned pages without
+        a text layer are OCRed when an OCR engine is configured.
+
+        Args:
+            pdf_files (files): The PDF files to extract the text from.
+            progress_callback (callable): Optional function called after every page as
+                progress_callback(filename, file_index, n_files, page_number, n_pages).
+            page_log (list): Optional list receiving (filename, page_number, method, seconds,
+                number of characters) for every page, see `iter_pdf_pages` for the methods.
+
+        Yields:
+            tuple: ((filename, page_number), text) for each page, in document order.
+        """
+        for file_index, pdf_file in enumerate(pdf_files):
+            source = pdf_file.read()
             filename = pdf_file.name
+            n_pages = count_pages(source)
             if self.verbose:
                 print("Debug: processing file ", filename)
 
-            for page_num in range(len(pdf)):
+            start = time.perf_counter()
+            page_info = {}
+            for page_num, current_page_text in iter_pdf_pages(source, workers=self.ingest_workers, ocr=self.ocr,
+                                                              page_info=page_info):
+                self.metrics.observe('extract', time.perf_counter() - start)
+                self.metrics.count('pages')
+                method, seconds = page_info.pop(page_num)
+                if method == 'ocr':
+                    self.metrics.observe('ocr', seconds)
+                    self.metrics.count('ocr_pages')
+                elif method == 'ocr-cached':
+                    self.metrics.count('ocr_cache_hits')
+                if page_log is not None:
+                    page_log.append((filename, page_num, method, seconds, len(current_page_text)))
                 if self.verbose:
                     print("Debug: now on page", page_num)
-                page = pdf.load_page(page_num)
-
-                current_page_text = page.get_text().replace('\n', ' ').replace('\u2009', ' ').replace('\xa0', ' ')
-                current_page_text = ' '.join(current_page_text.split())
-
-
-                # Store the temporary file name in the dictionary
-                text_dict[(filename, page_num)] = (current_page_text)
+                if progress_callback is not None:
+                    progress_callback(filename, file_index, len(pdf_files), page_num, n_pages)
+                yield (filename, page_num), current_page_text
+                # Time spent by the consumer is not extraction time
+                start = time.perf_counter()
 
+    def get_text(self, pdf_files):
+        """
+        Function to extract the text from one or more PDF file
 
-        return text_dict
+        Args:
+            pdf_files (files): The PDF files to extract the text from
 
+        Returns:
+            text_dict (dict): The text extracted for each page number 
+                with references to the source pdf and page
+        """
+        return dict(self.iter_pages(pdf_files))
 
     def chunk_text(self, text_dict):
         """
@@ -148,36 +950,26 @@ class RAG:
 
         Args:
             text_dict (dict): Dictionary with page numbers as keys and text as values.
-            max_length (int): Maximum length of each chunk.
-            overlap (int): Number of characters to overlap between chunks.
 
         Returns:
-            list of tuples: Each tuple contains (chunk, (filename, page_numbers)), 
-                            where `chunk` is the text chunk, 'filename' is the source file and `page_numbers` 
-                            is a list of page numbers from which the chunk is derived.
+            list of tuples: Each tuple contains (chunk, references), where `chunk` is the text
+                            chunk and `references` is the list of (filename, page_number) pairs
+                            from which the chunk is derived.
         """
-        overlap = self.overlap
-        chunks = []
-        current_chunk = ""
-        current_references = []  # Stores (file_name, page_number) tuples
+        return list(self.iter_chunks(text_dict.items()))
 
-        for (file_name, page_number), (text) in text_dict.items():
-            sentences = re.split(r'(?<=[.!?]) +', text)
-            for sentence in sentences:
-                if len(current_chunk) + len(sentence) > self.chunk_size and current_chunk:
-                    chunks.append((current_chunk, current_references.copy()))
-                    current_chunk = current_chunk[-overlap:]
-                    current_references = list(set(current_references + [(file_name, page_number)]))
-                current_chunk += sentence + ' '
-                current_references.append((file_name, page_number))
-                current_references = sorted(set(current_references), key=current_references.index)
+    def iter_chunks(self, pages):
+        """
+        Streaming version of `chunk_text`: splits pages into chunks as they arrive.
+        Chunks may span consecutive pages of a file and list every page they contain.
 
-            if current_chunk:
-                chunks.append((current_chunk, current_references))
-                current_chunk = ""
-                current_references = []
+        Args:
+            pages (iterable): ((filename, page_number), text) pairs, e.g. from `iter_pages`.
 
-        return chunks
+        Returns:
+            generator: (chunk, references) tuples where references is a list of (filename, page_number).
+        """
+        return iter_chunks(pages, self.chunk_size, self.overlap, unit=self.chunk_unit)
 
     # Note: tried to use haystack but messed up dependencies with pydantic so
     # could not even try to test this code
@@ -214,83 +1006,671 @@ class RAG:
 
         
     
-    def store_chunks(self, chunks):
+    def store_chunks(self, chunks, file_hashes=None, collection=DEFAULT_COLLECTION):
         """
         Stores the processed text chunks in the database.
 
         Args:
-            chunks (List[Tuple[str, Tuple[str, int]]]): List of text chunks with references.
+            chunks (List[Tuple[str, List[Tuple[str, int]]]]): List of text chunks with all the
+                (filename, page_number) references they span.
+            file_hashes (dict): Optional content hash of each source PDF, keyed by filename.
+            collection (str): Name of the collection the chunks belong to.
+
+        Returns:
+            list of int: IDs of the stored chunks.
         """
-        
-        cursor = self.db.cursor()
-        for chunk, references in chunks:
-            
-            pdf_filename, page_number = references[0]  
-            #if self.verbose:
-                #print("Debug: reference", pdf_filename, page_number)
-            cursor.execute("INSERT INTO text_chunks (chunk, pdf_filename, page_number) VALUES (?, ?, ?)", 
-                        (chunk, pdf_filename, page_number))
+        with self.write_lock, self.metrics.time('store'):
+            file_hashes = file_hashes or {}
+            cursor = self.db.cursor()
+            # IDs are assigned up front so that every table is written with one executemany;
+            # all writes go through this connection under write_lock, so they cannot collide.
+            # sqlite_sequence holds the largest ID ever used, so IDs of deleted chunks are not reused
+            row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'text_chunks'").fetchone()
+            first_id = (row[0] if row is not None else 0) + 1
+            rows = [(first_id + i, chunk, references[0][0], references[0][1], self._content_hash(chunk),
+                     file_hashes.get(references[0][0]), collection) for i, (chunk, references) in enumerate(chunks)]
+            cursor.executemany("INSERT INTO text_chunks (id, chunk, pdf_filename, page_number, chunk_hash, file_hash, "
+                               "collection) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            if self.fts_enabled:
+                cursor.executemany("INSERT INTO text_chunks_fts (rowid, chunk) VALUES (?, ?)", [row[:2] for row in rows])
+            cursor.executemany("INSERT INTO chunk_pages (chunk_id, pdf_filename, page_number) VALUES (?, ?, ?)",
+                               [(row[0], filename, page) for row, (_, references) in zip(rows, chunks)
+                                for filename, page in references])
+
+            self.db.commit()
+            self.metrics.count('chunks', len(chunks))
+            return [row[0] for row in rows]
+
+    @staticmethod
+    def _clean_text(text):
+        """
+        Drops non-ASCII characters before encoding.
+        """
+        return text.encode('ascii', 'ignore').decode('ascii')
 
-        self.db.commit()
+    def _length_sorted_batches(self, rows):
+        """
+        Splits rows into batches of similar tokenized length so that little
+        padding is wasted when a batch is encoded.
+
+        Args:
+            rows (list of tuples): (key, cleaned_text) pairs, e.g. chunk hash and text.
 
-    def create_embeddings(self):
+        Yields:
+            list of tuples: Batches of at most `embed_batch_size` rows.
         """
-        Creates embeddings for each chunk stored in the database using the sentence transformer model.
+        texts = [text for _, text in rows]
+        try:
+            lengths = [len(ids) for ids in self.model.tokenizer(texts, add_special_tokens=False)['input_ids']]
+        except Exception:
+            lengths = [len(text) for text in texts]
+
+        order = np.argsort(lengths, kind='stable')
+        for start in range(0, len(order), self.embed_batch_size):
+            yield [rows[i] for i in order[start:start + self.embed_batch_size]]
+
+    def _encode_batch(self, texts, pool=None):
         """
-        cursor = self.db.cursor()
-        cursor.execute("SELECT id, chunk FROM text_chunks")
-        rows = cursor.fetchall()
+        Encodes a batch of texts, using the multi-process pool when one is running.
 
-        for row in rows:
-            try:
+        Returns:
+            np.ndarray: float32 matrix with one embedding per text.
+        """
+        if pool is not None:
+            embeddings = self.model.encode_multi_process(texts, pool, batch_size=self.embed_batch_size)
+        else:
+            embeddings = self.model.encode(texts, batch_size=self.embed_batch_size, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def _start_encode_pool(self):
+        """
+        Starts the multi-process encoding pool when `encode_processes` asks for one.
 
-                raw_text = row[1]
-                cleaned_text = ''.join(char for char in raw_text if ord(char) < 128)
-                embedding = self.model.encode(cleaned_text)
-                cursor.execute("INSERT INTO embeddings (chunk_id, embedding) VALUES (?, ?)", (row[0], embedding.tobytes()))
+        Returns:
+            dict: The pool, to be stopped with `model.stop_multi_process_pool`, or None.
+        """
+        if self.encode_processes and self.encode_processes > 1:
+            return self.model.start_multi_process_pool(target_devices=['cpu'] * self.encode_processes)
+        return None
 
-            # Rest of the code...
-            except Exception as e:
-                print(f"Error encoding text: {row[1]}")
-                print("Error message:", e)
-                continue  # Skip this row and continue with the next
+    def create_embeddings(self, save_index=True, chunk_ids=None, pool=None):
+        """
+        Creates embeddings for the chunks stored in the database that do not have one yet,
+        using the sentence transformer model.
 
-        self.db.commit()
+        Missing chunks are processed in windows. A chunk whose text hash matches an already
+        embedded chunk reuses that embedding, and identical texts within a window are encoded
+        once. The remaining texts are grouped into length-sorted batches, encoded one batch
+        at a time (optionally across several CPU processes) and written with one executemany
+        per window. A batch that fails to encode is skipped and recorded in `embedding_errors`
+        without affecting the other batches.
+
+        Args:
+            save_index (bool): Persist the vector index afterwards; ingestion saves once at the end instead.
+            chunk_ids (list of int): IDs of just stored chunks to embed, instead of scanning
+                the database for every chunk without an embedding.
+            pool (dict): Running multi-process pool to encode with, kept running afterwards;
+                by default one is started for this call when `encode_processes` asks for it.
+
+        Returns:
+            list of int: IDs of chunks that could not be embedded.
+        """
+        with self.write_lock:
+            cursor = self.db.cursor()
+            if chunk_ids is not None:
+                missing_ids = list(chunk_ids)
+            else:
+                cursor.execute("""
+                    SELECT t.id FROM text_chunks t
+                    LEFT JOIN embeddings e ON e.chunk_id = t.id
+                    WHERE e.chunk_id IS NULL
+                """)
+                missing_ids = [row[0] for row in cursor.fetchall()]
+
+            own_pool = pool is None and bool(missing_ids)
+            if own_pool:
+                pool = self._start_encode_pool()
+
+            self.embedding_errors = []
+            window_size = self.embed_batch_size * 16
+            try:
+                for start in range(0, len(missing_ids), window_size):
+                    window_ids = missing_ids[start:start + window_size]
+                    placeholders = ','.join('?' * len(window_ids))
+                    cursor.execute(f"SELECT id, chunk, chunk_hash, collection FROM text_chunks WHERE id IN ({placeholders})",
+                                   window_ids)
+                    rows = cursor.fetchall()
+
+                    # Embeddings of identical text that is already in the database
+                    hashes = list({row[2] for row in rows})
+                    placeholders = ','.join('?' * len(hashes))
+                    cursor.execute(f"""
+                        SELECT t.chunk_hash, e.embedding FROM text_chunks t
+                        JOIN embeddings e ON e.chunk_id = t.id
+                        WHERE t.chunk_hash IN ({placeholders})
+                    """, hashes)
+                    known = {chunk_hash: np.frombuffer(blob, dtype=np.float32) for chunk_hash, blob in cursor.fetchall()}
+
+                    # Encode each unknown text once
+                    to_encode = {}
+                    for _, chunk, chunk_hash, _ in rows:
+                        if chunk_hash not in known and chunk_hash not in to_encode:
+                            to_encode[chunk_hash] = self._clean_text(chunk)
+
+                    for batch in self._length_sorted_batches(list(to_encode.items())):
+                        try:
+                            with self.metrics.time('embed'):
+                                embeddings = self._encode_batch([text for _, text in batch], pool)
+                            self.metrics.count('embeddings', len(batch))
+                        except Exception as e:
+                            failed = {chunk_hash for chunk_hash, _ in batch}
+                            self.embedding_errors.append(([row[0] for row in rows if row[2] in failed], str(e)))
+                            continue
+                        known.update(zip((chunk_hash for chunk_hash, _ in batch), embeddings))
+
+                    embedded = [(row[0], row[3], known[row[2]]) for row in rows if row[2] in known]
+                    self.metrics.count('embeddings_reused', len(rows) - len(to_encode))
+                    if not embedded:
+                        continue
+                    embedded_ids = np.array([chunk_id for chunk_id, _, _ in embedded], dtype=np.int64)
+                    collections = np.array([collection for _, collection, _ in embedded], dtype=object)
+                    embeddings = np.vstack([embedding for _, _, embedding in embedded])
+                    cursor.executemany("INSERT OR REPLACE INTO embeddings (chunk_id, embedding) VALUES (?, ?)",
+                                       zip(embedded_ids.tolist(), (embedding.tobytes() for embedding in embeddings)))
+                    # Commit first, so searches never find ids whose rows they cannot read yet
+                    self.db.commit()
+                    normalized = self._normalize(embeddings)
+                    with self.index_lock.write():
+                        for collection in set(collections):
+                            rows_in = collections == collection
+                            self.index.add(embedded_ids[rows_in], normalized[rows_in], collection)
+            finally:
+                if own_pool and pool is not None:
+                    self.model.stop_multi_process_pool(pool)
+
+            self.db.commit()
+            if save_index:
+                self.index.save(self.index_path)
+            if missing_ids:
+                # The corpus changed, so cached search results are stale
+                self.cache.clear('search')
+
+            failed_ids = [chunk_id for chunk_ids, _ in self.embedding_errors for chunk_id in chunk_ids]
+            if self.verbose:
+                print(f"Debug: embedded {len(missing_ids) - len(failed_ids)} new chunks")
+                if failed_ids:
+                    print(f"Debug: {len(failed_ids)} chunks in {len(self.embedding_errors)} batches could not be embedded")
+            return failed_ids
 
-    def semantic_search(self, query):
+    def semantic_search(self, query, filters=None):
         """
         Performs semantic search to find the most relevant text chunks for a given query.
 
+        Depending on `retrieval_mode` chunks are ranked by cosine similarity, by BM25
+        keyword relevance, or by reciprocal rank fusion of both. With a `reranker_model`
+        the best `rerank_candidates` of that ranking are reranked by the cross-encoder.
+
         Args:
             query (str): User's query string.
+            filters (dict): Optional metadata filters, see `retrieve`.
 
         Returns:
             List[int]: List of chunk IDs representing the top search results.
         """
-        cleaned_query = ''.join(char for char in query if ord(char) < 128)
-        query_embedding = self.model.encode(cleaned_query)
-        cursor = self.db.cursor()
-        cursor.execute("SELECT chunk_id, embedding FROM embeddings")
-        rows = cursor.fetchall()
+        top_chunk_ids, _ = self._ranked_search(query, filters=filters)
+        return top_chunk_ids
+
+    @staticmethod
+    def _search_filters(filters):
+        """
+        Validates search filters and brings them into one canonical form.
+
+        Returns:
+            dict: 'collection' and 'pdf_filename' as sorted lists and 'pages' as a (first, last)
+                tuple, each only if given; empty if nothing is filtered.
+        """
+        canonical = {}
+        for name, value in (filters or {}).items():
+            if name not in SEARCH_FILTERS:
+                raise ValueError(f"Unknown search filter '{name}', expected one of {SEARCH_FILTERS}")
+            if value is None:
+                continue
+            if name == 'pages':
+                first, last = value
+                canonical[name] = (int(first), int(last))
+            else:
+                canonical[name] = sorted({value} if isinstance(value, str) else set(value))
+        return canonical
+
+    @staticmethod
+    def _filter_sql(filters, column):
+        """
+        Builds an SQL condition restricting a chunk ID column to the chunks matching
+        canonical filters, answered from the indexes on collection, filename and page.
+
+        Returns:
+            tuple: (condition, parameters); the condition is empty if nothing is filtered.
+        """
+        conditions, params = [], []
+        if 'collection' in filters:
+            conditions.append(f"{column} IN (SELECT id FROM text_chunks WHERE collection IN "
+                              f"({','.join('?' * len(filters['collection']))}))")
+            params.extend(filters['collection'])
+        page_conditions = []
+        if 'pdf_filename' in filters:
+            page_conditions.append(f"pdf_filename IN ({','.join('?' * len(filters['pdf_filename']))})")
+            params.extend(filters['pdf_filename'])
+        if 'pages' in filters:
+            page_conditions.append("page_number BETWEEN ? AND ?")
+            params.extend(filters['pages'])
+        if page_conditions:
+            conditions.append(f"{column} IN (SELECT chunk_id FROM chunk_pages WHERE {' AND '.join(page_conditions)})")
+        return ' AND '.join(conditions), params
+
+    def _candidate_ids(self, filters):
+        """
+        Looks up the chunks matching filename or page filters, so that only they are scored.
 
-        similarities = []  # This will store the list of (chunk_id, similarity score)
+        Returns:
+            list of int: The matching chunk IDs, or None if neither filter is set.
+        """
+        if 'pdf_filename' not in filters and 'pages' not in filters:
+            return None
+        condition, params = self._filter_sql(filters, 'id')
+        with self.pool.reader() as db:
+            return [row[0] for row in db.execute(f"SELECT id FROM text_chunks WHERE {condition}", params)]
+
+    def _search_index(self, query_embedding, k, filters):
+        """
+        Searches the vector index within canonical filters. Only the indexes of the filtered
+        collections are scanned, and with filename or page filters only the matching chunks
+        are scored, so the cost follows the size of the filtered subset.
 
-        for row in rows:
-            chunk_id = row[0]
-            embedding = np.frombuffer(row[1], dtype=np.float32)
-            sim_score = np.dot(query_embedding, embedding) / (np.linalg.norm(query_embedding) * np.linalg.norm(embedding))  # Calculate similarity score
+        Returns:
+            tuple: (ids, scores) arrays of the k best chunks, sorted by decreasing cosine similarity.
+        """
+        candidate_ids = self._candidate_ids(filters)
+        with self.index_lock.read():
+            if candidate_ids is None:
+                ids, scores = self.index.search(query_embedding, k, filters.get('collection'))
+                self.metrics.count('scan_rows', self.index.size(filters.get('collection')))
+                return ids, scores
+            ids, scores = self.index.score_ids(query_embedding, candidate_ids)
+        self.metrics.count('scan_rows', len(ids))
+        rows = top_k_rows(scores, k)
+        return ids[rows], scores[rows]
+
+    def _ranked_search(self, query, timings=None, filters=None):
+        """
+        Ranks chunks for a query in the configured retrieval mode, using the search cache.
+
+        Args:
+            query (str): User's query string.
+            timings (dict): Optional dict receiving the 'encode_ms' and 'score_ms' stage timings,
+                and 'rerank_ms' with a reranker.
+            filters (dict): Optional metadata filters, see `retrieve`.
 
-            similarities.append((chunk_id, sim_score))  # Append the tuple (chunk_id, similarity score)
+        Returns:
+            tuple: (chunk IDs, scores) best first. Scores are cosine similarities, BM25
+                scores or fused reciprocal rank scores depending on the retrieval mode, or
+                cross-encoder scores with a reranker.
+        """
+        timings = {} if timings is None else timings
+        timings.setdefault('encode_ms', 0.0)
+        timings.setdefault('score_ms', 0.0)
+        start = time.perf_counter()
+        query = normalize_query(query)
+        filters = self._search_filters(filters)
+        # Every setting the ranking depends on, read when searching as they can be changed at runtime
+        search_key = cache_key('scored', self.embedding_key, query, self.top_k, self.search_threshold, self.retrieval_mode,
+                               self.index.search_params, self.rrf_k, self.lexical_candidates, self.lexical_prefilter,
+                               self.reranker and (self.reranker.model_name, self.rerank_candidates), filters)
+        cached = self.cache.get('search', search_key)
+        if cached is not None:
+            timings['score_ms'] += 1000 * (time.perf_counter() - start)
+            top_chunk_ids, scores = cached
+            self.prerender_sources(top_chunk_ids)
+            return list(top_chunk_ids), list(scores)
+
+        # The reranker picks the top_k chunks from a wider candidate set
+        k = max(self.top_k, self.rerank_candidates) if self.reranker is not None else self.top_k
+        if self.retrieval_mode == 'vector' or not self.fts_enabled:
+            top_chunk_ids, scores = self._vector_search(query, timings, k, filters)
+        elif self.retrieval_mode == 'bm25':
+            top_chunk_ids, scores = self.lexical_search(query, k, filters=filters)
+            timings['score_ms'] += 1000 * (time.perf_counter() - start)
+        elif self.retrieval_mode == 'hybrid':
+            top_chunk_ids, scores = self._hybrid_search(query, timings, k, filters)
+        else:
+            raise ValueError(f"Unknown retrieval mode '{self.retrieval_mode}', expected 'vector', 'bm25' or 'hybrid'")
 
-        # Sort based on similarity score
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        if self.reranker is not None:
+            top_chunk_ids, scores = self._rerank(query, top_chunk_ids, timings)
 
-        # Return the top k chunk IDs
-        top_chunk_ids = [chunk_id for chunk_id, _ in similarities[:self.top_k]]
         if self.verbose:
             print('Semantic search returning IDs', top_chunk_ids)
         
-        return top_chunk_ids
+        self.cache.put('search', search_key, (top_chunk_ids, scores))
+        self.prerender_sources(top_chunk_ids)
+        return list(top_chunk_ids), list(scores)
+
+    def retrieve(self, query, filters=None):
+        """
+        Single-pass retrieval: one query embedding, one index scan and one database
+        query fetching the text and every source page of the top chunks.
+
+        Filters restrict the search before any chunk is scored: only the vector indexes of
+        the selected collections are scanned, and filename or page filters look up the
+        matching chunks in the database and score only those.
+
+        Args:
+            query (str): User's query string.
+            filters (dict): Optional metadata filters: 'collection' (a name or list of names),
+                'pdf_filename' (a name or list of names) and 'pages' (first and last page
+                number, 0-based like the references of the chunks). A chunk matches the page
+                filters if any of its pages does.
+
+        Returns:
+            dict: 'query', 'chunks' (list of dicts with 'id', 'text', 'score' and 'pages',
+                the (pdf_filename, page_number) pairs the chunk was taken from, best chunk first)
+                and 'timings' ('encode_ms', 'score_ms', 'rerank_ms' with a reranker, and 'fetch_ms';
+                the language model functions add 'llm_ms' when given the result).
+        """
+        timings = {}
+        with self.metrics.profile('query'):
+            top_chunk_ids, scores = self._ranked_search(query, timings, filters)
+
+            start = time.perf_counter()
+            found = self._fetch_chunks(top_chunk_ids)
+            chunks = [{'id': chunk_id, 'text': found[chunk_id][0], 'score': float(score), 'pages': found[chunk_id][1]}
+                      for chunk_id, score in zip(top_chunk_ids, scores) if chunk_id in found]
+            timings['fetch_ms'] = 1000 * (time.perf_counter() - start)
+
+        for stage in ('encode', 'score', 'rerank', 'fetch'):
+            if f'{stage}_ms' in timings:
+                self.metrics.observe(stage, timings[f'{stage}_ms'] / 1000)
+        self.metrics.observe('retrieve', sum(timings.values()) / 1000)
+        self.metrics.count('queries')
+
+        return {'query': query, 'chunks': chunks, 'timings': timings}
+
+    def _fetch_chunks(self, chunk_ids):
+        """
+        Fetches the text and source pages of chunks with one query.
+
+        Args:
+            chunk_ids (list of int): The IDs of the chunks.
+
+        Returns:
+            dict: chunk ID -> (text, list of (pdf_filename, page_number) in page order);
+                unknown IDs are left out.
+        """
+        if not chunk_ids:
+            return {}
+        placeholders = ','.join('?' * len(chunk_ids))
+        with self.pool.reader() as db:
+            rows = db.execute(f'''
+                SELECT text_chunks.id, text_chunks.chunk, chunk_pages.pdf_filename, chunk_pages.page_number
+                FROM text_chunks LEFT JOIN chunk_pages ON chunk_pages.chunk_id = text_chunks.id
+                WHERE text_chunks.id IN ({placeholders})
+                ORDER BY text_chunks.id, chunk_pages.rowid
+            ''', list(chunk_ids)).fetchall()
+        found = {}
+        for chunk_id, chunk, pdf_filename, page_number in rows:
+            pages = found.setdefault(chunk_id, (chunk, []))[1]
+            if pdf_filename is not None:
+                pages.append((pdf_filename, page_number))
+        return found
+
+    def prerender_sources(self, chunk_ids):
+        """
+        Starts rendering the source pages of chunks in the background, if `pdf_dir` is set.
+
+        Args:
+            chunk_ids (list of int): The IDs of the chunks whose pages to render.
+        """
+        if self.pdf_dir is None or not chunk_ids:
+            return None
+        placeholders = ','.join('?' * len(chunk_ids))
+        with self.pool.reader() as db:
+            rows = db.execute(f"SELECT DISTINCT pdf_filename, page_number FROM chunk_pages WHERE chunk_id IN ({placeholders})",
+                              list(chunk_ids)).fetchall()
+        pages = [(os.path.join(self.pdf_dir, pdf_filename), page_number) for pdf_filename, page_number in rows]
+        return self.renderer.prerender(pages)
+
+    def _rerank(self, query, chunk_ids, timings):
+        """
+        Reranks first-stage candidates with the cross-encoder and keeps the best `top_k`.
+
+        Returns:
+            tuple: (chunk IDs, cross-encoder scores) best first.
+        """
+        start = time.perf_counter()
+        texts = {}
+        if chunk_ids:
+            placeholders = ','.join('?' * len(chunk_ids))
+            with self.pool.reader() as db:
+                texts = dict(db.execute(f"SELECT id, chunk FROM text_chunks WHERE id IN ({placeholders})",
+                                        list(chunk_ids)).fetchall())
+        candidates = [(chunk_id, texts[chunk_id]) for chunk_id in chunk_ids if chunk_id in texts]
+        top_chunk_ids, scores = self.reranker.rerank(query, candidates, self.top_k)
+        timings['rerank_ms'] = timings.get('rerank_ms', 0.0) + 1000 * (time.perf_counter() - start)
+        self.metrics.count('rerank_pairs', len(candidates))
+        return top_chunk_ids, scores
+
+    def _vector_search(self, query, timings, k, filters):
+        """
+        Ranks chunks by cosine similarity with the query embedding.
+
+        Returns:
+            tuple: (chunk IDs, similarities) of the `k` top chunks above `search_threshold`.
+        """
+        start = time.perf_counter()
+        query_embedding = self.encode_query(query)
+        encoded = time.perf_counter()
+
+        top_chunk_ids, similarities = self._search_index(query_embedding, k, filters)
+
+        if self.search_threshold is not None:
+            keep = similarities >= self.search_threshold
+            top_chunk_ids, similarities = top_chunk_ids[keep], similarities[keep]
+
+        timings['encode_ms'] += 1000 * (encoded - start)
+        timings['score_ms'] += 1000 * (time.perf_counter() - encoded)
+        return top_chunk_ids.tolist(), similarities.tolist()
+
+    @staticmethod
+    def _fts_query(text, phrase=False):
+        """
+        Turns free text into an FTS5 query, quoting every word so that punctuation
+        and FTS5 operators in the text cannot cause syntax errors.
+
+        Args:
+            text (str): The query text.
+            phrase (bool): Match the words as one exact phrase instead of any of them.
+
+        Returns:
+            str: The FTS5 MATCH expression, or None if the text has no words.
+        """
+        words = re.findall(r'\w+', text)
+        if not words:
+            return None
+        if phrase:
+            return '"' + ' '.join(words) + '"'
+        return ' OR '.join(f'"{word}"' for word in words)
+
+    def lexical_search(self, query, k, phrase=False, filters=None):
+        """
+        BM25 keyword search over the chunk text with the SQLite FTS5 index.
+
+        Args:
+            query (str): User's query string.
+            k (int): Maximum number of results.
+            phrase (bool): Only return chunks containing the words as one exact phrase.
+            filters (dict): Optional metadata filters, see `retrieve`.
+
+        Returns:
+            tuple: (chunk IDs, BM25 scores) best first; higher scores are better.
+        """
+        match = self._fts_query(query, phrase)
+        if match is None or not self.fts_enabled:
+            return [], []
+        condition, params = self._filter_sql(self._search_filters(filters), 'rowid')
+        with self.pool.reader() as db:
+            rows = db.execute(f'''
+                SELECT rowid, bm25(text_chunks_fts) AS score FROM text_chunks_fts
+                WHERE text_chunks_fts MATCH ? {'AND ' + condition if condition else ''} ORDER BY score LIMIT ?
+            ''', (match, *params, k)).fetchall()
+        # FTS5 reports BM25 as a negative number, lower being better
+        return [row[0] for row in rows], [-row[1] for row in rows]
+
+    def _hybrid_search(self, query, timings, k, filters):
+        """
+        Fuses the BM25 and vector rankings with reciprocal rank fusion.
+
+        Chunks containing a quoted phrase of the query, or the whole query as an exact
+        phrase, come first; if there are at least `k` of them no embedding is computed.
+        With `lexical_prefilter` only the BM25 candidates are scored with vectors. Vector
+        candidates below `search_threshold` are left out of the vector ranking.
+
+        Returns:
+            tuple: (chunk IDs, scores) of the `k` top chunks. Fused scores are at most
+                2 / (rrf_k + 1); exact phrase matches score above 1.
+        """
+        start = time.perf_counter()
+        quoted = re.findall(r'"([^"]+)"', query)
+        phrase_ids = []
+        for phrase in quoted or [query]:
+            ids, _ = self.lexical_search(phrase, k, phrase=True, filters=filters)
+            phrase_ids.extend(chunk_id for chunk_id in ids if chunk_id not in phrase_ids)
+        phrase_ids = phrase_ids[:k]
+        phrase_scores = [1.0 + 1.0 / (self.rrf_k + rank + 1) for rank in range(len(phrase_ids))]
+        if len(phrase_ids) >= k:
+            timings['score_ms'] += 1000 * (time.perf_counter() - start)
+            return phrase_ids, phrase_scores
+
+        lexical_ids, _ = self.lexical_search(query, self.lexical_candidates, filters=filters)
+        lexical_done = time.perf_counter()
+        query_embedding = self.encode_query(query)
+        encoded = time.perf_counter()
+        if self.lexical_prefilter and lexical_ids:
+            with self.index_lock.read():
+                vector_ids, similarities = self.index.score_ids(query_embedding, lexical_ids)
+            order = np.argsort(-similarities, kind='stable')
+            vector_ids, similarities = vector_ids[order], similarities[order]
+            self.metrics.count('scan_rows', len(lexical_ids))
+        else:
+            vector_ids, similarities = self._search_index(query_embedding, self.lexical_candidates, filters)
+        if self.search_threshold is not None:
+            # Same cut as vector retrieval; weak vector matches neither add rank nor fill the results
+            vector_ids = vector_ids[similarities >= self.search_threshold]
+
+        fused = {}
+        for ranking in (lexical_ids, vector_ids.tolist()):
+            for rank, chunk_id in enumerate(ranking):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        ranked = [chunk_id for chunk_id in sorted(fused, key=fused.get, reverse=True) if chunk_id not in phrase_ids]
+        ranked = ranked[:k - len(phrase_ids)]
+
+        timings['encode_ms'] += 1000 * (encoded - lexical_done)
+        timings['score_ms'] += 1000 * ((lexical_done - start) + (time.perf_counter() - encoded))
+        return phrase_ids + ranked, phrase_scores + [fused[chunk_id] for chunk_id in ranked]
+
+    def batch_semantic_search(self, queries, filters=None):
+        """
+        Semantic search for many queries at once: all queries are encoded in one
+        batched call and scored against the index with a single matrix multiply.
+        Keyword and hybrid retrieval modes, reranked searches and searches filtered
+        by filename or page search the queries one by one.
+
+        Args:
+            queries (list of str): The query strings.
+            filters (dict): Optional metadata filters applied to every query, see `retrieve`.
+
+        Returns:
+            list of list of int: The top chunk IDs for each query.
+        """
+        queries = [normalize_query(query) for query in queries]
+        filters = self._search_filters(filters)
+        if ((self.retrieval_mode != 'vector' and self.fts_enabled) or self.reranker is not None
+                or 'pdf_filename' in filters or 'pages' in filters):
+            return [self.semantic_search(query, filters) for query in queries]
+        query_embeddings = self.encode_queries(queries)
+
+        with self.index_lock.read():
+            ranked = self.index.search_batch(query_embeddings, self.top_k, filters.get('collection'))
+        results = []
+        for top_chunk_ids, similarities in ranked:
+            if self.search_threshold is not None:
+                top_chunk_ids = top_chunk_ids[similarities >= self.search_threshold]
+            results.append(top_chunk_ids.tolist())
+        return results
+
+    def encode_queries(self, queries):
+        """
+        Returns the normalized embeddings of several queries, encoding the ones
+        missing from the cache in a single batch.
+
+        Args:
+            queries (list of str): The query strings.
+
+        Returns:
+            np.ndarray: Matrix of unit-length float32 embeddings, one row per query.
+        """
+        queries = [normalize_query(query) for query in queries]
+        keys = [cache_key(self.embedding_key, query) for query in queries]
+        embeddings = [self.cache.get('embedding', key) for key in keys]
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = self._normalize(self._encode_batch([self._clean_text(queries[i]) for i in missing]))
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+                self.cache.put('embedding', keys[i], embedding)
+
+        if not embeddings:
+            return np.zeros((0, self.index.dim), dtype=np.float32)
+        return np.vstack(embeddings)
+
+    def encode_query(self, query):
+        """
+        Returns the normalized embedding of a query, using the cache when possible.
+
+        Args:
+            query (str): User's query string.
+
+        Returns:
+            np.ndarray: Unit-length float32 query embedding.
+        """
+        query = normalize_query(query)
+        embedding_key = cache_key(self.embedding_key, query)
+        query_embedding = self.cache.get('embedding', embedding_key)
+        if query_embedding is None:
+            query_embedding = self.query_encoder(self._clean_text(query))
+            self.cache.put('embedding', embedding_key, query_embedding)
+        return query_embedding
+
+    def _encode_query_batch(self, texts):
+        """
+        Encodes the queries coalesced by the query encoder in one model call.
+
+        Returns:
+            np.ndarray: Unit-length float32 embeddings, one row per text.
+        """
+        return self._normalize(self._encode_batch(texts))
+
+    def close(self):
+        """
+        Closes the database connections.
+        """
+        with self.write_lock:
+            if self.cache.db is not None:
+                self.cache.flush()
+                self.cache.db.close()
+            if self.ocr is not None:
+                self.ocr.close()
+                self.ocr.db.close()
+            self.pool.close()
         
     def get_chunks_by_ids(self, chunk_ids):
         """
@@ -301,24 +1681,53 @@ class RAG:
 
         Returns:
             chunks (list of tuples): A list of tuples containing the text chunk and its reference 
-                   (PDF filename, page number).
+                   (PDF filename, page number) of its first page, or None if an ID is unknown.
         """
-        chunks = []
-        cursor = self.db.cursor()
-        
-        for chunk_id in chunk_ids:
-            cursor.execute("SELECT chunk, pdf_filename, page_number FROM text_chunks WHERE id = ?", (chunk_id,))
-            result = cursor.fetchone()
-
-            if result:
-                chunk, pdf_filename, page_number = result
-                chunks.append((chunk, (pdf_filename, page_number)))
-                
-            else:
-                return None
-        return chunks
+        found = self._fetch_chunks(chunk_ids)
+        if any(chunk_id not in found for chunk_id in chunk_ids):
+            return None
+        return [(found[chunk_id][0], found[chunk_id][1][0]) for chunk_id in chunk_ids]
 
 
+    def _llm_messages(self, prompt):
+        """
+        Builds the chat messages and sampling settings sent to the language model.
+
+        Returns:
+            tuple: (messages, max_tokens, temperature, completion cache key)
+        """
+        message=[{"role": "assistant", "content": "You are an expert in this content, helping to explain the text"}, {"role": "user", "content": prompt}]
+        # The same limit the prompt budget of `context_budget` reserves for the answer
+        max_tokens, temperature = self.max_token_length, 0.1
+        return message, max_tokens, temperature, cache_key(self.llm_engine, temperature, max_tokens, message)
+
+    def _client(self):
+        """
+        Returns the OpenAI client, created on first use.
+        """
+        if self._llm_client is None:
+            import openai
+            self._llm_client = openai.OpenAI(api_key=self.llm_api_key, base_url=self.llm_base_url,
+                                             timeout=self.llm_timeout, max_retries=self.llm_retries)
+        return self._llm_client
+
+    def _async_client(self):
+        """
+        Returns the asynchronous OpenAI client of the running event loop, created on
+        first use. Each `asyncio.run` gets its own client, since a client reused after
+        its loop closed fails with "Event loop is closed". Retries are handled by
+        `stream_llm` so that they can back off and be cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        with self._async_llm_clients_lock:
+            client = self._async_llm_clients.get(loop)
+            if client is None:
+                import openai
+                client = openai.AsyncOpenAI(api_key=self.llm_api_key, base_url=self.llm_base_url,
+                                            timeout=self.llm_timeout, max_retries=0)
+                self._async_llm_clients[loop] = client
+        return client
+
     def integrate_llm(self, prompt):
         """
         Generates a response using a large language model based on the given prompt.
@@ -330,71 +1739,403 @@ class RAG:
             str: The generated response from the language model.
         """
         
-        message=[{"role": "assistant", "content": "You are an expert in this content, helping to explain the text"}, {"role": "user", "content": prompt}]
+        message, max_tokens, temperature, completion_key = self._llm_messages(prompt)
+        cached_response = self.cache.get('completion', completion_key)
+        if cached_response is not None:
+            return cached_response
+
         try:
-            response = openai.chat.completions.create(
-                model=self.llm_engine,  
-                messages=message,
-                max_tokens=250,  
-                temperature=0.1  
-            )
+            with self.metrics.time('llm'):
+                response = self._client().chat.completions.create(
+                    model=self.llm_engine,  
+                    messages=message,
+                    max_tokens=max_tokens,  
+                    temperature=temperature  
+                )
             # Extracting the content from the response
             chat_message = response.choices[0].message
             if self.verbose:
                 print(chat_message)
+            self._record_llm_usage(prompt, chat_message.content, getattr(response, 'usage', None))
+            if chat_message.content is not None:
+                self.cache.put('completion', completion_key, chat_message.content)
             return chat_message.content
     
         except Exception as e:
             print(f"Error in generating response: {e}")
             return None
         
+    async def stream_llm(self, prompt):
+        """
+        Streams a language model response token by token.
+
+        Failed requests are retried with exponential backoff as long as no token has been
+        received yet. Cancelling the consuming task closes the underlying HTTP stream.
+
+        Args:
+            prompt (str): Prompt string including context and query for the language model.
+
+        Yields:
+            str: Pieces of the response text as they arrive.
+        """
+        message, max_tokens, temperature, completion_key = self._llm_messages(prompt)
+        cached_response = self.cache.get('completion', completion_key)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        import openai
+        retryable = (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError)
+        start = time.perf_counter()
+        for attempt in range(self.llm_retries + 1):
+            pieces = []
+            try:
+                stream = await self._async_client().chat.completions.create(
+                    model=self.llm_engine,
+                    messages=message,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True
+                )
+                try:
+                    async for event in stream:
+                        if not event.choices:
+                            continue
+                        piece = event.choices[0].delta.content
+                        if piece:
+                            if not pieces:
+                                self.metrics.observe('llm_first_token', time.perf_counter() - start)
+                            pieces.append(piece)
+                            yield piece
+                finally:
+                    await stream.response.aclose()
+                break
+            except retryable as e:
+                # A partially streamed answer cannot be retried without repeating tokens
+                if pieces or attempt == self.llm_retries:
+                    raise
+                delay = 0.5 * 2 ** attempt + random.uniform(0, 0.25)
+                if self.verbose:
+                    print(f"Debug: retrying language model request in {delay:.2f}s after {e!r}")
+                await asyncio.sleep(delay)
+
+        self.metrics.observe('llm', time.perf_counter() - start)
+        self._record_llm_usage(prompt, ''.join(pieces))
+        if pieces:
+            self.cache.put('completion', completion_key, ''.join(pieces))
+
+    def _record_llm_usage(self, prompt, response, usage=None):
+        """
+        Counts a language model request and its tokens, as reported by the API or counted locally.
+        """
+        if not self.metrics.enabled:
+            return
+        self.metrics.count('llm_requests')
+        if usage is not None and getattr(usage, 'prompt_tokens', None) is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            prompt_tokens = self.count_tokens(prompt) + MESSAGE_OVERHEAD_TOKENS
+            completion_tokens = self.count_tokens(response or '')
+        self.metrics.count('llm_prompt_tokens', prompt_tokens)
+        self.metrics.count('llm_completion_tokens', completion_tokens)
+
+    async def async_integrate_llm(self, prompt, on_token=None):
+        """
+        Asynchronous version of `integrate_llm`.
+
+        Args:
+            prompt (str): Prompt string including context and query for the language model.
+            on_token (callable): Optional function called with the text received so far after every token.
+
+        Returns:
+            str: The generated response, or None if the request failed.
+        """
+        pieces = []
+        try:
+            async for piece in self.stream_llm(prompt):
+                pieces.append(piece)
+                if on_token is not None:
+                    on_token(''.join(pieces))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error in generating response: {e}")
+            return None
+        return ''.join(pieces)
+
+    def count_tokens(self, text):
+        """
+        Counts the tokens of a text with tiktoken (estimated if tiktoken is unavailable).
+        """
+        if self._token_counter is None:
+            self._token_counter = token_counter()
+        return self._token_counter(text)
+
+    @property
+    def context_budget(self):
+        """
+        Number of prompt tokens available: the model's context window minus the tokens
+        reserved for the response and the chat message overhead.
+        """
+        window = self.context_window or context_window(self.llm_engine)
+        return window - self.max_token_length - MESSAGE_OVERHEAD_TOKENS
+
+    def search_query(self, question, conversation=None):
+        """
+        Returns the text to search for: the latest question only, or with `query_rewrite`
+        a short standalone rewrite of it that resolves references to earlier turns.
+
+        Args:
+            question (str): The latest question.
+            conversation (Conversation): The conversation so far.
+
+        Returns:
+            str: The search query.
+        """
+        if not self.query_rewrite or conversation is None or not len(conversation):
+            return question
+        previous = conversation.turns[-1] if conversation.turns else ('', '')
+        prompt = (f"Conversation summary: {conversation.summary}\n"
+                  f"Previous question: {previous[0]}\nPrevious answer: {first_sentence(previous[1])}\n"
+                  f"Rewrite the following question as one short standalone search query. "
+                  f"Reply with the query only.\nQuestion: {question}")
+        rewrite = self.integrate_llm(fit_tokens(prompt, self.context_budget, self.count_tokens, keep='tail'))
+        if not rewrite:
+            return question
+        return fit_tokens(' '.join(rewrite.split()), REWRITE_TOKENS, self.count_tokens)
+
+    def record_turn(self, conversation, question, answer):
+        """
+        Adds a turn to a conversation, folding the turns beyond the `history_turns` most
+        recent ones into its rolling summary, so the conversation stays bounded.
+
+        Args:
+            conversation (Conversation): The conversation to update.
+            question (str): The question of the turn.
+            answer (str): The answer of the turn.
+        """
+        conversation.turns.append((question, answer or ''))
+        while len(conversation.turns) > self.history_turns:
+            old_question, old_answer = conversation.turns.pop(0)
+            conversation.summary = self._fold_summary(conversation.summary, old_question, old_answer)
+            conversation.n_summarized += 1
+
+    def _fold_summary(self, summary, question, answer):
+        """
+        Adds one turn to a rolling summary of at most `summary_tokens` tokens. With
+        `llm_summaries` the language model rewrites the summary; otherwise, or if that
+        fails, the question and the first sentence of the answer are appended and the
+        oldest words dropped.
+        """
+        if self.llm_summaries:
+            prompt = (f"Summary so far: {summary}\nQ: {question}\nA: {answer}\n"
+                      f"Update the summary with this exchange in at most {self.summary_tokens} tokens. "
+                      f"Reply with the summary only.")
+            updated = self.integrate_llm(fit_tokens(prompt, self.context_budget, self.count_tokens, keep='tail'))
+            if updated:
+                return fit_tokens(' '.join(updated.split()), self.summary_tokens, self.count_tokens)
+        folded = f"{summary} Q: {question} A: {first_sentence(answer)}".strip()
+        return fit_tokens(folded, self.summary_tokens, self.count_tokens, keep='tail')
+
+    def build_prompt(self, question, conversation=None, chunks=()):
+        """
+        Packs retrieved chunks and conversation history into the prompt token budget.
+
+        The question always goes in, then the chunks best first, then the recent turns
+        newest first, then the summary of older turns; whatever no longer fits is left
+        out (the first chunk is shortened rather than dropped).
+
+        Args:
+            question (str): The latest question.
+            conversation (Conversation): Optional conversation so far.
+            chunks (list of str): Retrieved chunk texts, best first.
 
-    def generate_response(self, query):
+        Returns:
+            tuple: (prompt, number of prompt tokens)
+        """
+        question_text = f"Q: {question}" if conversation is not None and len(conversation) else question
+        budget = self.context_budget - self.count_tokens(question_text)
+
+        packed_chunks = []
+        for chunk in chunks:
+            n_tokens = self.count_tokens(chunk) + 1
+            if n_tokens > budget:
+                if not packed_chunks:
+                    chunk = fit_tokens(chunk, budget - 1, self.count_tokens)
+                    packed_chunks.append(chunk)
+                    budget -= self.count_tokens(chunk) + 1
+                break
+            packed_chunks.append(chunk)
+            budget -= n_tokens
+
+        history = []
+        if conversation is not None:
+            for turn_question, turn_answer in reversed(conversation.turns):
+                turn = f"Q: {turn_question}\nA: {turn_answer}"
+                n_tokens = self.count_tokens(turn) + 1
+                if n_tokens > budget:
+                    break
+                history.insert(0, turn)
+                budget -= n_tokens
+            if conversation.summary and len(history) == len(conversation.turns):
+                summary = fit_tokens(f"Summary of the earlier conversation: {conversation.summary}",
+                                     budget - 1, self.count_tokens, keep='tail')
+                if summary:
+                    history.insert(0, summary)
+                    budget -= self.count_tokens(summary) + 1
+
+        parts = ([" ".join(packed_chunks)] if packed_chunks else []) + history + [question_text]
+        prompt = "\n".join(parts)
+        if self.verbose:
+            print(f'Prompt of {self.context_budget - budget} tokens: {len(packed_chunks)}/{len(chunks)} chunks, '
+                  f'{len(history)} history entries')
+        return prompt, self.context_budget - budget
+
+    def _rag_prompt(self, query, retrieval, conversation=None):
+        """
+        Builds the language model prompt from retrieved chunks and the conversation so far.
+
+        Returns:
+            str: The prompt, or None if no relevant chunk was found.
+        """
+        if not retrieval['chunks']:
+            return None
+
+        prompt, _ = self.build_prompt(query, conversation, [chunk['text'] for chunk in retrieval['chunks']])
+        return prompt
+
+    def new_conversation(self):
+        """
+        Returns an empty conversation for `record_turn` and the response functions.
+        """
+        return Conversation()
+
+    def generate_response(self, query, retrieval=None, conversation=None, filters=None):
         """
         Generates a response to a given query using semantic search and large language model integration.
 
         Args:
             query (str): The query string for which a response is required.
+            retrieval (dict): Result of `retrieve` to answer from, e.g. retrieved for the latest
+                question only while `query` holds the whole conversation. Retrieves for `query`
+                if omitted. Its timings receive 'llm_ms'.
+            conversation (Conversation): Earlier turns, packed into the prompt within the token budget.
+            filters (dict): Optional metadata filters of the retrieval, see `retrieve`.
 
         Returns:
             str: Generated response to the query.
         """
-        
-        best_chunk_ids = self.semantic_search(query)
-        if best_chunk_ids:
-            chunks = []
-            cursor = self.db.cursor()
-
-            for best_chunk_id in best_chunk_ids:
-                cursor.execute("SELECT chunk FROM text_chunks WHERE id = ?", (best_chunk_id,))
-                chunk = cursor.fetchone()
-                if chunk:
-                    chunks.append(chunk[0])
-
-            combined_chunks = " ".join(chunks)
-            response = self.integrate_llm(combined_chunks + "\n" + query)
+        retrieval = retrieval if retrieval is not None else self.retrieve(self.search_query(query, conversation), filters)
+        prompt = self._rag_prompt(query, retrieval, conversation)
+        if prompt is not None:
+            start = time.perf_counter()
+            with self.metrics.profile('query'):
+                response = self.integrate_llm(prompt)
+            retrieval['timings']['llm_ms'] = 1000 * (time.perf_counter() - start)
             return response
         else:
             return "Sorry, I couldn't find a relevant response."
-        
-        
-    def get_page_image(self, pdf_file, page_num):
+
+    async def async_generate_response(self, query, on_token=None, retrieval=None, conversation=None, filters=None, on_retrieval=None):
+        """
+        Asynchronous, streaming version of `generate_response`.
+
+        Args:
+            query (str): The query string for which a response is required.
+            on_token (callable): Optional function called with the text received so far after every token.
+            retrieval (dict): Result of `retrieve` to answer from, see `generate_response`.
+            conversation (Conversation): Earlier turns, packed into the prompt within the token budget.
+            filters (dict): Optional metadata filters of the retrieval, see `retrieve`.
+            on_retrieval (callable): Optional function called with the result of `retrieve` once
+                it is available; its timings gain 'llm_ms' when the answer is complete.
+
+        Returns:
+            str: Generated response to the query.
+        """
+        if retrieval is None:
+            # Retrieval is synchronous (query rewriting, embedding, SQLite, index scans), so it runs off the event loop
+            retrieval = await asyncio.to_thread(lambda: self.retrieve(self.search_query(query, conversation), filters))
+        if on_retrieval is not None:
+            on_retrieval(retrieval)
+        prompt = self._rag_prompt(query, retrieval, conversation)
+        if prompt is None:
+            response = "Sorry, I couldn't find a relevant response."
+            if on_token is not None:
+                on_token(response)
+            return response
+        start = time.perf_counter()
+        try:
+            return await self.async_integrate_llm(prompt, on_token)
+        finally:
+            retrieval['timings']['llm_ms'] = 1000 * (time.perf_counter() - start)
+
+    async def answer_concurrently(self, query, on_rag_token=None, on_llm_token=None, timeout=None, retrieval=None, conversation=None, filters=None, on_retrieval=None):
+        """
+        Runs the RAG answer and the plain language model answer concurrently, streaming both.
+        If either fails unexpectedly or the timeout expires, the other request is cancelled.
+
+        Args:
+            query (str): The query string for which a response is required.
+            on_rag_token (callable): Called with the RAG answer so far after every token.
+            on_llm_token (callable): Called with the plain answer so far after every token.
+            timeout (float): Optional overall timeout in seconds.
+            retrieval (dict): Result of `retrieve` for the RAG answer, see `generate_response`.
+            conversation (Conversation): Earlier turns, given to both answers within the token budget.
+            filters (dict): Optional metadata filters of the retrieval, see `retrieve`.
+            on_retrieval (callable): Called with the result of `retrieve`, see `async_generate_response`.
+
+        Returns:
+            tuple: (rag_response, llm_response)
+        """
+        # Start the plain request first, it does not wait for retrieval
+        plain_prompt, _ = self.build_prompt(query, conversation)
+        llm_task = asyncio.ensure_future(self.async_integrate_llm(plain_prompt, on_llm_token))
+        await asyncio.sleep(0)
+        rag_task = asyncio.ensure_future(self.async_generate_response(query, on_rag_token, retrieval, conversation, filters,
+                                                                   on_retrieval))
+        try:
+            return tuple(await asyncio.wait_for(asyncio.gather(rag_task, llm_task), timeout))
+        except BaseException:
+            for task in (rag_task, llm_task):
+                task.cancel()
+            raise
+
+    def evaluate_questions(self, qa_pairs, results_path, max_workers=8, client=None, include_llm=True):
+        """
+        Evaluates a question set in batch mode, see `rag_eval.run_evaluation`.
+
+        Args:
+            qa_pairs (list of tuples or str): (question, reference answer) pairs, or the path
+                of a question file with Q:/A: lines such as assets/question_doc.txt.
+            results_path (str): JSON lines file the per-question results are appended to;
+                an interrupted run resumes from it.
+            max_workers (int): Maximum number of concurrent language model requests.
+            client: OpenAI compatible client, defaults to the client used by `integrate_llm`.
+            include_llm (bool): Also request the plain LLM answer for comparison.
+
+        Returns:
+            dict: p50/p95 latencies, token counts and retrieval hit rate.
+        """
+        import rag_eval
+
+        if isinstance(qa_pairs, str):
+            qa_pairs = rag_eval.read_question_answer_pairs(qa_pairs)
+        return rag_eval.run_evaluation(self, qa_pairs, results_path, max_workers=max_workers,
+                                       client=client, include_llm=include_llm)
+
+    def get_page_image(self, pdf_file, page_num, dpi=None):
         """
         Extracts and returns a specific page image from a PDF file.
 
+        Images come from the page render cache; the document is opened only on a miss
+        and then stays open for later pages.
+
         Args:
-            pdf_file: The PDF file to extract the image from.
+            pdf_file: The PDF file (path or uploaded file) to extract the image from.
             page_num: The page number to extract the image for.
+            dpi (int): Resolution of the image, defaults to render_dpi.
 
         Returns:
             BytesIO object containing the image.
         """
-        pdf = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        page = pdf.load_page(page_num)
-        page_image = page.get_pixmap()
-
-        image_bytes = io.BytesIO()
-        page_image.save(image_bytes, 'png')
-        image_bytes.seek(0)
-
-        return image_bytes
+        return io.BytesIO(self.renderer.render(pdf_file, page_num, dpi))
@@ -0,0 +1,229 @@
+"""
+OCR fallback for scanned and image-only PDF pages.
+
+Pages whose text layer is (nearly) empty but that contain images are rasterized
+with PyMuPDF and recognized by Tesseract in a process pool, while the pages with
+text pass straight through, so only the pages that need OCR pay for it. Results
+are cached in SQLite by a hash of the page content (its drawing commands and
+embedded images), so re-ingesting a document, even under another name, never
+runs OCR on the same page twice. Pages whose OCR failed or timed out are not
+cached; uploading a document with timed out pages again retries just those pages,
+while pages the engine failed on are not retried, as they would fail again.
+
+Requires the tesseract binary and the pytesseract and Pillow packages; without
+them pages are kept as extracted and marked 'ocr-unavailable'.
+"""
+import collections
+import hashlib
+import importlib.util
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from pdf_extract import FITZ_LOCK, opened_pdf
+
+OCR_ENGINES = ('tesseract',)
+
+# Page methods of OCR that did not succeed but may next time; documents holding them are
+# ingested again while OCR is available. 'ocr-failed' pages would fail the same way
+OCR_RETRYABLE = ('ocr-timeout', 'ocr-unavailable')
+
+
+def ocr_image(png, engine='tesseract', languages='eng', timeout=60):
+    """
+    Recognizes the text of a page image. Runs in the OCR worker processes.
+
+    Args:
+        png (bytes): PNG-encoded page image.
+        engine (str): OCR engine, see OCR_ENGINES.
+        languages (str): Tesseract language codes, e.g. 'eng+deu'.
+        timeout (float): Seconds after which the OCR process is killed.
+
+    Returns:
+        tuple: (text, seconds)
+    """
+    import io
+    import pytesseract
+    from PIL import Image
+
+    from pdf_extract import clean_page_text
+
+    start = time.perf_counter()
+    text = pytesseract.image_to_string(Image.open(io.BytesIO(png)), lang=languages, timeout=timeout)
+    return clean_page_text(text), time.perf_counter() - start
+
+
+class PageOCR:
+    """
+    Replaces the text of low-text pages with OCR output, in page order.
+    """
+
+    def __init__(self, db=None, engine='tesseract', languages='eng', dpi=300, min_chars=32, workers=2, timeout=60,
+                 verbose=False):
+        """
+        Args:
+            db (sqlite3.Connection): Connection used only for the OCR cache table; None disables caching.
+            engine (str): OCR engine, see OCR_ENGINES.
+            languages (str): Tesseract language codes, e.g. 'eng+deu'.
+            dpi (int): Resolution pages are rasterized at.
+            min_chars (int): Pages with fewer extracted characters are candidates for OCR.
+            workers (int): Number of OCR processes.
+            timeout (float): Seconds allowed per page before it is kept as extracted.
+            verbose (bool): Flag to enable verbose logging for debugging.
+        """
+        if engine not in OCR_ENGINES:
+            raise ValueError(f"Unknown OCR engine '{engine}', expected one of {OCR_ENGINES}")
+        self.db = db
+        self.engine = engine
+        self.languages = languages
+        self.dpi = dpi
+        self.min_chars = min_chars
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.executor = None
+        self._available = None
+
+        if self.db is not None:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS ocr_cache (
+                    page_hash TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    seconds REAL NOT NULL
+                )
+            ''')
+            self.db.commit()
+
+    @property
+    def available(self):
+        """
+        Whether the OCR engine can be used, checked once.
+        """
+        if self._available is None:
+            try:
+                import pytesseract
+                if importlib.util.find_spec('PIL') is None:
+                    raise ImportError("Pillow is not installed")
+                pytesseract.get_tesseract_version()
+                self._available = True
+            except Exception as e:
+                if self.verbose:
+                    print(f"Debug: OCR unavailable, scanned pages keep their extracted text: {e}")
+                self._available = False
+        return self._available
+
+    def page_hash(self, pdf, page):
+        """
+        Hashes what a page shows: its content streams and the images it draws, plus
+        the OCR settings, so identical pages share a cache entry across documents.
+        """
+        digest = hashlib.sha256(f'{self.engine}:{self.languages}:{self.dpi}'.encode('utf-8'))
+        digest.update(page.read_contents())
+        for image in page.get_images(full=True):
+            digest.update(pdf.xref_stream_raw(image[0]) or b'')
+        return digest.hexdigest()
+
+    def _cached(self, page_hash):
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT text FROM ocr_cache WHERE page_hash = ?", (page_hash,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _store(self, page_hash, text, seconds):
+        if self.db is None:
+            return
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO ocr_cache (page_hash, text, seconds) VALUES (?, ?, ?)",
+                            (page_hash, text, seconds))
+            self.db.commit()
+
+    def needs_ocr(self, page, text):
+        """
+        A page needs OCR when it has (almost) no text layer but shows images.
+        """
+        return len(text) < self.min_chars and bool(page.get_images())
+
+    def apply(self, source, pages, page_info=None):
+        """
+        Runs OCR on the low-text pages of a document while passing the other pages through.
+
+        OCR runs ahead in the process pool with a bounded number of pages in flight, and
+        pages are yielded in their original order.
+
+        Args:
+            source (str or bytes): Path to the PDF or its content, for rasterizing pages.
+            pages (iterable): (page_number, text, seconds) of the extracted text layer.
+            page_info (dict): Optional dict receiving (method, seconds) for each page number;
+                method is 'text', 'ocr', 'ocr-cached', 'ocr-timeout', 'ocr-failed' or 'ocr-unavailable'.
+
+        Yields:
+            tuple: (page_number, text) for each page.
+        """
+        import fitz
+
+        in_flight = collections.deque()   # [page_number, text, method, seconds, (future, page_hash) or None]
+
+        def finish(entry):
+            page_number, text, method, seconds, job = entry
+            if job is not None:
+                future, page_hash = job
+                try:
+                    # The worker enforces the timeout itself; this only guards against a hung process
+                    ocr_text, ocr_seconds = future.result(timeout=self.timeout + 10)
+                    text, method, seconds = ocr_text, 'ocr', seconds + ocr_seconds
+                    self._store(page_hash, ocr_text, ocr_seconds)
+                except FutureTimeoutError:
+                    method = 'ocr-timeout'
+                except Exception as e:
+                    # pytesseract raises RuntimeError when it kills a page at its own timeout
+                    method = 'ocr-timeout' if 'timeout' in str(e).lower() else 'ocr-failed'
+                    if self.verbose:
+                        print(f"Debug: OCR of page {page_number} failed: {e}")
+            if page_info is not None:
+                page_info[page_number] = (method, seconds)
+            return page_number, text
+
+        with opened_pdf(source) as pdf:
+            for page_number, text, seconds in pages:
+                with FITZ_LOCK:
+                    # Pages with a text layer are not even loaded again
+                    page = pdf.load_page(page_number) if len(text) < self.min_chars else None
+                    if page is None or not self.needs_ocr(page, text):
+                        in_flight.append([page_number, text, 'text', seconds, None])
+                    elif not self.available:
+                        in_flight.append([page_number, text, 'ocr-unavailable', seconds, None])
+                    else:
+                        start = time.perf_counter()
+                        page_hash = self.page_hash(pdf, page)
+                        cached = self._cached(page_hash)
+                        if cached is not None:
+                            in_flight.append([page_number, cached, 'ocr-cached', seconds + time.perf_counter() - start, None])
+                        else:
+                            png = page.get_pixmap(dpi=self.dpi, colorspace=fitz.csGRAY).tobytes('png')
+                            future = self._executor().submit(ocr_image, png, self.engine, self.languages, self.timeout)
+                            in_flight.append([page_number, text, 'ocr', seconds + time.perf_counter() - start,
+                                              (future, page_hash)])
+
+                # Yield finished pages in order, waiting only when too much OCR is queued
+                n_jobs = sum(entry[4] is not None for entry in in_flight)
+                while in_flight and (in_flight[0][4] is None or in_flight[0][4][0].done() or n_jobs > 2 * self.workers):
+                    n_jobs -= in_flight[0][4] is not None
+                    yield finish(in_flight.popleft())
+
+            while in_flight:
+                yield finish(in_flight.popleft())
+
+    def _executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def close(self):
+        """
+        Stops the OCR processes.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
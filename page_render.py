@@ -0,0 +1,255 @@
+"""
+Cached rendering of PDF pages to PNG images.
+
+Documents stay open in a small pool of handles instead of being re-opened for
+every page, and encoded images are kept in an LRU cache keyed by (file hash,
+page, DPI), bounded in memory and mirrored to a bounded directory on disk so
+they survive restarts. Pages can be rendered ahead of time in a background
+thread, e.g. the source pages of a search result before the user asks for them.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf_extract import FITZ_LOCK
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_bytes(source):
+    """
+    Returns the content of a PDF file object. getbuffer() exposes an uploaded file's
+    bytes without copying them; other file objects are read and rewound.
+    """
+    if hasattr(source, 'getbuffer'):
+        return source.getbuffer()
+    content = source.read()
+    source.seek(0)
+    return content
+
+
+class PageRenderer:
+    """
+    Renders PDF pages through a pool of open documents and a memory + disk LRU cache.
+
+    MuPDF must not be used from several threads at once, so all document access is
+    serialized by the process-wide FITZ_LOCK that ingestion and OCR take as well;
+    cache hits never take it.
+    """
+
+    def __init__(self, cache_dir=None, dpi=110, thumbnail_dpi=30, max_memory_mb=64, max_disk_mb=512,
+                 max_open_documents=8, verbose=False):
+        """
+        Args:
+            cache_dir (str): Directory of the on-disk image cache, None keeps images in memory only.
+            dpi (int): Default resolution of rendered pages.
+            thumbnail_dpi (int): Resolution of thumbnails.
+            max_memory_mb (float): Memory budget of the cached images.
+            max_disk_mb (float): Disk budget of the image cache directory.
+            max_open_documents (int): Number of documents kept open.
+            verbose (bool): Flag to enable verbose logging for debugging.
+        """
+        self.cache_dir = cache_dir
+        self.dpi = dpi
+        self.thumbnail_dpi = thumbnail_dpi
+        self.max_memory_bytes = int(max_memory_mb * 1e6)
+        self.max_disk_bytes = int(max_disk_mb * 1e6)
+        self.max_open_documents = max_open_documents
+        self.verbose = verbose
+
+        self.images = OrderedDict()      # (file hash, page, dpi) -> PNG bytes
+        self.memory_bytes = 0
+        self.documents = OrderedDict()   # file hash -> open fitz document
+        self.path_hashes = {}            # path -> ((mtime, size), file hash)
+        self.cache_lock = threading.Lock()
+        self.document_lock = FITZ_LOCK
+        self.executor = None
+
+        self.disk_bytes = 0
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+
+    def _source_hash(self, source):
+        """
+        Identifies a PDF by the hash of its content, re-hashing a path only when the file changed.
+
+        Args:
+            source (str or file-like): Path to the PDF or an uploaded file object.
+        """
+        if isinstance(source, str):
+            stat = os.stat(source)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            known = self.path_hashes.get(source)
+            if known is None or known[0] != signature:
+                known = (signature, file_hash(source))
+                self.path_hashes[source] = known
+            return known[1]
+        return hashlib.sha256(source_bytes(source)).hexdigest()
+
+    def _document(self, source, source_hash):
+        """
+        Returns an open document from the pool, opening it and closing the least
+        recently used one if needed. Must be called with document_lock held.
+        """
+        pdf = self.documents.get(source_hash)
+        if pdf is None:
+            import fitz
+            if isinstance(source, str):
+                pdf = fitz.open(source)
+            else:
+                pdf = fitz.open(stream=bytes(source_bytes(source)), filetype="pdf")
+            self.documents[source_hash] = pdf
+            while len(self.documents) > self.max_open_documents:
+                self.documents.popitem(last=False)[1].close()
+        self.documents.move_to_end(source_hash)
+        return pdf
+
+    def _disk_path(self, key):
+        source_hash, page_number, dpi = key
+        return os.path.join(self.cache_dir, f'{source_hash}_{page_number}_{dpi}.png')
+
+    def _remember(self, key, image):
+        """
+        Adds an image to the memory cache, evicting least recently used images over budget.
+        """
+        with self.cache_lock:
+            if key in self.images:
+                self.images.move_to_end(key)
+                return
+            self.images[key] = image
+            self.memory_bytes += len(image)
+            while self.memory_bytes > self.max_memory_bytes and len(self.images) > 1:
+                self.memory_bytes -= len(self.images.popitem(last=False)[1])
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as file:
+                image = file.read()
+        except FileNotFoundError:
+            return None
+        # The modification time orders disk entries by last use
+        os.utime(path)
+        return image
+
+    def _write_disk(self, key, image):
+        """
+        Writes an image to the disk cache, deleting least recently used files over budget.
+        """
+        if self.cache_dir is None:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(image)
+        os.replace(tmp_path, path)
+        with self.cache_lock:
+            self.disk_bytes += len(image)
+            if self.disk_bytes <= self.max_disk_bytes:
+                return
+            entries = sorted((entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.png')),
+                             key=lambda entry: entry.stat().st_mtime)
+            self.disk_bytes = sum(entry.stat().st_size for entry in entries)
+            for entry in entries:
+                if self.disk_bytes <= self.max_disk_bytes or entry.path == path:
+                    break
+                self.disk_bytes -= entry.stat().st_size
+                os.remove(entry.path)
+
+    def render(self, source, page_number, dpi=None):
+        """
+        Returns the PNG image of a page, from the cache when possible.
+
+        Args:
+            source (str or file-like): Path to the PDF or an uploaded file object.
+            page_number (int): Zero-based page number.
+            dpi (int): Resolution, defaults to the renderer's dpi.
+
+        Returns:
+            bytes: The PNG-encoded page.
+        """
+        dpi = dpi or self.dpi
+        key = (self._source_hash(source), page_number, dpi)
+
+        with self.cache_lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+                return image
+
+        image = self._read_disk(key)
+        if image is None:
+            with self.document_lock:
+                pdf = self._document(source, key[0])
+                image = pdf.load_page(page_number).get_pixmap(dpi=dpi).tobytes('png')
+            self._write_disk(key, image)
+            if self.verbose:
+                print(f'Rendered page {page_number} at {dpi} dpi')
+        self._remember(key, image)
+        return image
+
+    def thumbnail(self, source, page_number):
+        """
+        Returns a small PNG image of a page, for previews.
+        """
+        return self.render(source, page_number, self.thumbnail_dpi)
+
+    def prerender(self, pages, dpi=None, thumbnails=True):
+        """
+        Renders pages in a background thread so later render calls are cache hits.
+
+        Args:
+            pages (iterable): (path, page_number) pairs; missing files are skipped.
+            dpi (int): Resolution, defaults to the renderer's dpi.
+            thumbnails (bool): Also render the thumbnails of the pages.
+
+        Returns:
+            concurrent.futures.Future: Completes when all pages are rendered.
+        """
+        pages = list(pages)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prerender')
+
+        def work():
+            for path, page_number in pages:
+                try:
+                    if thumbnails:
+                        self.thumbnail(path, page_number)
+                    self.render(path, page_number, dpi)
+                except (OSError, ValueError, RuntimeError) as e:
+                    # fitz reports missing files and bad page numbers with these
+                    if self.verbose:
+                        print(f'Could not prerender {path} page {page_number}: {e}')
+
+        return self.executor.submit(work)
+
+    def clear(self):
+        """
+        Empties the memory and disk caches and closes all documents.
+        """
+        with self.document_lock:
+            for pdf in self.documents.values():
+                pdf.close()
+            self.documents.clear()
+        with self.cache_lock:
+            self.images.clear()
+            self.memory_bytes = 0
+            if self.cache_dir is not None:
+                for entry in os.scandir(self.cache_dir):
+                    if entry.name.endswith('.png'):
+                        os.remove(entry.path)
+            self.disk_bytes = 0
@@ -0,0 +1,129 @@
+import collections
+import contextlib
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Document opened once per worker process by _init_worker
+_worker_pdf = None
+
+# MuPDF must not be used from several threads at once, so every fitz call of the
+# process (ingestion, OCR rasterizing, page rendering) holds this lock. It is
+# reentrant and only held per call or page range, never across a yield.
+FITZ_LOCK = threading.RLock()
+
+
+def clean_page_text(text):
+    """
+    Collapses newlines, thin and non-breaking spaces and runs of whitespace into single spaces.
+    """
+    text = text.replace('\n', ' ').replace('\u2009', ' ').replace('\xa0', ' ')
+    return ' '.join(text.split())
+
+
+def open_pdf(source):
+    """
+    Opens a PDF from a file path or from its bytes.
+    """
+    import fitz
+
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+
+@contextlib.contextmanager
+def opened_pdf(source):
+    """
+    Context manager opening and closing a PDF under FITZ_LOCK; calls on the
+    document in between must take the lock themselves.
+    """
+    with FITZ_LOCK:
+        pdf = open_pdf(source)
+    try:
+        yield pdf
+    finally:
+        with FITZ_LOCK:
+            pdf.close()
+
+
+def _init_worker(source):
+    global _worker_pdf
+    _worker_pdf = open_pdf(source)
+
+
+def _extract_pages(page_numbers, pdf=None):
+    """
+    Extracts the cleaned text of a range of pages.
+
+    Returns:
+        list of tuples: (page_number, text, seconds) for each page.
+    """
+    pdf = pdf if pdf is not None else _worker_pdf
+    pages = []
+    for page_num in page_numbers:
+        start = time.perf_counter()
+        with FITZ_LOCK:
+            text = clean_page_text(pdf.load_page(page_num).get_text())
+        pages.append((page_num, text, time.perf_counter() - start))
+    return pages
+
+
+def count_pages(source):
+    """
+    Returns the number of pages of a PDF.
+    """
+    with FITZ_LOCK, open_pdf(source) as pdf:
+        return len(pdf)
+
+
+def iter_pdf_pages(source, workers=0, pages_per_task=8, ocr=None, page_info=None):
+    """
+    Yields the text of every page of a PDF in page order.
+
+    With `workers` > 1 pages are extracted in a process pool in which every worker opens
+    the document once. Only a bounded number of page ranges are in flight at any time,
+    so memory use does not grow with the size of the document.
+
+    Args:
+        source (str or bytes): Path to the PDF or its content.
+        workers (int): Number of worker processes, 0 or 1 extracts in-process.
+        pages_per_task (int): Number of consecutive pages extracted per worker task.
+        ocr (ocr.PageOCR): Optional OCR fallback for scanned pages without a text layer.
+        page_info (dict): Optional dict receiving (method, seconds) for each page number,
+            method being 'text' or one of the OCR outcomes listed in `PageOCR.apply`.
+
+    Yields:
+        tuple: (page_number, text) for each page.
+    """
+    pages = _iter_text_layer(source, workers, pages_per_task)
+    if ocr is not None:
+        yield from ocr.apply(source, pages, page_info)
+        return
+    for page_num, text, seconds in pages:
+        if page_info is not None:
+            page_info[page_num] = ('text', seconds)
+        yield page_num, text
+
+
+def _iter_text_layer(source, workers, pages_per_task):
+    """
+    Yields (page_number, text, seconds) of the text layer of every page, see `iter_pdf_pages`.
+    """
+    n_pages = count_pages(source)
+    ranges = (range(start, min(start + pages_per_task, n_pages)) for start in range(0, n_pages, pages_per_task))
+
+    if not workers or workers <= 1:
+        with opened_pdf(source) as pdf:
+            for page_numbers in ranges:
+                yield from _extract_pages(page_numbers, pdf)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(source,)) as executor:
+        in_flight = collections.deque()
+        for page_numbers in ranges:
+            in_flight.append(executor.submit(_extract_pages, page_numbers))
+            if len(in_flight) >= 2 * workers:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
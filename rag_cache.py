@@ -0,0 +1,200 @@
+import hashlib
+import json
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(*parts):
+    """
+    Builds a compact cache key from any JSON-serializable parts.
+
+    Returns:
+        str: SHA-256 hex digest of the parts.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def normalize_query(query):
+    """
+    Normalizes query text so that trivially different spellings share a cache entry.
+    """
+    return ' '.join(query.split())
+
+
+class RAGCache:
+    """
+    LRU cache for query embeddings, search results and LLM completions.
+
+    Each namespace ('embedding', 'search', 'completion', ...) is an independent
+    LRU bounded by `max_size` entries. When a database connection is given, entries
+    are also written to a `cache` table so they survive application restarts.
+    Hits only update the recency in memory; the persisted `last_used` times are
+    written in batches with the next put, or after `flush_interval` seconds.
+    All operations are thread-safe.
+    """
+
+    def __init__(self, max_size=1000, db=None, flush_interval=60):
+        """
+        Args:
+            max_size (int): Maximum number of entries kept per namespace.
+            db (sqlite3.Connection): Optional connection used to persist entries, not used
+                for anything else since the cache commits after every write.
+            flush_interval (float): Maximum number of seconds hits wait before their
+                `last_used` times are persisted.
+        """
+        self.max_size = max_size
+        self.db = db
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.namespaces = {}
+        self.hits = 0
+        self.misses = 0
+        # (namespace, key) -> time of the last hit not yet persisted
+        self._used = {}
+        self._last_flush = time.monotonic()
+
+        if self.db is not None:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_used ON cache (namespace, last_used)")
+            self.db.commit()
+            self._load()
+
+    def _load(self):
+        """
+        Loads the most recently used persisted entries of every namespace.
+        """
+        cursor = self.db.cursor()
+        cursor.execute("SELECT DISTINCT namespace FROM cache")
+        for (namespace,) in cursor.fetchall():
+            cursor.execute("SELECT key, value FROM cache WHERE namespace = ? ORDER BY last_used DESC LIMIT ?",
+                           (namespace, self.max_size))
+            entries = self._namespace(namespace)
+            for key, value in reversed(cursor.fetchall()):
+                entries[key] = pickle.loads(value)
+
+    def _namespace(self, namespace):
+        if namespace not in self.namespaces:
+            self.namespaces[namespace] = OrderedDict()
+        return self.namespaces[namespace]
+
+    def get(self, namespace, key):
+        """
+        Looks up an entry and marks it as most recently used.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        with self.lock:
+            entries = self._namespace(namespace)
+            if key not in entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entries.move_to_end(key)
+            if self.db is not None:
+                self._used[(namespace, key)] = time.time()
+                if time.monotonic() - self._last_flush > self.flush_interval:
+                    self.flush()
+            return entries[key]
+
+    def get_many(self, namespace, keys):
+        """
+        Looks up several entries under one lock acquisition, marking the found ones as most
+        recently used. Like `get`, it does not touch the database.
+
+        Returns:
+            list: The cached value of each key, None for a miss.
+        """
+        with self.lock:
+            entries = self._namespace(namespace)
+            now = time.time()
+            values = []
+            for key in keys:
+                if key not in entries:
+                    self.misses += 1
+                    values.append(None)
+                    continue
+                self.hits += 1
+                entries.move_to_end(key)
+                if self.db is not None:
+                    self._used[(namespace, key)] = now
+                values.append(entries[key])
+            if self.db is not None and self._used and time.monotonic() - self._last_flush > self.flush_interval:
+                self.flush()
+            return values
+
+    def flush(self):
+        """
+        Persists the `last_used` times of the entries hit since the last flush.
+        """
+        with self.lock:
+            if self.db is not None and self._used:
+                self._write_used()
+                self.db.commit()
+            self._last_flush = time.monotonic()
+
+    def _write_used(self):
+        self.db.executemany("UPDATE cache SET last_used = ? WHERE namespace = ? AND key = ?",
+                            [(last_used, namespace, key) for (namespace, key), last_used in self._used.items()])
+        self._used = {}
+
+    def put(self, namespace, key, value):
+        """
+        Stores an entry, evicting the least recently used one if the namespace is full.
+        """
+        self.put_many(namespace, [(key, value)])
+
+    def put_many(self, namespace, items):
+        """
+        Stores several (key, value) entries with one database commit, evicting the least
+        recently used ones if the namespace is full.
+        """
+        items = list(items)
+        with self.lock:
+            entries = self._namespace(namespace)
+            for key, value in items:
+                entries[key] = value
+                entries.move_to_end(key)
+            evicted = []
+            while len(entries) > self.max_size:
+                evicted.append(entries.popitem(last=False)[0])
+
+            if self.db is not None:
+                # Recency of the hits since the last write goes into the same commit
+                self._write_used()
+                now = time.time()
+                self.db.executemany("INSERT OR REPLACE INTO cache (namespace, key, value, last_used) VALUES (?, ?, ?, ?)",
+                                    [(namespace, key, pickle.dumps(value), now) for key, value in items])
+                self.db.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?",
+                                    [(namespace, evicted_key) for evicted_key in evicted])
+                self.db.commit()
+                self._last_flush = time.monotonic()
+
+    def clear(self, namespace=None):
+        """
+        Removes all entries of one namespace, or of every namespace.
+        """
+        with self.lock:
+            if namespace is None:
+                self.namespaces = {}
+                self._used = {}
+            else:
+                self.namespaces.pop(namespace, None)
+                self._used = {used: last_used for used, last_used in self._used.items() if used[0] != namespace}
+
+            if self.db is not None:
+                if namespace is None:
+                    self.db.execute("DELETE FROM cache")
+                else:
+                    self.db.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+                self.db.commit()
@@ -0,0 +1,247 @@
+"""
+Batch evaluation of a question set against the RAG pipeline.
+
+All questions are encoded in one batched call and retrieved with a single matrix
+multiply, then the RAG and plain LLM answers are requested through a bounded pool
+of concurrent workers. Every finished question is appended to a JSON lines results
+file, so an interrupted run resumes where it stopped. A summary with p50/p95
+latencies, token counts and the retrieval hit rate is written next to it.
+
+Usage:
+    python rag_eval.py --questions assets/question_doc.txt --results assets/eval_results.jsonl
+"""
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+WORD = re.compile(r'[a-z0-9]+')
+STOPWORDS = {'the', 'and', 'for', 'you', 'are', 'can', 'that', 'this', 'with', 'from', 'will', 'your',
+             'have', 'not', 'but', 'all', 'any', 'which', 'their', 'there', 'been', 'into', 'also'}
+
+
+def read_question_answer_pairs(file_path):
+    """
+    Reads question/answer pairs from a text file where questions start with 'Q:' and
+    answers with 'A:'; answers may continue over several lines.
+
+    Returns:
+        list of tuples: (question, answer) with the 'Q:'/'A:' prefixes removed.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            lines = file.readlines()
+    except UnicodeDecodeError:
+        with open(file_path, 'r', encoding='ISO-8859-1') as file:
+            lines = file.readlines()
+
+    pairs = []
+    current_question = None
+    current_answer = ""
+    for line in lines:
+        if line.startswith('Q:'):
+            if current_question and current_answer:
+                pairs.append((current_question, current_answer.strip()))
+            current_question = line[2:].strip()
+            current_answer = ""
+        elif line.startswith('A:'):
+            current_answer = line[2:].strip()
+        elif current_question:
+            current_answer += " " + line.strip()
+
+    if current_question and current_answer:
+        pairs.append((current_question, current_answer.strip()))
+    return pairs
+
+
+def content_words(text):
+    """
+    Lowercased words of a text without very short words and common stopwords.
+    """
+    return {word for word in WORD.findall(text.lower()) if len(word) > 2 and word not in STOPWORDS}
+
+
+def answer_overlap(answer, chunks):
+    """
+    Fraction of the reference answer's content words found in the retrieved chunks.
+    """
+    answer_words = content_words(answer)
+    if not answer_words:
+        return 0.0
+    chunk_words = set().union(*(content_words(chunk) for chunk in chunks)) if chunks else set()
+    return len(answer_words & chunk_words) / len(answer_words)
+
+
+def percentile(values, q):
+    """
+    Percentile of a list of numbers, None when the list is empty.
+    """
+    values = [value for value in values if value is not None]
+    return float(np.percentile(values, q)) if values else None
+
+
+def load_completed(results_path):
+    """
+    Reads the records already written to a results file.
+
+    Returns:
+        dict: Records keyed by question index.
+    """
+    completed = {}
+    if not os.path.exists(results_path):
+        return completed
+    with open(results_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interruption; that question is run again
+                continue
+            completed[record['index']] = record
+    return completed
+
+
+def complete(client, rag, prompt):
+    """
+    Requests one completion, returning its text, token usage and latency.
+    """
+    messages, max_tokens, temperature, _ = rag._llm_messages(prompt)
+    start = time.perf_counter()
+    try:
+        response = client.chat.completions.create(model=rag.llm_engine, messages=messages,
+                                                  max_tokens=max_tokens, temperature=temperature)
+    except Exception as e:
+        return {'text': None, 'error': str(e), 'latency_ms': 1000 * (time.perf_counter() - start)}
+    usage = getattr(response, 'usage', None)
+    return {
+        'text': response.choices[0].message.content,
+        'latency_ms': 1000 * (time.perf_counter() - start),
+        'prompt_tokens': getattr(usage, 'prompt_tokens', None),
+        'completion_tokens': getattr(usage, 'completion_tokens', None),
+    }
+
+
+def summarize(records, wall_seconds=None):
+    """
+    Aggregates per-question records into latency, token and retrieval-quality metrics.
+    """
+    records = list(records)
+    summary = {'questions': len(records)}
+    if records:
+        summary['retrieval_hit_rate'] = float(np.mean([record['retrieval_hit'] for record in records]))
+        summary['mean_answer_overlap'] = float(np.mean([record['answer_overlap'] for record in records]))
+        summary['retrieval_ms_per_question'] = float(np.mean([record['retrieval_ms'] for record in records]))
+    for name in ('rag', 'llm'):
+        results = [record[name] for record in records if record.get(name)]
+        latencies = [result['latency_ms'] for result in results if result.get('latency_ms') is not None]
+        summary[name] = {
+            'latency_p50_ms': percentile(latencies, 50),
+            'latency_p95_ms': percentile(latencies, 95),
+            'prompt_tokens': sum(result.get('prompt_tokens') or 0 for result in results),
+            'completion_tokens': sum(result.get('completion_tokens') or 0 for result in results),
+            'errors': sum(1 for result in results if result.get('error')),
+        }
+    if wall_seconds is not None:
+        summary['wall_seconds'] = wall_seconds
+    return summary
+
+
+def run_evaluation(rag, qa_pairs, results_path, max_workers=8, client=None, hit_threshold=0.5, include_llm=True):
+    """
+    Evaluates a question set, resuming from an existing results file.
+
+    Args:
+        rag (RAG): The RAG instance to evaluate.
+        qa_pairs (list of tuples): (question, reference answer) pairs.
+        results_path (str): JSON lines file the per-question records are appended to.
+        max_workers (int): Maximum number of concurrent language model requests.
+        client: OpenAI compatible client (anything with chat.completions.create), defaults to the RAG's client.
+        hit_threshold (float): Minimum answer overlap for a retrieval to count as a hit.
+        include_llm (bool): Also request the plain LLM answer for comparison.
+
+    Returns:
+        dict: Summary metrics over all questions in the results file.
+    """
+    client = client or rag._client()
+    completed = load_completed(results_path)
+    pending = [i for i in range(len(qa_pairs)) if i not in completed]
+    start = time.perf_counter()
+
+    if pending:
+        # One batched encode and one matrix multiply for every pending question
+        questions = [qa_pairs[i][0] for i in pending]
+        retrieval_start = time.perf_counter()
+        chunk_id_lists = rag.batch_semantic_search(questions)
+        all_ids = sorted({chunk_id for chunk_ids in chunk_id_lists for chunk_id in chunk_ids})
+        chunk_texts = {}
+        if all_ids:
+            placeholders = ','.join('?' * len(all_ids))
+            # A pooled read connection, so evaluating never contends with the writer
+            with rag.pool.reader() as db:
+                chunk_texts = dict(db.execute(f"SELECT id, chunk FROM text_chunks WHERE id IN ({placeholders})",
+                                              all_ids).fetchall())
+        retrieval_ms = 1000 * (time.perf_counter() - retrieval_start) / len(pending)
+
+        def evaluate(i, chunk_ids):
+            question, answer = qa_pairs[i]
+            chunks = [chunk_texts[chunk_id] for chunk_id in chunk_ids if chunk_id in chunk_texts]
+            overlap = answer_overlap(answer, chunks)
+            record = {
+                'index': i, 'question': question, 'reference': answer, 'chunk_ids': chunk_ids,
+                'retrieval_ms': retrieval_ms, 'answer_overlap': overlap, 'retrieval_hit': overlap >= hit_threshold,
+            }
+            if chunks:
+                # The production prompt, packed into the same token budget
+                record['rag'] = complete(client, rag, rag.build_prompt(question, chunks=chunks)[0])
+            else:
+                record['rag'] = {'text': "Sorry, I couldn't find a relevant response.", 'latency_ms': 0.0}
+            if include_llm:
+                record['llm'] = complete(client, rag, question)
+            return record
+
+        with open(results_path, 'a', encoding='utf-8') as results_file, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(evaluate, i, chunk_ids) for i, chunk_ids in zip(pending, chunk_id_lists)]
+            for future in as_completed(futures):
+                record = future.result()
+                completed[record['index']] = record
+                results_file.write(json.dumps(record) + '\n')
+                results_file.flush()
+
+    summary = summarize(completed.values(), wall_seconds=time.perf_counter() - start)
+    summary['questions_this_run'] = len(pending)
+    with open(os.path.splitext(results_path)[0] + '.summary.json', 'w', encoding='utf-8') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', default='assets/question_doc.txt', help='Question file with Q:/A: pairs')
+    parser.add_argument('--results', default='assets/eval_results.jsonl', help='JSON lines results file (resumable)')
+    parser.add_argument('--db', default='data/db_file.db', help='Path to the SQLite database')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence transformer embedding model')
+    parser.add_argument('--llm-engine', default='gpt-3.5-turbo', help='Language model')
+    parser.add_argument('--llm-base-url', default=None, help='OpenAI compatible API base URL, e.g. a stub server')
+    parser.add_argument('--top-k', type=int, default=3, help='Number of chunks retrieved per question')
+    parser.add_argument('--workers', type=int, default=8, help='Maximum concurrent language model requests')
+    parser.add_argument('--no-llm', action='store_true', help='Skip the plain LLM comparison answers')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from my_rag import RAG
+
+    load_dotenv()
+    rag = RAG(db_path=args.db, llm_api_key=os.getenv("OPENAI_API_KEY"), embedding_model=args.model,
+              llm_engine=args.llm_engine, top_k=args.top_k, llm_base_url=args.llm_base_url)
+    qa_pairs = read_question_answer_pairs(args.questions)
+    summary = run_evaluation(rag, qa_pairs, args.results, max_workers=args.workers, include_llm=not args.no_llm)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Local HTTP endpoint serving one shared RAG instance to many clients.
+
+The model, vector index and database connections are loaded once; concurrent
+requests are handled by a thread per connection, query encodes are coalesced
+by the RAG's micro-batching encoder and searches use pooled read-only
+connections.
+
+Endpoints:
+    GET  /health       number of indexed chunks and encoder batching statistics
+    GET  /metrics      stage latency histograms and counters in the Prometheus text format
+    POST /retrieve     {"query": ...} -> retrieval result (chunks, scores, pages, timings)
+    POST /search       {"query": ...} -> {"chunk_ids": [...]}
+    POST /answer       {"query": ...} -> {"answer": ..., "retrieval": ...}
+
+Every POST body may carry "filters", e.g. {"collection": "hr", "pages": [0, 9]},
+restricting the search as described in RAG.retrieve.
+
+Usage:
+    python rag_service.py --db data/db_file.db --port 8600
+"""
+import argparse
+import json
+import os
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RAGServer(ThreadingHTTPServer):
+    # Accept bursts of concurrent clients without refusing connections
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class RAGHandler(BaseHTTPRequestHandler):
+    rag = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/metrics':
+            data = self.rag.metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if self.path.rstrip('/') != '/health':
+            self._send_json(404, {'error': 'not found'})
+            return
+        encoder = self.rag.query_encoder
+        self._send_json(200, {'chunks': len(self.rag.index), 'encode_batches': encoder.batches,
+                              'mean_encode_batch_size': encoder.mean_batch_size})
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            query = request['query']
+            filters = request.get('filters')
+        except (ValueError, KeyError, AttributeError):
+            self._send_json(400, {'error': 'expected a JSON body with a "query"'})
+            return
+
+        path = self.path.rstrip('/')
+        try:
+            if path == '/retrieve':
+                self._send_json(200, self.rag.retrieve(query, filters))
+            elif path == '/search':
+                self._send_json(200, {'chunk_ids': self.rag.semantic_search(query, filters)})
+            elif path == '/answer':
+                retrieval = self.rag.retrieve(query, filters)
+                answer = self.rag.generate_response(query, retrieval=retrieval)
+                self._send_json(200, {'answer': answer, 'retrieval': retrieval})
+            else:
+                self._send_json(404, {'error': 'not found'})
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+
+
+def start_service(rag, host='127.0.0.1', port=0):
+    """
+    Serves a RAG instance over HTTP in a background thread.
+
+    Args:
+        rag (RAG): The shared RAG instance.
+        host (str): Interface to listen on.
+        port (int): Port to listen on, 0 picks a free port.
+
+    Returns:
+        tuple: (server, base_url). Call server.shutdown() to stop it.
+    """
+    handler = type('RAGHandler', (RAGHandler,), {'rag': rag})
+    server = RAGServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+class RAGClient:
+    """
+    Client of a RAG service, offering the retrieval methods of RAG over HTTP.
+    """
+
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _post(self, path, body):
+        request = urllib.request.Request(self.base_url + path, data=json.dumps(body).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def retrieve(self, query, filters=None):
+        result = self._post('/retrieve', {'query': query, 'filters': filters})
+        # JSON turns the (pdf_filename, page_number) tuples into lists
+        for chunk in result['chunks']:
+            chunk['pages'] = [tuple(page) for page in chunk['pages']]
+        return result
+
+    def semantic_search(self, query, filters=None):
+        return self._post('/search', {'query': query, 'filters': filters})['chunk_ids']
+
+    def generate_response(self, query, filters=None):
+        return self._post('/answer', {'query': query, 'filters': filters})['answer']
+
+    def health(self):
+        with urllib.request.urlopen(self.base_url + '/health', timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='data/db_file.db', help='Path to the SQLite database')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence transformer embedding model')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--top-k', type=int, default=3, help='Number of chunks retrieved per query')
+    parser.add_argument('--reranker', help='Cross-encoder reranking the retrieved candidates, e.g. '
+                                           'cross-encoder/ms-marco-MiniLM-L-6-v2')
+    parser.add_argument('--rerank-candidates', type=int, default=20, help='Candidates reranked per query')
+    parser.add_argument('--read-connections', type=int, default=8, help='Read-only database connections')
+    parser.add_argument('--batch-wait-ms', type=float, default=0, help='Time to wait for more queries to encode together')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from my_rag import RAG
+
+    load_dotenv()
+    rag = RAG(db_path=args.db, llm_api_key=os.getenv("OPENAI_API_KEY"), embedding_model=args.model, top_k=args.top_k,
+              read_connections=args.read_connections, query_batch_wait_ms=args.batch_wait_ms,
+              reranker_model=args.reranker, rerank_candidates=args.rerank_candidates)
+    handler = type('RAGHandler', (RAGHandler,), {'rag': rag})
+    server = RAGServer((args.host, args.port), handler)
+    print(f"RAG service listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
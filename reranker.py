@@ -0,0 +1,104 @@
+"""
+Second retrieval stage: reranking candidate chunks with a cross-encoder.
+
+The bi-encoder index is cheap enough to scan the whole corpus but judges query
+and chunk separately. A cross-encoder reads them together and ranks far better,
+at a cost per pair, so it only rescores a few dozen candidates of the first stage
+and the best of those go into the prompt. Small MS MARCO cross-encoders such as
+'cross-encoder/ms-marco-MiniLM-L-6-v2' score a batch of candidates on a CPU in
+tens of milliseconds.
+
+Scores are cached per (query, chunk text), so repeated and follow-up questions
+only score the candidates they have not seen.
+"""
+import threading
+import time
+
+import numpy as np
+
+from rag_cache import cache_key
+
+
+class Reranker:
+    """
+    Scores (query, chunk) pairs with a sentence-transformers CrossEncoder loaded on first use.
+    """
+
+    def __init__(self, model_name, cache=None, batch_size=32, max_length=512, verbose=False):
+        """
+        Args:
+            model_name (str): Name or path of the cross-encoder model.
+            cache (RAGCache): Optional cache of the scores, in its 'rerank' namespace.
+            batch_size (int): Number of pairs scored per model call.
+            max_length (int): Maximum number of tokens of a query and chunk pair; longer pairs are truncated.
+            verbose (bool): Flag to enable verbose logging for debugging.
+        """
+        self.model_name = model_name
+        self.cache = cache
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.verbose = verbose
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        """
+        The cross-encoder model, loaded on first use.
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    start = time.perf_counter()
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device='cpu')
+                    if self.verbose:
+                        print(f"Debug: loaded {self.model_name} in {time.perf_counter() - start:.1f} s")
+        return self._model
+
+    def score(self, query, texts):
+        """
+        Scores how relevant each text is to the query, using cached scores when possible.
+
+        Args:
+            query (str): The (normalized) query.
+            texts (list of str): The candidate chunk texts.
+
+        Returns:
+            np.ndarray: One float32 relevance score per text; higher is more relevant.
+        """
+        keys = [cache_key('rerank', self.model_name, query, text) for text in texts]
+        # One lookup and one write for all candidates, rather than one per pair
+        scores = self.cache.get_many('rerank', keys) if self.cache is not None else [None] * len(texts)
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            predicted = self.model.predict([(query, texts[i]) for i in missing], batch_size=self.batch_size,
+                                           show_progress_bar=False)
+            for i, score in zip(missing, np.asarray(predicted, dtype=np.float32).reshape(-1)):
+                scores[i] = float(score)
+            if self.cache is not None:
+                self.cache.put_many('rerank', [(keys[i], scores[i]) for i in missing])
+            if self.verbose:
+                print(f"Debug: reranked {len(missing)} of {len(texts)} candidates with the cross-encoder")
+        return np.asarray(scores, dtype=np.float32)
+
+    def rerank(self, query, candidates, k):
+        """
+        Orders candidates by cross-encoder score and keeps the best `k`.
+
+        Args:
+            query (str): The (normalized) query.
+            candidates (list of tuples): (chunk ID, text) pairs from the first stage.
+            k (int): Number of candidates to keep.
+
+        Returns:
+            tuple: (chunk IDs, scores) of the kept candidates, best first.
+        """
+        if not candidates:
+            return [], []
+        scores = self.score(query, [text for _, text in candidates])
+        # Stable, so ties keep the order of the first stage
+        order = np.argsort(-scores, kind='stable')[:k]
+        return [candidates[i][0] for i in order], [float(scores[i]) for i in order]
@@ -0,0 +1,179 @@
+"""
+Tests of the asynchronous, streaming language model client against the local
+stub server of benchmarks/stub_llm_server.py.
+"""
+import asyncio
+import os
+import sys
+import time
+
+import openai
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+from my_rag import RAG
+from stub_llm_server import start_stub_server
+
+PROMPT = ' '.join(f'word{i}' for i in range(40))
+
+
+@pytest.fixture
+def stub():
+    """
+    Starts a stub server on an ephemeral port; call with StubSettings arguments.
+    Returns (settings, base_url).
+    """
+    servers = []
+
+    def start(**settings):
+        server, base_url = start_stub_server(port=0, **settings)
+        servers.append(server)
+        return server.RequestHandlerClass.settings, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def make_rag(tmp_path):
+    """
+    Creates RAG instances on a temporary database, pointed at a stub server.
+    """
+    rags = []
+
+    def make(base_url, **kwargs):
+        rag = RAG(db_path=str(tmp_path / f'rag{len(rags)}.db'), llm_api_key='stub', llm_base_url=base_url,
+                  ocr_engine=None, collect_metrics=False, **kwargs)
+        rags.append(rag)
+        return rag
+
+    yield make
+    for rag in rags:
+        rag.close()
+
+
+async def collect(rag, prompt=PROMPT):
+    return [piece async for piece in rag.stream_llm(prompt)]
+
+
+def test_tokens_stream_in_order(stub, make_rag):
+    settings, base_url = stub(token_delay=0.01, answer_words=10)
+    rag = make_rag(base_url)
+
+    pieces = asyncio.run(collect(rag))
+
+    assert pieces == ['Stub'] + [' answer:'] + [f' word{i}' for i in range(30, 40)]
+    assert settings.requests == 1
+
+
+def test_answer_is_cached_after_streaming(stub, make_rag):
+    settings, base_url = stub(answer_words=5)
+    rag = make_rag(base_url)
+
+    first = asyncio.run(rag.async_integrate_llm(PROMPT))
+    second = asyncio.run(rag.async_integrate_llm(PROMPT))
+
+    assert first == second == 'Stub answer: word35 word36 word37 word38 word39'
+    assert settings.requests == 1
+
+
+def test_server_errors_are_retried(stub, make_rag):
+    settings, base_url = stub(fail_first=2, answer_words=3)
+    rag = make_rag(base_url, llm_retries=2)
+
+    pieces = asyncio.run(collect(rag))
+
+    assert ''.join(pieces) == 'Stub answer: word37 word38 word39'
+    assert settings.requests == 3
+
+
+def test_connection_errors_are_retried(stub, make_rag):
+    settings, base_url = stub(drop_first=1, answer_words=3)
+    rag = make_rag(base_url, llm_retries=1)
+
+    pieces = asyncio.run(collect(rag))
+
+    assert ''.join(pieces) == 'Stub answer: word37 word38 word39'
+    assert settings.requests == 2
+
+
+def test_retries_stop_at_llm_retries(stub, make_rag):
+    settings, base_url = stub(fail_first=6)
+    rag = make_rag(base_url, llm_retries=2)
+
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(collect(rag))
+    assert settings.requests == 3
+    # async_integrate_llm reports the failure as a missing answer
+    assert asyncio.run(rag.async_integrate_llm(PROMPT)) is None
+
+
+def test_cancelling_closes_the_stream(stub, make_rag):
+    settings, base_url = stub(token_delay=0.05, answer_words=40)
+    rag = make_rag(base_url)
+
+    async def cancel_mid_stream():
+        received = []
+        started = asyncio.Event()
+
+        async def consume():
+            async for piece in rag.stream_llm(PROMPT):
+                received.append(piece)
+                if len(received) == 3:
+                    started.set()
+
+        task = asyncio.create_task(consume())
+        await asyncio.wait_for(started.wait(), timeout=5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return received
+
+    received = asyncio.run(cancel_mid_stream())
+
+    assert 3 <= len(received) < 42
+    # The server notices the closed connection on its next write
+    deadline = time.monotonic() + 5
+    while settings.cancelled == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert settings.cancelled == 1
+    assert settings.requests == 1
+    # A cancelled answer is not cached as complete
+    assert asyncio.run(rag.async_integrate_llm(PROMPT)).endswith('word39')
+
+
+def test_llm_timeout_raises(stub, make_rag):
+    settings, base_url = stub(first_token_delay=2.0)
+    rag = make_rag(base_url, llm_timeout=0.3, llm_retries=0)
+
+    start = time.perf_counter()
+    with pytest.raises(openai.APITimeoutError):
+        asyncio.run(collect(rag))
+    assert time.perf_counter() - start < 1.5
+    assert settings.requests == 1
+
+
+def test_plain_answer_overlaps_retrieval(stub, make_rag):
+    settings, base_url = stub(answer_words=3)
+    rag = make_rag(base_url)
+    requests_during_retrieval = []
+
+    def slow_retrieve(query, filters=None):
+        time.sleep(0.3)
+        requests_during_retrieval.append(settings.requests)
+        return {'query': query, 'chunks': [], 'timings': {}, 'filters': filters}
+    rag.retrieve = slow_retrieve
+
+    retrievals = []
+    rag_text, llm_text = asyncio.run(rag.answer_concurrently(PROMPT, filters={'collection': 'manuals'},
+                                                             on_retrieval=retrievals.append))
+
+    # The plain request was sent while the RAG answer was still retrieving
+    assert requests_during_retrieval == [1]
+    assert llm_text == 'Stub answer: word37 word38 word39'
+    assert rag_text == "Sorry, I couldn't find a relevant response."
+    assert [retrieval['filters'] for retrieval in retrievals] == [{'collection': 'manuals'}]
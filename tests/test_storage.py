@@ -0,0 +1,87 @@
+"""
+Tests of how documents and vectors are stored, on temporary databases.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.append(ROOT)
+from my_rag import RAG
+from vector_store import MmapVectorStore
+
+
+@pytest.fixture
+def make_rag(tmp_path):
+    """
+    Creates RAG instances on a temporary database, without a language model server.
+    """
+    rags = []
+
+    def make(**kwargs):
+        rag = RAG(db_path=str(tmp_path / f'rag{len(rags)}.db'), llm_api_key='stub',
+                  ocr_engine=None, collect_metrics=False, **kwargs)
+        rags.append(rag)
+        return rag
+
+    yield make
+    for rag in rags:
+        rag.close()
+
+
+def store(rag, filename, collection, n_chunks=3):
+    return rag.store_chunks([(f'{filename} chunk {i}', [(filename, i + 1)]) for i in range(n_chunks)],
+                            collection=collection)
+
+
+def count_chunks(rag):
+    return rag.db.execute("SELECT COUNT(*) FROM text_chunks").fetchone()[0]
+
+
+def test_delete_with_persistent_cache(make_rag):
+    rag = make_rag(persist_cache=True)
+    store(rag, 'a.pdf', 'first')
+    store(rag, 'b.pdf', 'first')
+    store(rag, 'c.pdf', 'second')
+    rag.cache.put('search', 'query', [1, 2, 3])
+
+    assert rag.delete_document('a.pdf') == 3
+    assert rag.cache.get('search', 'query') is None
+    assert rag.delete_collection('second') == 3
+
+    # The writer transaction was committed, so another connection can write
+    assert not rag.db.in_transaction
+    rag.cache.put('search', 'query', [4])
+    rag.cache.flush()
+    assert count_chunks(rag) == 3
+
+
+def unit_vectors(rng, n, dim=384):
+    # Dimensions of different spread around a shared offset, like sentence embeddings
+    vectors = rng.normal(size=(n, dim)) * np.linspace(0.3, 2.0, dim) + rng.normal(size=dim) * 2
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def test_int8_recall_after_small_first_batch(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = unit_vectors(rng, 2000)
+    queries = vectors[rng.choice(len(vectors), 100)] + rng.normal(size=(100, vectors.shape[1])) * 0.02
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    store = MmapVectorStore(str(tmp_path / 'store'), vectors.shape[1], 'int8')
+    store.append([0], vectors[:1])
+    for start in range(1, len(vectors), 256):
+        store.append(np.arange(start, min(start + 256, len(vectors))), vectors[start:start + 256])
+
+    assert (np.abs(store.vectors) == 127).mean() < 0.001
+    exact = np.argsort(-queries @ vectors.T, axis=1)[:, :3]
+    found = [np.argsort(-store.scores(query))[:3] for query in queries]
+    recall = np.mean([len(set(a) & set(b)) / 3 for a, b in zip(exact, found)])
+    assert recall >= 0.9
+
+    # The widened scale is persisted with the rows it was applied to
+    reloaded = MmapVectorStore(str(tmp_path / 'store'), vectors.shape[1], 'int8')
+    assert reloaded.load()
+    assert np.allclose(reloaded.scores(queries[0]), store.scores(queries[0]))
@@ -0,0 +1,787 @@
+import hashlib
+import os
+import re
+import numpy as np
+from vector_store import MmapVectorStore
+
+# Collection of documents ingested without naming one, and of databases created before collections
+DEFAULT_COLLECTION = 'default'
+
+
+def top_k_rows(scores, k):
+    """
+    Returns the positions of the k highest scores, best first.
+
+    Args:
+        scores (np.ndarray): 1-D array of similarity scores.
+        k (int): Number of positions to return.
+
+    Returns:
+        np.ndarray: Positions into `scores` sorted by decreasing score.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    rows = np.argpartition(-scores, k - 1)[:k]
+    return rows[np.argsort(-scores[rows])]
+
+
+def lookup_rows(all_ids, order, ids):
+    """
+    Finds the row positions of chunk IDs.
+
+    Args:
+        all_ids (np.ndarray): The chunk ID of every row.
+        order (np.ndarray): argsort of `all_ids`.
+        ids (array-like of int): The chunk IDs to look up.
+
+    Returns:
+        tuple: (rows, found) where `found` marks the IDs present in the index and
+            `rows` holds the row position of each of them.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(all_ids) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(all_ids, ids, sorter=order), len(all_ids) - 1)
+    rows = order[positions]
+    found = all_ids[rows] == ids
+    return rows[found], found
+
+
+class FlatIndex:
+    """
+    Exact brute-force index over a resident, pre-normalized float32 matrix.
+    Every search scores all vectors with one matrix-vector product.
+
+    Vectors are kept in a buffer that grows geometrically, so that adding many small
+    batches during ingestion copies each vector a constant number of times on average.
+    """
+
+    def __init__(self, dim):
+        """
+        Args:
+            dim (int): Dimension of the embedding vectors.
+        """
+        self.dim = dim
+        self.reset()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def search_params(self):
+        """
+        The settings search results depend on.
+        """
+        return ('flat',)
+
+    @property
+    def vectors(self):
+        """
+        The used rows of the vector buffer.
+        """
+        return self._vectors[:self._size]
+
+    @property
+    def ids(self):
+        """
+        The chunk ID of every used row.
+        """
+        return self._ids[:self._size]
+
+    def reset(self):
+        """
+        Removes all vectors from the index.
+        """
+        self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._size = 0
+        self._id_order = None
+
+    def add(self, ids, vectors):
+        """
+        Adds normalized vectors to the index.
+
+        Args:
+            ids (array-like of int): Chunk IDs of the vectors.
+            vectors (np.ndarray): Matrix of unit-length float32 vectors, one row per ID.
+        """
+        if len(ids) == 0:
+            return
+        size = self._size + len(ids)
+        if size > len(self._ids):
+            capacity = max(size, 2 * len(self._ids), 1024)
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[:self._size] = self.vectors
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_ids[:self._size] = self.ids
+            self._vectors, self._ids = grown, grown_ids
+        self._vectors[self._size:size] = np.asarray(vectors, dtype=np.float32)
+        self._ids[self._size:size] = np.asarray(ids, dtype=np.int64)
+        self._size = size
+        self._id_order = None
+
+    def remove(self, ids):
+        """
+        Removes the vectors of the given chunk IDs.
+
+        Returns:
+            int: Number of vectors removed.
+        """
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        n_removed = len(keep) - int(keep.sum())
+        if n_removed:
+            # Compacted in place; the buffer keeps its capacity
+            size = self._size - n_removed
+            self._vectors[:size] = self.vectors[keep]
+            self._ids[:size] = self.ids[keep]
+            self._size = size
+            self._id_order = None
+        return n_removed
+
+    def score_ids(self, query, ids):
+        """
+        Scores only the given chunks, e.g. the candidates of a lexical prefilter.
+
+        Args:
+            query (np.ndarray): Unit-length query vector.
+            ids (array-like of int): Chunk IDs to score.
+
+        Returns:
+            tuple: (ids, scores) for the IDs present in the index, in the given order.
+        """
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind='stable')
+        rows, found = lookup_rows(self.ids, self._id_order, ids)
+        return np.asarray(ids, dtype=np.int64)[found], self.vectors[rows] @ query
+
+    def search(self, query, k):
+        """
+        Finds the k vectors most similar to the query.
+
+        Args:
+            query (np.ndarray): Unit-length query vector.
+            k (int): Number of results.
+
+        Returns:
+            tuple: (ids, scores) arrays sorted by decreasing cosine similarity.
+        """
+        if self._size == 0:
+            return self.ids, np.zeros(0, dtype=np.float32)
+        scores = self.vectors @ query
+        rows = top_k_rows(scores, k)
+        return self.ids[rows], scores[rows]
+
+    def search_batch(self, queries, k, block_size=256):
+        """
+        Searches many queries with one matrix multiply per block of queries.
+
+        Args:
+            queries (np.ndarray): Matrix of unit-length query vectors, one per row.
+            k (int): Number of results per query.
+            block_size (int): Number of queries scored together, bounding the score matrix size.
+
+        Returns:
+            list of tuples: (ids, scores) for each query.
+        """
+        results = []
+        for start in range(0, len(queries), block_size):
+            scores = queries[start:start + block_size] @ self.vectors.T
+            for row_scores in scores:
+                rows = top_k_rows(row_scores, k)
+                results.append((self.ids[rows], row_scores[rows]))
+        return results
+
+    def save(self, path):
+        """
+        The flat index is rebuilt from the database, so nothing is persisted.
+        """
+        pass
+
+    def load(self, path):
+        """
+        The flat index is rebuilt from the database, so there is nothing to load.
+
+        Returns:
+            bool: Always False.
+        """
+        return False
+
+
+class IVFFlatIndex:
+    """
+    Approximate inverted-file index. Vectors are partitioned into `n_lists` clusters
+    by spherical k-means and a search only scans the `nprobe` clusters whose centroids
+    are closest to the query. Raising `nprobe` trades latency for recall.
+
+    Until enough vectors have been added to train the coarse quantizer, searches fall
+    back to an exact scan. Vectors added after training are kept in a small pending
+    buffer that is scanned exactly and merged into the lists once it grows.
+    """
+
+    def __init__(self, dim, n_lists=None, nprobe=8, min_train_size=1024, kmeans_iters=20, seed=0):
+        """
+        Args:
+            dim (int): Dimension of the embedding vectors.
+            n_lists (int): Number of clusters. Defaults to about 4 * sqrt(N) at training time.
+            nprobe (int): Number of clusters scanned per query.
+            min_train_size (int): Number of vectors needed before the quantizer is trained.
+            kmeans_iters (int): Number of k-means iterations when training.
+            seed (int): Random seed for k-means initialization.
+        """
+        self.dim = dim
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iters = kmeans_iters
+        self.seed = seed
+        self.reset()
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending_ids)
+
+    @property
+    def search_params(self):
+        """
+        The settings search results depend on.
+        """
+        return ('ivf', self.n_lists, self.nprobe)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def reset(self):
+        """
+        Removes all vectors and the trained quantizer.
+        """
+        self.centroids = None
+        # Vectors grouped by list: list i occupies rows offsets[i]:offsets[i + 1]
+        self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.trained_size = 0
+        # Vectors not yet assigned to a list
+        self.pending_vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.pending_ids = np.zeros(0, dtype=np.int64)
+        self._id_order = None
+
+    def add(self, ids, vectors):
+        """
+        Adds normalized vectors to the index, training or re-training the quantizer
+        when the index has grown enough.
+
+        Args:
+            ids (array-like of int): Chunk IDs of the vectors.
+            vectors (np.ndarray): Matrix of unit-length float32 vectors, one row per ID.
+        """
+        if len(ids) == 0:
+            return
+        self.pending_vectors = np.vstack([self.pending_vectors, np.asarray(vectors, dtype=np.float32)])
+        self.pending_ids = np.concatenate([self.pending_ids, np.asarray(ids, dtype=np.int64)])
+        self._id_order = None
+
+        total = len(self)
+        if not self.is_trained:
+            if total >= self.min_train_size:
+                self.train()
+        elif total >= 4 * self.trained_size:
+            self.train()
+        elif len(self.pending_ids) > max(1024, len(self.ids) // 10):
+            self._merge_pending()
+
+    def remove(self, ids):
+        """
+        Removes the vectors of the given chunk IDs from the lists and the pending buffer.
+        The quantizer is kept; it is retrained once the index grows again.
+
+        Returns:
+            int: Number of vectors removed.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        keep = ~np.isin(self.ids, ids)
+        keep_pending = ~np.isin(self.pending_ids, ids)
+        n_removed = len(keep) - int(keep.sum()) + len(keep_pending) - int(keep_pending.sum())
+        if n_removed:
+            list_of_row = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+            counts = np.bincount(list_of_row[keep], minlength=len(self.offsets) - 1)
+            self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            self.vectors = self.vectors[keep]
+            self.ids = self.ids[keep]
+            self.pending_vectors = self.pending_vectors[keep_pending]
+            self.pending_ids = self.pending_ids[keep_pending]
+            self._id_order = None
+        return n_removed
+
+    def train(self):
+        """
+        Runs spherical k-means over all vectors and rebuilds the inverted lists.
+        """
+        vectors = np.vstack([self.vectors, self.pending_vectors])
+        ids = np.concatenate([self.ids, self.pending_ids])
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(len(ids))))
+        n_lists = min(n_lists, len(ids))
+
+        self.centroids = self._kmeans(vectors, n_lists)
+        self.trained_size = len(ids)
+        self._build_lists(vectors, ids)
+
+    def _kmeans(self, vectors, n_lists):
+        """
+        Spherical k-means on (a sample of) the vectors.
+
+        Returns:
+            np.ndarray: Unit-length centroids, one row per list.
+        """
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(vectors), 256 * n_lists)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(self.kmeans_iters):
+            assignment = self._assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            # Sum the members of each cluster with one segmented reduction
+            order = np.argsort(assignment, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            nonempty = counts > 0
+            sums[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+            # Re-seed empty clusters with random sample points
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = sums / norms
+
+        return centroids.astype(np.float32)
+
+    @staticmethod
+    def _assign(vectors, centroids, block_size=65536):
+        """
+        Assigns each vector to its most similar centroid, in blocks to bound memory.
+        """
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_size):
+            block = vectors[start:start + block_size]
+            assignment[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+        return assignment
+
+    def _build_lists(self, vectors, ids):
+        """
+        Groups vectors contiguously by their assigned list.
+        """
+        assignment = self._assign(vectors, self.centroids)
+        order = np.argsort(assignment, kind='stable')
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.ids = ids[order]
+        counts = np.bincount(assignment, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._id_order = None
+        self.pending_vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.pending_ids = np.zeros(0, dtype=np.int64)
+
+    def _merge_pending(self):
+        """
+        Assigns pending vectors to their lists using the existing centroids.
+        """
+        self._build_lists(np.vstack([self.vectors, self.pending_vectors]),
+                          np.concatenate([self.ids, self.pending_ids]))
+
+    def search(self, query, k, nprobe=None):
+        """
+        Finds approximately the k vectors most similar to the query.
+
+        Args:
+            query (np.ndarray): Unit-length query vector.
+            k (int): Number of results.
+            nprobe (int): Overrides the number of lists scanned for this query.
+
+        Returns:
+            tuple: (ids, scores) arrays sorted by decreasing cosine similarity.
+        """
+        if not self.is_trained:
+            candidates = [(self.pending_ids, self.pending_vectors @ query)]
+        else:
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            probes = top_k_rows(self.centroids @ query, nprobe)
+            candidates = [(self.pending_ids, self.pending_vectors @ query)]
+            for list_no in probes:
+                start, end = self.offsets[list_no], self.offsets[list_no + 1]
+                if end > start:
+                    candidates.append((self.ids[start:end], self.vectors[start:end] @ query))
+
+        ids = np.concatenate([c[0] for c in candidates])
+        scores = np.concatenate([c[1] for c in candidates])
+        rows = top_k_rows(scores, k)
+        return ids[rows], scores[rows]
+
+    def score_ids(self, query, ids):
+        """
+        Scores only the given chunks exactly, whichever list they are in.
+
+        Returns:
+            tuple: (ids, scores) for the IDs present in the index, in the given order.
+        """
+        all_ids = np.concatenate([self.ids, self.pending_ids])
+        if self._id_order is None or len(self._id_order) != len(all_ids):
+            self._id_order = np.argsort(all_ids, kind='stable')
+        rows, found = lookup_rows(all_ids, self._id_order, ids)
+        in_lists = rows < len(self.ids)
+        scores = np.empty(len(rows), dtype=np.float32)
+        scores[in_lists] = self.vectors[rows[in_lists]] @ query
+        scores[~in_lists] = self.pending_vectors[rows[~in_lists] - len(self.ids)] @ query
+        return np.asarray(ids, dtype=np.int64)[found], scores
+
+    def search_batch(self, queries, k, nprobe=None):
+        """
+        Searches many queries. Each query probes different lists, so they are searched one by one.
+
+        Returns:
+            list of tuples: (ids, scores) for each query.
+        """
+        return [self.search(query, k, nprobe) for query in queries]
+
+    def save(self, path):
+        """
+        Persists the index to an .npz file.
+
+        Args:
+            path (str): Destination file path.
+        """
+        if len(self) == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        np.savez(path,
+                 centroids=self.centroids if self.is_trained else np.zeros((0, self.dim), dtype=np.float32),
+                 vectors=self.vectors, ids=self.ids, offsets=self.offsets,
+                 pending_vectors=self.pending_vectors, pending_ids=self.pending_ids,
+                 trained_size=np.int64(self.trained_size))
+
+    def load(self, path):
+        """
+        Loads a persisted index.
+
+        Args:
+            path (str): File written by `save`.
+
+        Returns:
+            bool: True if the index was loaded, False if the file is missing or unusable.
+        """
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                if data['vectors'].shape[1] != self.dim:
+                    return False
+                centroids = data['centroids']
+                self.centroids = centroids if len(centroids) else None
+                self.vectors = data['vectors']
+                self.ids = data['ids']
+                self.offsets = data['offsets']
+                self.pending_vectors = data['pending_vectors']
+                self.pending_ids = data['pending_ids']
+                self.trained_size = int(data['trained_size'])
+                self._id_order = None
+        except (OSError, KeyError, ValueError):
+            self.reset()
+            return False
+        return True
+
+
+class MmapFlatIndex:
+    """
+    Exact-ish brute-force index over a memory-mapped, optionally quantized vector file.
+
+    The whole file is scanned with the quantized vectors, then the best
+    `oversample * k` candidates are rescored with their exact float32 embeddings,
+    fetched through the `rescore` callback, before the final top k is chosen.
+    """
+
+    def __init__(self, dim, base_path, dtype='float16', rescore=None, oversample=4):
+        """
+        Args:
+            dim (int): Dimension of the embedding vectors.
+            base_path (str): Path prefix of the vector store files.
+            dtype (str): Storage type of the vectors, 'float32', 'float16' or 'int8'.
+            rescore (callable): Function mapping a list of chunk IDs to their normalized
+                float32 embeddings; None skips rescoring.
+            oversample (int): Number of candidates rescored per requested result.
+        """
+        self.dim = dim
+        self.store = MmapVectorStore(base_path, dim, dtype)
+        self.rescore = rescore if dtype != 'float32' else None
+        self.oversample = oversample
+        self._id_order = None
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def search_params(self):
+        """
+        The settings search results depend on.
+        """
+        return ('mmap', self.store.dtype, self.oversample if self.rescore is not None else None)
+
+    @property
+    def ids(self):
+        return self.store.ids
+
+    def reset(self):
+        self.store.reset()
+        self._id_order = None
+
+    def add(self, ids, vectors):
+        self.store.append(ids, vectors)
+        self._id_order = None
+
+    def remove(self, ids):
+        self._id_order = None
+        return self.store.remove(ids)
+
+    def score_ids(self, query, ids):
+        """
+        Scores only the given chunks with the stored (possibly quantized) vectors.
+
+        Returns:
+            tuple: (ids, scores) for the IDs present in the index, in the given order.
+        """
+        if self._id_order is None:
+            self._id_order = np.argsort(self.store.ids, kind='stable')
+        rows, found = lookup_rows(self.store.ids, self._id_order, ids)
+        return np.asarray(ids, dtype=np.int64)[found], self.store.scores(query, rows)
+
+    def search(self, query, k):
+        """
+        Finds the k vectors most similar to the query.
+
+        Returns:
+            tuple: (ids, scores) arrays sorted by decreasing cosine similarity.
+        """
+        if len(self.store) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = self.store.scores(query)
+        n_candidates = k * self.oversample if self.rescore is not None else k
+        rows = top_k_rows(scores, n_candidates)
+        ids = np.asarray(self.store.ids[rows])
+        scores = scores[rows]
+
+        if self.rescore is not None:
+            scores = self.rescore(ids.tolist()) @ query
+            rows = top_k_rows(scores, k)
+            ids, scores = ids[rows], scores[rows]
+        return ids, scores
+
+    def search_batch(self, queries, k):
+        return [self.search(query, k) for query in queries]
+
+    def save(self, path):
+        """
+        Every append is already written to the vector file.
+        """
+        pass
+
+    def load(self, path):
+        """
+        Maps the vector store files.
+
+        Returns:
+            bool: True if a compatible store exists.
+        """
+        self._id_order = None
+        return self.store.load()
+
+
+def collection_path(path, collection):
+    """
+    Derives the file path of a collection's index from the path of the default collection.
+
+    Args:
+        path (str): Path (or path prefix) of the default collection's index, e.g. 'data/db_file.ivf.npz'.
+        collection (str): Name of the collection.
+
+    Returns:
+        str: `path` for the default collection, otherwise the path with a readable and
+            unique collection suffix before its extension, e.g. 'data/db_file.ivf.c-hr-1f3a9c2e.npz'.
+    """
+    if collection == DEFAULT_COLLECTION:
+        return path
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '_', collection)[:40]
+    digest = hashlib.sha1(collection.encode('utf-8')).hexdigest()[:8]
+    root, ext = os.path.splitext(path)
+    return f'{root}.c-{slug}-{digest}{ext}'
+
+
+class CollectionIndex:
+    """
+    One vector index per collection of documents.
+
+    A search scoped to some collections only scans their indexes, so its cost grows
+    with the size of those collections rather than with the whole corpus. Unscoped
+    searches merge the results of every collection.
+    """
+
+    def __init__(self, dim, factory):
+        """
+        Args:
+            dim (int): Dimension of the embedding vectors.
+            factory (callable): Function mapping a collection name to a new, empty index of that collection.
+        """
+        self.dim = dim
+        self.factory = factory
+        self.indexes = {}
+
+    def __len__(self):
+        return sum(len(index) for index in self.indexes.values())
+
+    @property
+    def collections(self):
+        return sorted(self.indexes)
+
+    @property
+    def search_params(self):
+        """
+        The settings search results depend on, of every collection's index.
+        """
+        return tuple((name, self.indexes[name].search_params) for name in sorted(self.indexes))
+
+    def collection(self, name):
+        """
+        Returns the index of a collection, creating it if needed.
+        """
+        index = self.indexes.get(name)
+        if index is None:
+            index = self.indexes[name] = self.factory(name)
+        return index
+
+    def _selected(self, collections):
+        if collections is None:
+            return list(self.indexes.values())
+        return [self.indexes[name] for name in collections if name in self.indexes]
+
+    def size(self, collections=None):
+        """
+        Returns the number of vectors in some collections, all by default.
+        """
+        return sum(len(index) for index in self._selected(collections))
+
+    def reset(self):
+        """
+        Removes all vectors from every collection.
+        """
+        for index in self.indexes.values():
+            index.reset()
+
+    def add(self, ids, vectors, collection=DEFAULT_COLLECTION):
+        """
+        Adds normalized vectors to the index of a collection.
+
+        Args:
+            ids (array-like of int): Chunk IDs of the vectors.
+            vectors (np.ndarray): Matrix of unit-length float32 vectors, one row per ID.
+            collection (str): Name of the collection the chunks belong to.
+        """
+        if len(ids) == 0:
+            return
+        self.collection(collection).add(ids, vectors)
+
+    def remove(self, ids):
+        """
+        Removes the vectors of the given chunk IDs from whichever collection holds them.
+
+        Returns:
+            int: Number of vectors removed.
+        """
+        return sum(index.remove(ids) for index in self.indexes.values())
+
+    def score_ids(self, query, ids):
+        """
+        Scores only the given chunks, in any collection.
+
+        Returns:
+            tuple: (ids, scores) for the IDs present in the index, grouped by collection.
+        """
+        results = [index.score_ids(query, ids) for index in self.indexes.values() if len(index)] if len(ids) else []
+        if not results:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return (np.concatenate([found for found, _ in results]),
+                np.concatenate([scores for _, scores in results]).astype(np.float32))
+
+    @staticmethod
+    def _merge(results, k):
+        ids = np.concatenate([found for found, _ in results])
+        scores = np.concatenate([scores for _, scores in results]).astype(np.float32)
+        rows = top_k_rows(scores, k)
+        return ids[rows], scores[rows]
+
+    def search(self, query, k, collections=None):
+        """
+        Finds the k vectors most similar to the query in some collections.
+
+        Args:
+            query (np.ndarray): Unit-length query vector.
+            k (int): Number of results.
+            collections (list of str): Collections to search, all if None.
+
+        Returns:
+            tuple: (ids, scores) arrays sorted by decreasing cosine similarity.
+        """
+        indexes = [index for index in self._selected(collections) if len(index)]
+        if not indexes:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if len(indexes) == 1:
+            return indexes[0].search(query, k)
+        return self._merge([index.search(query, k) for index in indexes], k)
+
+    def search_batch(self, queries, k, collections=None):
+        """
+        Searches many queries in some collections, batched within each collection.
+
+        Returns:
+            list of tuples: (ids, scores) for each query.
+        """
+        indexes = [index for index in self._selected(collections) if len(index)]
+        if not indexes:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+        if len(indexes) == 1:
+            return indexes[0].search_batch(queries, k)
+        per_index = [index.search_batch(queries, k) for index in indexes]
+        return [self._merge(results, k) for results in zip(*per_index)]
+
+    def save(self, path):
+        """
+        Persists every collection's index, see `collection_path`.
+
+        Args:
+            path (str): Path of the default collection's index.
+        """
+        for name, index in self.indexes.items():
+            index.save(collection_path(path, name))
+
+
+INDEX_TYPES = {
+    'flat': FlatIndex,
+    'ivf': IVFFlatIndex,
+}
+
+
+def create_index(index_type, dim, **params):
+    """
+    Creates a vector index by name.
+
+    Args:
+        index_type (str): One of 'flat' (exact) or 'ivf' (approximate).
+        dim (int): Dimension of the embedding vectors.
+        **params: Index specific parameters such as `nprobe` or `n_lists`.
+
+    Returns:
+        FlatIndex or IVFFlatIndex: The new, empty index.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {sorted(INDEX_TYPES)}")
+    if index_type == 'flat':
+        return FlatIndex(dim)
+    return INDEX_TYPES[index_type](dim, **params)
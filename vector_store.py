@@ -0,0 +1,292 @@
+"""
+Compact, memory-mapped storage for normalized embedding vectors.
+
+Vectors live in one contiguous raw file addressed by row, optionally quantized to
+float16 or to int8 with a per-dimension scale, next to a file with the chunk id of
+each row and a small JSON metadata file. Readers map the files read-only, so the OS
+pages vectors in lazily and several processes share one page-cached copy.
+
+Usage (migrate the embeddings of an existing database):
+    python vector_store.py --db data/db_file.db --dtype int8
+"""
+import argparse
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+DTYPES = ('float32', 'float16', 'int8')
+# int8 scales leave room for values up to this factor beyond the largest seen so far
+SCALE_HEADROOM = 2.0
+
+
+class MmapVectorStore:
+    """
+    Append-only vector file with optional float16 or int8 quantization.
+    """
+
+    def __init__(self, base_path, dim, dtype='float16'):
+        """
+        Args:
+            base_path (str): Path prefix of the store files (<base>.vectors, <base>.ids, <base>.vectors.json).
+            dim (int): Dimension of the vectors.
+            dtype (str): Storage type, 'float32', 'float16' or 'int8'.
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown vector dtype '{dtype}', expected one of {DTYPES}")
+        self.vectors_path = base_path + '.vectors'
+        self.ids_path = base_path + '.ids'
+        self.meta_path = base_path + '.vectors.json'
+        self.dim = dim
+        self.dtype = dtype
+        self.count = 0
+        self.scale = None
+        self.vectors = None
+        self.ids = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def row_bytes(self):
+        return self.dim * np.dtype(self.dtype).itemsize
+
+    def load(self):
+        """
+        Maps existing store files.
+
+        Returns:
+            bool: True if a compatible store was found.
+        """
+        if not os.path.exists(self.meta_path):
+            return False
+        with open(self.meta_path, 'r') as meta_file:
+            meta = json.load(meta_file)
+        if meta['dim'] != self.dim or meta['dtype'] != self.dtype:
+            return False
+        # Files of an interrupted rewrite do not match the recorded count
+        if (not os.path.exists(self.vectors_path) or not os.path.exists(self.ids_path)
+                or os.path.getsize(self.vectors_path) < meta['count'] * self.row_bytes
+                or os.path.getsize(self.ids_path) < meta['count'] * 8):
+            return False
+        self.count = meta['count']
+        self.scale = np.asarray(meta['scale'], dtype=np.float32) if meta.get('scale') is not None else None
+        self._map()
+        return True
+
+    def _map(self):
+        """
+        Memory-maps the first `count` rows read-only.
+        """
+        if self.count == 0:
+            self.vectors = np.zeros((0, self.dim), dtype=self.dtype)
+            self.ids = np.zeros(0, dtype=np.int64)
+            return
+        self.vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(self.count, self.dim))
+        self.ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(self.count,))
+
+    def _write_meta(self):
+        """
+        Atomically records the number of valid rows; rows past it are ignored.
+        """
+        meta = {'dim': self.dim, 'dtype': self.dtype, 'count': self.count,
+                'scale': self.scale.tolist() if self.scale is not None else None}
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_path, self.meta_path)
+
+    def _quantize(self, vectors):
+        if self.dtype == 'float32':
+            return vectors.astype(np.float32)
+        if self.dtype == 'float16':
+            return vectors.astype(np.float16)
+        # Components of unit vectors lie in [-1, 1], which bounds every scale
+        needed = (np.minimum(np.abs(vectors).max(axis=0), 1.0) / 127.0).astype(np.float32)
+        widened = np.clip(needed * SCALE_HEADROOM, 1e-6 / 127.0, 1.0 / 127.0).astype(np.float32)
+        if self.scale is None:
+            self.scale = widened
+        elif (needed > self.scale).any():
+            # Values beyond the scale would be clipped; widen it and requantize the stored rows.
+            # Every dimension gets its headroom back, so one rewrite covers the near misses too
+            self._requantize(np.maximum(self.scale, widened))
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def _requantize(self, scale, block_size=65536):
+        """
+        Rewrites the stored int8 rows for a wider per-dimension scale, one block at a time.
+        """
+        if self.count:
+            ratio = self.scale / scale
+            with open(self.vectors_path + '.tmp', 'wb') as out:
+                for start in range(0, self.count, block_size):
+                    block = self.vectors[start:start + block_size].astype(np.float32) * ratio
+                    out.write(np.rint(block).astype(np.int8).tobytes())
+            # Release the maps before replacing the file
+            self.vectors = None
+            self.ids = None
+            os.replace(self.vectors_path + '.tmp', self.vectors_path)
+        self.scale = scale
+        self._write_meta()
+        self._map()
+
+    def append(self, ids, vectors):
+        """
+        Appends normalized float32 vectors and their chunk ids.
+        """
+        if len(ids) == 0:
+            return
+        data = self._quantize(np.asarray(vectors, dtype=np.float32))
+        ids = np.asarray(ids, dtype=np.int64)
+
+        # Release the maps before growing the files
+        self.vectors = None
+        self.ids = None
+        for path, row_bytes, block in ((self.vectors_path, self.row_bytes, data), (self.ids_path, 8, ids)):
+            with open(path, 'ab') as out:
+                # Drop rows left behind by an interrupted append
+                out.truncate(self.count * row_bytes)
+                out.write(np.ascontiguousarray(block).tobytes())
+        self.count += len(ids)
+        self._write_meta()
+        self._map()
+
+    def remove(self, ids, block_size=65536):
+        """
+        Removes the vectors of the given chunk IDs by rewriting the files without them,
+        one block at a time, and swapping them in atomically.
+
+        Returns:
+            int: Number of vectors removed.
+        """
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        n_removed = len(keep) - int(keep.sum())
+        if n_removed == 0:
+            return 0
+
+        for path, rows in ((self.vectors_path, self.vectors), (self.ids_path, self.ids)):
+            with open(path + '.tmp', 'wb') as out:
+                for start in range(0, self.count, block_size):
+                    block = rows[start:start + block_size]
+                    out.write(np.ascontiguousarray(block[keep[start:start + block_size]]).tobytes())
+        # Release the maps before replacing the files
+        self.vectors = None
+        self.ids = None
+        os.replace(self.vectors_path + '.tmp', self.vectors_path)
+        os.replace(self.ids_path + '.tmp', self.ids_path)
+        self.count -= n_removed
+        self._write_meta()
+        self._map()
+        return n_removed
+
+    def reset(self):
+        """
+        Removes all vectors.
+        """
+        self.vectors = None
+        self.ids = None
+        for path in (self.vectors_path, self.ids_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.count = 0
+        self.scale = None
+        self._map()
+
+    def scores(self, query, rows=None, block_size=65536):
+        """
+        Approximate cosine similarity of the query with stored vectors, computed in
+        blocks so only one block is dequantized at a time.
+
+        Args:
+            query (np.ndarray): Unit-length float32 query vector.
+            rows (np.ndarray): Optional row positions to score instead of all rows.
+            block_size (int): Number of rows dequantized at once.
+
+        Returns:
+            np.ndarray: float32 scores, one per scored row.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.dtype == 'int8':
+            query = query * self.scale
+        n = self.count if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, block_size):
+            if rows is None:
+                block = self.vectors[start:start + block_size]
+            else:
+                block = self.vectors[rows[start:start + block_size]]
+            scores[start:start + block_size] = block.astype(np.float32) @ query
+        return scores
+
+
+def migrate(db_path, dtype='float16', base_path=None, batch_size=10000):
+    """
+    Writes the float32 embeddings stored in a RAG database to vector stores, one per
+    collection at the path RAG opens it from (see `vector_index.collection_path`).
+
+    Args:
+        db_path (str): Path to the SQLite database.
+        dtype (str): Storage type of the new stores.
+        base_path (str): Path prefix of the default collection's store files, defaults to
+            the database path without extension.
+        batch_size (int): Number of embeddings read per batch.
+
+    Returns:
+        dict: The new MmapVectorStore of each collection, by name; empty without embeddings.
+    """
+    from vector_index import collection_path, DEFAULT_COLLECTION
+
+    base_path = base_path or os.path.splitext(db_path)[0]
+    db = sqlite3.connect(db_path)
+    cursor = db.cursor()
+    # Chunks of databases created before collections belong to the default collection
+    has_collections = 'collection' in [row[1] for row in cursor.execute("PRAGMA table_info(text_chunks)")]
+    collections = [DEFAULT_COLLECTION]
+    if has_collections:
+        collections = [row[0] for row in cursor.execute("SELECT DISTINCT collection FROM text_chunks")]
+
+    stores = {}
+    for collection in collections:
+        if has_collections:
+            cursor.execute("""
+                SELECT e.chunk_id, e.embedding FROM embeddings e JOIN text_chunks t ON t.id = e.chunk_id
+                WHERE t.collection = ? ORDER BY e.rowid
+            """, (collection,))
+        else:
+            cursor.execute("SELECT chunk_id, embedding FROM embeddings ORDER BY rowid")
+        store = None
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            vectors = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            if store is None:
+                store = MmapVectorStore(collection_path(base_path, collection), vectors.shape[1], dtype)
+                store.reset()
+            store.append([row[0] for row in rows], vectors / norms)
+        if store is not None:
+            stores[collection] = store
+    db.close()
+    return stores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='data/db_file.db', help='Path to the SQLite database')
+    parser.add_argument('--dtype', default='float16', choices=DTYPES, help='Storage type of the vectors')
+    args = parser.parse_args()
+
+    stores = migrate(args.db, args.dtype)
+    if not stores:
+        print("No embeddings found, nothing to migrate")
+    for collection, store in stores.items():
+        size_mb = os.path.getsize(store.vectors_path) / 1e6
+        print(f"Wrote {len(store)} vectors of collection '{collection}' ({args.dtype}, {size_mb:.1f} MB) "
+              f"to {store.vectors_path}")
+
+
+if __name__ == '__main__':
+    main()